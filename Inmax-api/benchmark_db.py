@@ -0,0 +1,61 @@
+"""
+Benchmark: cliente Mongo nuevo por petición vs. cliente compartido.
+
+Ejecuta la misma consulta que /test-db contra un mongod local y reporta
+peticiones por segundo en ambos modos.
+
+Uso:
+    MONGO_URI=mongodb://localhost:27017/ python benchmark_db.py [peticiones] [concurrencia]
+"""
+import asyncio
+import sys
+import time
+
+from pymongo import MongoClient
+
+import db
+
+PETICIONES = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+CONCURRENCIA = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+
+def consulta_cliente_nuevo():
+    # Comportamiento anterior de get_db(): un MongoClient por petición
+    cliente = MongoClient(db.MONGO_URI)
+    try:
+        return list(cliente[db.MONGO_DB]["test"].find({}, {"_id": 0}))
+    finally:
+        cliente.close()
+
+
+async def consulta_cliente_compartido():
+    return await db.get_db_async()["test"].find({}, {"_id": 0}).to_list(length=None)
+
+
+async def medir(nombre, fabrica):
+    semaforo = asyncio.Semaphore(CONCURRENCIA)
+
+    async def una():
+        async with semaforo:
+            await fabrica()
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(una() for _ in range(PETICIONES)))
+    duracion = time.perf_counter() - inicio
+    print(f"{nombre:<28} {PETICIONES / duracion:10.1f} req/s  ({duracion:.2f} s)")
+
+
+async def main():
+    db.conectar()
+    coleccion = db.get_db()["test"]
+    if coleccion.count_documents({}) == 0:
+        coleccion.insert_one({"mensaje": "Hola desde Mongo!"})
+
+    # El modo anterior corre en hilos porque pymongo es bloqueante
+    await medir("cliente nuevo por petición", lambda: asyncio.to_thread(consulta_cliente_nuevo))
+    await medir("cliente compartido (motor)", consulta_cliente_compartido)
+    db.cerrar()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
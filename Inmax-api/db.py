@@ -1,5 +1,68 @@
+import os
+
 from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+
+# ---------------------------------------------------
+# Configuración (variables de entorno con valores por defecto)
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://mongo:27017/")
+MONGO_DB = os.getenv("MONGO_DB", "inmax")
+MONGO_MAX_POOL = int(os.getenv("MONGO_MAX_POOL", "100"))
+MONGO_MIN_POOL = int(os.getenv("MONGO_MIN_POOL", "0"))
+MONGO_TIMEOUT_SELECCION_MS = int(os.getenv("MONGO_TIMEOUT_SELECCION_MS", "5000"))
+MONGO_TIMEOUT_CONEXION_MS = int(os.getenv("MONGO_TIMEOUT_CONEXION_MS", "5000"))
+MONGO_TIMEOUT_SOCKET_MS = int(os.getenv("MONGO_TIMEOUT_SOCKET_MS", "10000"))
+MONGO_TIMEOUT_COLA_MS = int(os.getenv("MONGO_TIMEOUT_COLA_MS", "2000"))
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primaryPreferred")
+
+# Clientes compartidos por todo el proceso (uno síncrono y uno asíncrono)
+_cliente = None
+_cliente_async = None
+
+
+def _opciones_cliente():
+    return {
+        "maxPoolSize": MONGO_MAX_POOL,
+        "minPoolSize": MONGO_MIN_POOL,
+        "serverSelectionTimeoutMS": MONGO_TIMEOUT_SELECCION_MS,
+        "connectTimeoutMS": MONGO_TIMEOUT_CONEXION_MS,
+        "socketTimeoutMS": MONGO_TIMEOUT_SOCKET_MS,
+        "waitQueueTimeoutMS": MONGO_TIMEOUT_COLA_MS,
+        "readPreference": MONGO_READ_PREFERENCE,
+    }
+
+
+def conectar():
+    """
+    Crea los clientes compartidos. Se llama una sola vez desde el lifespan de FastAPI.
+    """
+    global _cliente, _cliente_async
+    if _cliente is None:
+        _cliente = MongoClient(MONGO_URI, **_opciones_cliente())
+    if _cliente_async is None:
+        _cliente_async = AsyncIOMotorClient(MONGO_URI, **_opciones_cliente())
+
+
+def cerrar():
+    """
+    Cierra los clientes compartidos y libera el pool de conexiones.
+    """
+    global _cliente, _cliente_async
+    if _cliente is not None:
+        _cliente.close()
+        _cliente = None
+    if _cliente_async is not None:
+        _cliente_async.close()
+        _cliente_async = None
+
 
 def get_db():
-    client = MongoClient("mongodb://mongo:27017/")
-    return client["inmax"]
+    if _cliente is None:
+        conectar()
+    return _cliente[MONGO_DB]
+
+
+def get_db_async():
+    if _cliente_async is None:
+        conectar()
+    return _cliente_async[MONGO_DB]
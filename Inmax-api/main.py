@@ -1,33 +1,43 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from db import get_db
+from db import conectar, cerrar, get_db_async
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Un solo pool de conexiones para todo el proceso
+    conectar()
+    yield
+    cerrar()
+
+app = FastAPI(lifespan=lifespan)
 
 @app.get("/")
 def root():
     return {"msg": "FastAPI conectado"}
 
 @app.get("/test-db")
-def test_db():
-    db = get_db()
+async def test_db():
+    db = get_db_async()
     test_col = db["test"]
     test_doc = {"mensaje": "Hola desde Mongo!"}
-    
-    if test_col.count_documents({}) == 0:
-        test_col.insert_one(test_doc)
-    
-    docs = list(test_col.find({}, {"_id": 0}))
+
+    if await test_col.count_documents({}) == 0:
+        await test_col.insert_one(test_doc)
+
+    docs = await test_col.find({}, {"_id": 0}).to_list(length=None)
     return {"documentos": docs}
 
 
 @app.get("/test2-db")
-def test_db():
-    db = get_db()
+async def test2_db():
+    db = get_db_async()
     test_col = db["test2"]
     test_doc = {"mensaje": "Hola desde Mongo2!"}
-    
-    if test_col.count_documents({}) == 0:
-        test_col.insert_one(test_doc)
-    
-    docs = list(test_col.find({}, {"_id": 0}))
+
+    if await test_col.count_documents({}) == 0:
+        await test_col.insert_one(test_doc)
+
+    docs = await test_col.find({}, {"_id": 0}).to_list(length=None)
     return {"documentos": docs}
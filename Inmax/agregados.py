@@ -0,0 +1,122 @@
+from bisect import bisect_left, insort
+from calendar import timegm
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+import heapq
+
+from cache_respuestas import incrementar_generacion
+
+# ---------------------------------------------------
+# Posición de cada métrica dentro del contador de un bucket
+IMPRESIONES, CLICKS, SESIONES, USUARIOS, DURACION = range(5)
+N_METRICAS = 5
+
+# Posición de cada dimensión dentro de la clave (pais, canal, campaña)
+DIMENSIONES = {"pais": 0, "canal": 1, "campaña": 2}
+
+SEGUNDOS_DIA = 86400
+
+Clave = Tuple[Optional[str], Optional[str], Optional[int]]
+
+# ---------------------------------------------------
+class AlmacenAgregados:
+    """
+    Contadores pre-agregados por (bucket de tiempo, país, canal, campaña).
+
+    Se actualiza de forma incremental con cada lote de eventos y responde
+    consultas por rango sumando solo los buckets que caen dentro del rango,
+    así que el costo no depende del largo del historial.
+    """
+
+    def __init__(self, segundos_bucket: int):
+        self.segundos_bucket = segundos_bucket
+        self._buckets: Dict[int, Dict[Clave, List[float]]] = {}
+        self._orden: List[int] = []
+
+    def _bucket_de(self, fecha: datetime) -> int:
+        return timegm(fecha.utctimetuple()) // self.segundos_bucket
+
+    def _contador(self, bucket: int, clave: Clave) -> List[float]:
+        claves = self._buckets.get(bucket)
+        if claves is None:
+            claves = self._buckets[bucket] = {}
+            insort(self._orden, bucket)
+        contador = claves.get(clave)
+        if contador is None:
+            contador = claves[clave] = [0.0] * N_METRICAS
+        return contador
+
+    def registrar(self, eventos: List[dict]):
+        for evento in eventos:
+            clave = (evento.get("pais"), evento.get("canal"), evento.get("campaña_id"))
+            contador = self._contador(self._bucket_de(evento["fecha"]), clave)
+            tipo = evento["tipo"]
+            if tipo == "impresion":
+                contador[IMPRESIONES] += 1
+            elif tipo == "click":
+                contador[CLICKS] += 1
+            elif tipo == "sesion":
+                contador[SESIONES] += 1
+                contador[DURACION] += evento.get("duracion") or 0.0
+                if evento.get("usuario_nuevo"):
+                    contador[USUARIOS] += 1
+
+    def sumar(self, segundos: int, clave: Clave, valores: List[float]):
+        """
+        Suma contadores ya calculados (en el orden de las métricas) al bucket de `segundos`.
+        """
+        contador = self._contador(segundos // self.segundos_bucket, clave)
+        for i in range(N_METRICAS):
+            contador[i] += valores[i]
+
+    def _buckets_en_rango(self, fecha_inicio: Optional[date], fecha_fin: Optional[date]):
+        desde = 0
+        hasta = len(self._orden)
+        if fecha_inicio is not None:
+            desde = bisect_left(self._orden, timegm(fecha_inicio.timetuple()) // self.segundos_bucket)
+        if fecha_fin is not None:
+            # fecha_fin es inclusiva: se incluye el día completo
+            limite = (timegm(fecha_fin.timetuple()) + SEGUNDOS_DIA) // self.segundos_bucket
+            hasta = bisect_left(self._orden, limite, desde)
+        for i in range(desde, hasta):
+            yield self._buckets[self._orden[i]]
+
+    def resumen(self, dimension: str, fecha_inicio: Optional[date] = None, fecha_fin: Optional[date] = None) -> Dict[object, List[float]]:
+        """
+        Suma los contadores del rango agrupados por una dimensión (pais, canal o campaña).
+        """
+        posicion = DIMENSIONES[dimension]
+        totales: Dict[object, List[float]] = {}
+        for claves in self._buckets_en_rango(fecha_inicio, fecha_fin):
+            for clave, contador in claves.items():
+                valor = clave[posicion]
+                if valor is None:
+                    continue
+                total = totales.get(valor)
+                if total is None:
+                    totales[valor] = contador.copy()
+                else:
+                    for i in range(N_METRICAS):
+                        total[i] += contador[i]
+        return totales
+
+# ---------------------------------------------------
+# Los rangos de los reportes son de días completos: basta el bucket diario
+AGREGADOS_POR_DIA = AlmacenAgregados(SEGUNDOS_DIA)
+
+def registrar_totales(cambios: Dict[tuple, Dict[str, float]]):
+    """
+    Suma los cambios de los contadores diarios de Mongo, por (día, país, canal, campaña).
+    """
+    for (dia, pais, canal, campaña), valores in cambios.items():
+        fila = [valores["impresiones"], valores["clicks"], valores["sesiones"], valores["usuarios"], valores["duracion"]]
+        if any(fila):
+            AGREGADOS_POR_DIA.sumar(dia * SEGUNDOS_DIA, (pais, canal, campaña), fila)
+    # Los reportes cacheados que dependen de eventos dejan de valer
+    incrementar_generacion("eventos")
+
+def top_n(filas: List[dict], n: int, campo: str) -> List[dict]:
+    """
+    Retorna las n filas con mayor valor en `campo`, ordenadas de mayor a menor.
+    """
+    return heapq.nlargest(n, filas, key=lambda fila: fila[campo])
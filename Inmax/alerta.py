@@ -1,11 +1,31 @@
-from fastapi import FastAPI, Body, HTTPException, status
+from fastapi import FastAPI, Body, Depends, HTTPException, Query, status
 from pydantic import BaseModel, Field
-from typing import List, Union
+from typing import Dict, List, Optional, Union
+from contextlib import asynccontextmanager
+from datetime import datetime
+import logging
+
+from pymongo.errors import PyMongoError
+
+from autorizacion import require
+from db import get_db_async
+from entrega_alertas import ENTREGA_ALERTAS
+from evaluador_alertas import ANUNCIANTE_GENERAL, EVALUADOR_ALERTAS
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ENTREGA_ALERTAS.iniciar()
+    # Configuraciones por anunciante y alertas disparadas antes del reinicio
+    await EVALUADOR_ALERTAS.iniciar(get_db_async)
+    yield
+    await EVALUADOR_ALERTAS.detener()
+    await ENTREGA_ALERTAS.detener()
 
 app = FastAPI(
     title="API de Alertas del Avisador",
     description="Endpoints para gestionar la configuración y disparo de alertas del avisador.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 class AlertaConfiguracion(BaseModel):
@@ -13,12 +33,14 @@ class AlertaConfiguracion(BaseModel):
     tipo_recepcion: str = Field(..., description="Tipo de recepción de la alerta (correo, SMS, push, etc.)")
     umbral_precio: float = Field(..., description="Umbral de precio para disparar la alerta")
     umbral_uso: int = Field(..., description="Umbral de uso para disparar la alerta")
+    destinatarios: List[str] = Field([], description="Correos, teléfonos o tokens push que reciben la alerta")
 
 class ActualizarAlertaRequest(BaseModel):
     ubicaciones: List[str]
     tipo_recepcion: str
     umbral_precio: float
     umbral_uso: int
+    destinatarios: List[str] = []
 
 class DisparoAlertaRequest(BaseModel):
     tipo_alerta: str = Field(..., description="Tipo de alerta a disparar (precio o uso)")
@@ -31,41 +53,94 @@ class MensajeResponse(BaseModel):
 class DisparoAlertaResponse(BaseModel):
     alerta_enviada: bool
 
+class EstadoCampaña(BaseModel):
+    campaña_id: str = Field(..., description="ID de la campaña")
+    anunciante: str = Field(ANUNCIANTE_GENERAL, description="Anunciante dueño de la campaña")
+    ubicacion: str = Field(..., description="Ubicación donde corre la campaña")
+    precio: Optional[float] = Field(None, description="Precio o gasto actual")
+    uso: Optional[float] = Field(None, description="Uso actual")
+
+class AlertaDisparada(BaseModel):
+    campaña_id: str
+    anunciante: str
+    tipo_alerta: str
+    valor_actual: float
+    umbral: float
+    ubicacion: str
+    tipo_recepcion: str
+    fecha: datetime
+
+class EstadisticasEntrega(BaseModel):
+    enviados: Dict[str, int]
+    en_cola: Dict[str, int]
+    reintentos_programados: int
+    fallidos: int
+    descartados: int
+    desbordados_a_mongo: int
+    mensajes_por_segundo: float
+    ultimo_retraso_s: float
+    maximo_retraso_s: float
+    promedio_retraso_s: float
+
+class EstadisticasEvaluador(BaseModel):
+    campañas: int
+    anunciantes: int
+    reglas: int
+    ticks: int
+    alertas_disparadas: int
+    ultimo_tick_ms: float
+    maximo_tick_ms: float
+    promedio_tick_ms: float
+    intervalo_s: float
+
+# Configuración que aplica a los anunciantes sin una propia, hasta que se guarde otra en Mongo
 ALERTAS_CONFIGURACION = {
     "ubicaciones": ["Chile", "México", "Colombia"],
     "tipo_recepcion": "correo",
     "umbral_precio": 50.0,
-    "umbral_uso": 75
+    "umbral_uso": 75,
+    "destinatarios": []
 }
+EVALUADOR_ALERTAS.configurar(ANUNCIANTE_GENERAL, ALERTAS_CONFIGURACION)
+EVALUADOR_ALERTAS.registrar_destino(ENTREGA_ALERTAS.encolar)
 
 # 20) GET /avisador/alertas
 @app.get(
     "/avisador/alertas",
     response_model=AlertaConfiguracion,
     summary="Obtiene la configuración actual de alertas",
-    status_code=status.HTTP_200_OK
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(require("leer"))]
 )
-async def obtener_alertas():
+async def obtener_alertas(anunciante: str = Query(ANUNCIANTE_GENERAL, description="Anunciante")):
     """
-    Obtiene la configuración actual de alertas del avisador.
+    Obtiene la configuración actual de alertas del anunciante (o la general si no tiene una propia).
     """
-    return ALERTAS_CONFIGURACION
+    return EVALUADOR_ALERTAS.configuracion(anunciante)
 
 # 21) PUT /avisador/alertas
 @app.put(
     "/avisador/alertas",
     response_model=MensajeResponse,
     summary="Actualiza la configuración de alertas",
-    status_code=status.HTTP_200_OK
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(require("actualizar"))]
 )
-async def actualizar_alertas(data: ActualizarAlertaRequest = Body(..., description="Nueva configuración de alertas")):
+async def actualizar_alertas(
+    data: ActualizarAlertaRequest = Body(..., description="Nueva configuración de alertas"),
+    anunciante: str = Query(ANUNCIANTE_GENERAL, description="Anunciante")
+):
     """
-    Actualiza la configuración actual de alertas del avisador.
+    Actualiza la configuración de alertas del anunciante; aplica desde el próximo
+    tick en este worker y, en los demás, cuando releen las configuraciones.
     """
     if not data.ubicaciones:
         raise HTTPException(status_code=422, detail="Debe proporcionar al menos una ubicación.")
-    global ALERTAS_CONFIGURACION
-    ALERTAS_CONFIGURACION = data.dict()
+    try:
+        await EVALUADOR_ALERTAS.guardar_configuracion(get_db_async(), anunciante, data.dict())
+    except PyMongoError:
+        logging.exception(f"No se pudo guardar la configuración de alertas de {anunciante}")
+        raise HTTPException(status_code=503, detail="No se pudo guardar la configuración de alertas.")
     return {"message": "Configuración de alertas actualizada correctamente"}
 
 # 22) POST /avisador/alertas/disparar-alerta
@@ -73,7 +148,8 @@ async def actualizar_alertas(data: ActualizarAlertaRequest = Body(..., descripti
     "/avisador/alertas/disparar-alerta",
     response_model=DisparoAlertaResponse,
     summary="Dispara manualmente una alerta",
-    status_code=status.HTTP_200_OK
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(require("crear"))]
 )
 async def disparar_alerta(data: DisparoAlertaRequest = Body(..., description="Parámetros para disparar la alerta")):
     """
@@ -85,9 +161,80 @@ async def disparar_alerta(data: DisparoAlertaRequest = Body(..., description="Pa
     if data.valor_actual <= 0:
         raise HTTPException(status_code=400, detail="El valor actual debe ser positivo para disparar la alerta.")
 
-    # Aquí se integraría con el sistema real de envío de alertas
+    configuracion = EVALUADOR_ALERTAS.configuracion(ANUNCIANTE_GENERAL)
+    EVALUADOR_ALERTAS.publicar([{
+        "campaña_id": data.campaña_id,
+        "anunciante": ANUNCIANTE_GENERAL,
+        "tipo_alerta": data.tipo_alerta,
+        "valor_actual": float(data.valor_actual),
+        "umbral": float(configuracion["umbral_precio" if data.tipo_alerta == "precio" else "umbral_uso"]),
+        "ubicacion": "",
+        "tipo_recepcion": configuracion["tipo_recepcion"],
+        "destinatarios": configuracion.get("destinatarios", []),
+        "fecha": datetime.utcnow(),
+    }])
     return {"alerta_enviada": True}
 
+# PUT /avisador/campañas/estado
+@app.put(
+    "/avisador/campañas/estado",
+    response_model=MensajeResponse,
+    summary="Reporta el precio y uso actuales de una o varias campañas",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(require("actualizar"))]
+)
+async def reportar_estado(estados: List[EstadoCampaña] = Body(..., description="Valores actuales por campaña")):
+    """
+    Actualiza los valores que el evaluador compara en cada tick.
+
+    Es el punto de integración con el gasto: el evaluador no lee presupuestos
+    ni métricas por su cuenta, porque allí no están el anunciante ni la
+    ubicación. Quien reporta (un job o el servicio del anunciante) envía aquí
+    el gasto y el uso actuales. Los valores viven en la memoria del worker
+    que los recibe; cada worker evalúa los suyos y Mongo evita que dos
+    disparen la misma alerta.
+    """
+    for estado in estados:
+        EVALUADOR_ALERTAS.actualizar(estado.campaña_id, estado.anunciante, estado.ubicacion, estado.precio, estado.uso)
+    return {"message": f"{len(estados)} campañas actualizadas"}
+
+# GET /avisador/alertas/disparadas
+@app.get(
+    "/avisador/alertas/disparadas",
+    response_model=List[AlertaDisparada],
+    summary="Últimas alertas disparadas",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(require("leer"))]
+)
+async def alertas_disparadas(limite: int = Query(100, ge=1, le=1000, description="Cantidad máxima de alertas")):
+    """
+    Alertas más recientes, de la más nueva a la más antigua.
+    """
+    recientes = EVALUADOR_ALERTAS.recientes
+    return [recientes[-i] for i in range(1, min(limite, len(recientes)) + 1)]
+
+# GET /avisador/alertas/evaluador
+@app.get(
+    "/avisador/alertas/evaluador",
+    response_model=EstadisticasEvaluador,
+    summary="Duración de los ticks del evaluador de alertas",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(require("leer"))]
+)
+async def estadisticas_evaluador():
+    return EVALUADOR_ALERTAS.estadisticas()
+
+# GET /avisador/alertas/entrega
+@app.get(
+    "/avisador/alertas/entrega",
+    response_model=EstadisticasEntrega,
+    summary="Rendimiento y retraso del envío de alertas",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(require("leer"))]
+)
+async def estadisticas_entrega():
+    return ENTREGA_ALERTAS.estadisticas()
+
 # Endpoint raíz de prueba
 @app.get("/", summary="API de Alertas funcionando correctamente")
 def read_root():
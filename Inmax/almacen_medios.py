@@ -0,0 +1,193 @@
+from typing import AsyncIterator, Dict, Optional, Tuple
+from datetime import datetime
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import re
+import secrets
+
+# ---------------------------------------------------
+MEDIOS_RUTA = os.getenv("MEDIOS_RUTA", "medios")
+MEDIOS_TAMANO_MAXIMO = int(os.getenv("MEDIOS_TAMANO_MAXIMO", str(2 * 1024 ** 3)))
+# Se escribe y hashea en bloques de este tamaño: es la memoria máxima por subida
+TAMANO_BLOQUE = 1024 * 1024
+SUBIDA_ID = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+class SubidaInvalida(ValueError):
+    pass
+
+class SubidaEnCurso(ValueError):
+    pass
+
+class OffsetIncorrecto(ValueError):
+    def __init__(self, offset: int):
+        super().__init__(f"La subida va en el byte {offset}.")
+        self.offset = offset
+
+# ---------------------------------------------------
+class AlmacenMedios:
+    """
+    Almacén de objetos local direccionado por SHA-256: objetos/ab/cd/<sha256>.
+
+    Las subidas se escriben en subidas/<id>.parte y se pueden retomar desde
+    el último byte recibido. Al completarse, el archivo se mueve a su ruta
+    por hash; si ese contenido ya existía, se descarta la copia nueva.
+    """
+
+    def __init__(self, raiz: str):
+        self.raiz = raiz
+        self._objetos = os.path.join(raiz, "objetos")
+        self._subidas = os.path.join(raiz, "subidas")
+        # Hash de cada subida abierta y bytes que lleva consumidos. Es de este
+        # proceso: si otro worker escribió un trozo, no coincide con el offset
+        # y se recalcula desde disco
+        self._hashes: Dict[str, Tuple["hashlib._Hash", int]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def ruta_objeto(self, sha256: str) -> str:
+        return os.path.join(self._objetos, sha256[:2], sha256[2:4], sha256)
+
+    def existe(self, sha256: str) -> bool:
+        return os.path.exists(self.ruta_objeto(sha256))
+
+    def _ruta_parte(self, id: str) -> str:
+        return os.path.join(self._subidas, f"{id}.parte")
+
+    def _ruta_meta(self, id: str) -> str:
+        return os.path.join(self._subidas, f"{id}.json")
+
+    # ---------------------------------------------------
+    def crear_subida(self, tamaño: Optional[int], metadatos: dict) -> dict:
+        if tamaño is not None and not 0 < tamaño <= MEDIOS_TAMANO_MAXIMO:
+            raise SubidaInvalida(f"El tamaño debe estar entre 1 y {MEDIOS_TAMANO_MAXIMO} bytes.")
+        os.makedirs(self._subidas, exist_ok=True)
+        id = secrets.token_urlsafe(16)
+        meta = {"subida_id": id, "tamaño": tamaño, "creada": datetime.utcnow().isoformat(), **metadatos}
+        with open(self._ruta_meta(id), "w", encoding="utf-8") as archivo:
+            json.dump(meta, archivo, ensure_ascii=False)
+        open(self._ruta_parte(id), "wb").close()
+        self._hashes[id] = (hashlib.sha256(), 0)
+        return {**meta, "offset": 0}
+
+    def estado(self, id: str) -> Optional[dict]:
+        if not SUBIDA_ID.match(id):
+            return None
+        try:
+            with open(self._ruta_meta(id), encoding="utf-8") as archivo:
+                meta = json.load(archivo)
+            # La subida puede finalizarse o cancelarse entre las dos lecturas
+            offset = os.path.getsize(self._ruta_parte(id))
+        except (FileNotFoundError, ValueError):
+            return None
+        return {**meta, "offset": offset}
+
+    def en_curso(self, id: str) -> bool:
+        lock = self._locks.get(id)
+        return lock is not None and lock.locked()
+
+    def _hash(self, id: str, offset: int) -> "hashlib._Hash":
+        hasher, consumidos = self._hashes.get(id, (None, -1))
+        if consumidos != offset:
+            hasher = hashlib.sha256()
+            consumidos = 0
+            with open(self._ruta_parte(id), "rb") as archivo:
+                while consumidos < offset:
+                    bloque = archivo.read(min(TAMANO_BLOQUE, offset - consumidos))
+                    if not bloque:
+                        break
+                    hasher.update(bloque)
+                    consumidos += len(bloque)
+            self._hashes[id] = (hasher, consumidos)
+        return hasher
+
+    async def escribir(self, id: str, offset: int, cuerpo: AsyncIterator[bytes]) -> dict:
+        """
+        Agrega `cuerpo` a la subida a partir de `offset`, que debe coincidir con
+        lo ya recibido. Si la conexión se corta, lo escrito hasta ahí queda y la
+        subida se retoma desde el nuevo offset.
+
+        El lock de asyncio ordena las peticiones de este worker; el flock sobre
+        el .parte, las de otros workers. Con el flock tomado, el offset se
+        compara contra el tamaño real del archivo.
+        """
+        lock = self._locks.setdefault(id, asyncio.Lock())
+        async with lock:
+            estado = self.estado(id)
+            if estado is None:
+                raise KeyError(id)
+            limite = estado["tamaño"] or MEDIOS_TAMANO_MAXIMO
+
+            pendiente = bytearray()
+            try:
+                # Sin O_CREAT: si otro worker finalizó o canceló la subida, no se recrea
+                descriptor = os.open(self._ruta_parte(id), os.O_WRONLY | os.O_APPEND)
+            except FileNotFoundError:
+                raise KeyError(id)
+            with open(descriptor, "ab") as archivo:
+                try:
+                    fcntl.flock(archivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise SubidaEnCurso("Ya hay una petición escribiendo esta subida.")
+                actual = os.fstat(archivo.fileno()).st_size
+                if offset != actual:
+                    raise OffsetIncorrecto(actual)
+                hasher = await asyncio.to_thread(self._hash, id, offset)
+                escritos = offset
+
+                def volcar():
+                    # hashlib suelta el GIL con bloques grandes: write y update van en un hilo
+                    archivo.write(pendiente)
+                    hasher.update(pendiente)
+                    self._hashes[id] = (hasher, escritos + len(pendiente))
+                try:
+                    async for trozo in cuerpo:
+                        if escritos + len(pendiente) + len(trozo) > limite:
+                            raise SubidaInvalida(f"La subida supera los {limite} bytes declarados.")
+                        pendiente += trozo
+                        if len(pendiente) >= TAMANO_BLOQUE:
+                            await asyncio.to_thread(volcar)
+                            escritos += len(pendiente)
+                            pendiente.clear()
+                finally:
+                    if pendiente:
+                        await asyncio.to_thread(volcar)
+                        escritos += len(pendiente)
+            return {**estado, "offset": escritos}
+
+    def completa(self, estado: dict) -> bool:
+        return estado["tamaño"] is not None and estado["offset"] == estado["tamaño"]
+
+    def finalizar(self, id: str) -> Tuple[str, int, bool]:
+        """
+        Mueve la subida a su ruta por hash. Retorna (sha256, tamaño, duplicado).
+        """
+        estado = self.estado(id)
+        if estado is None:
+            raise KeyError(id)
+        if estado["tamaño"] is not None and estado["offset"] != estado["tamaño"]:
+            raise OffsetIncorrecto(estado["offset"])
+        sha256 = self._hash(id, estado["offset"]).hexdigest()
+        destino = self.ruta_objeto(sha256)
+        duplicado = os.path.exists(destino)
+        if duplicado:
+            os.remove(self._ruta_parte(id))
+        else:
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            os.replace(self._ruta_parte(id), destino)
+        os.remove(self._ruta_meta(id))
+        self._hashes.pop(id, None)
+        self._locks.pop(id, None)
+        return sha256, estado["offset"], duplicado
+
+    def cancelar(self, id: str):
+        if not SUBIDA_ID.match(id):
+            return
+        for ruta in (self._ruta_parte(id), self._ruta_meta(id)):
+            if os.path.exists(ruta):
+                os.remove(ruta)
+        self._hashes.pop(id, None)
+        self._locks.pop(id, None)
+
+ALMACEN_MEDIOS = AlmacenMedios(MEDIOS_RUTA)
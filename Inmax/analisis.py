@@ -1,7 +1,17 @@
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, HTTPException, Path, Query, Depends, Request, Response
 from pydantic import BaseModel
 from typing import Optional, List
-from datetime import date
+from datetime import date, datetime
+import asyncio
+import hashlib
+
+import numpy as np
+
+from autorizacion import require
+from cache_respuestas import CACHE_CONTROL, cache_respuesta
+from entrega_archivos import coincide_etag
+from respuestas_rapidas import RespuestaJSON
+import teselas
 
 app = FastAPI(
     title="API de Geolocalización",
@@ -21,6 +31,16 @@ class CoordenadasActividad(BaseModel):
     lon: float
     actividad: int
 
+class TeselaActividad(BaseModel):
+    z: int
+    x: int
+    y: int
+    resolucion: int
+    total: int
+    maximo: int
+    # [columna, fila, actividad] de las celdas con actividad; (0, 0) es la esquina noroeste
+    celdas: List[List[int]]
+
 # Datos de ejemplo
 DATA_DISTRIBUCION_USUARIOS = [
     {"pais": "Chile", "cantidad": 500, "porcentaje": 25.0},
@@ -35,7 +55,8 @@ DATA_COORDENADAS_MAPA = [
 ]
 
 # 18) /reportes/geolocalizacion/usuarios
-@app.get("/reportes/geolocalizacion/usuarios", response_model=List[PaisDistribucion], summary="Distribución geográfica de usuarios")
+@app.get("/reportes/geolocalizacion/usuarios", response_model=List[PaisDistribucion], summary="Distribución geográfica de usuarios", dependencies=[Depends(require("leer"))])
+@cache_respuesta(ttl=300, revalidar=600)
 async def distribucion_usuarios(
     fecha_inicio: date,
     fecha_fin: Optional[date] = None
@@ -46,7 +67,8 @@ async def distribucion_usuarios(
     return DATA_DISTRIBUCION_USUARIOS
 
 # 19) /reportes/geolocalizacion/mapa
-@app.get("/reportes/geolocalizacion/mapa", response_model=List[CoordenadasActividad], summary="Datos geográficos para renderizar mapa")
+@app.get("/reportes/geolocalizacion/mapa", response_model=List[CoordenadasActividad], summary="Datos geográficos para renderizar mapa", dependencies=[Depends(require("leer"))])
+@cache_respuesta(ttl=300, revalidar=600)
 async def coordenadas_mapa(
     fecha_inicio: date,
     fecha_fin: Optional[date] = None
@@ -56,6 +78,48 @@ async def coordenadas_mapa(
     """
     return DATA_COORDENADAS_MAPA
 
+# 19b) /reportes/geolocalizacion/tiles/{z}/{x}/{y}
+@app.get("/reportes/geolocalizacion/tiles/{z}/{x}/{y}", response_model=TeselaActividad, summary="Densidad de actividad en una tesela del mapa", dependencies=[Depends(require("leer"))])
+async def tesela_actividad(
+    request: Request,
+    z: int = Path(..., ge=0, le=teselas.ZOOM_MAXIMO, description="Nivel de zoom"),
+    x: int = Path(..., ge=0, description="Columna de la tesela"),
+    y: int = Path(..., ge=0, description="Fila de la tesela"),
+    fecha_inicio: date = Query(..., description="Inicio del rango (inclusive)"),
+    fecha_fin: Optional[date] = Query(None, description="Fin del rango (inclusive), por defecto hoy")
+):
+    """
+    Actividad por celda de una tesela Web Mercator (z, x, y) en el rango de fechas.
+
+    Cada día se cuenta una vez y se guarda en disco junto con la cantidad de
+    puntos contados; al llegar eventos nuevos solo se binean esos puntos.
+    """
+    if x >= 1 << z or y >= 1 << z:
+        raise HTTPException(status_code=404, detail="Tesela fuera del mundo para ese zoom.")
+    fecha_fin = fecha_fin or datetime.utcnow().date()
+    if fecha_fin < fecha_inicio:
+        raise HTTPException(status_code=400, detail="fecha_fin no puede ser anterior a fecha_inicio.")
+
+    versiones = await asyncio.to_thread(teselas.versiones, fecha_inicio, fecha_fin)
+    # La tesela cambia solo si cambia la cantidad de puntos de algún día del rango
+    etag = '"' + hashlib.blake2b(repr((z, x, y, versiones)).encode(), digest_size=16).hexdigest() + '"'
+    encabezados = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if coincide_etag(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=encabezados)
+
+    conteos = await asyncio.to_thread(teselas.tesela, z, x, y, versiones)
+    filas, columnas = np.nonzero(conteos)
+    valores = conteos[filas, columnas]
+    return RespuestaJSON({
+        "z": z,
+        "x": x,
+        "y": y,
+        "resolucion": teselas.RESOLUCION,
+        "total": int(valores.sum()),
+        "maximo": int(valores.max()) if valores.size else 0,
+        "celdas": np.column_stack((columnas, filas, valores)).tolist(),
+    }, headers=encabezados)
+
 # Endpoint raíz de prueba
 @app.get("/", summary="Prueba del API de geolocalización")
 def read_root():
@@ -0,0 +1,71 @@
+from typing import List
+import asyncio
+import os
+
+from pymongo import ReturnDocument
+
+from db import get_db_async
+
+# ---------------------------------------------------
+# Cada worker reserva en Mongo bloques de ids y los entrega localmente
+IDS_TAMANO_BLOQUE = int(os.getenv("IDS_TAMANO_BLOQUE", "1000"))
+COLECCION_CONTADORES = "contadores"
+
+class AsignadorIds:
+    """
+    Ids enteros únicos entre workers sin un viaje a Mongo por id.
+
+    El documento `{_id: contador, valor}` guarda el último id reservado por
+    cualquier worker. Reservar un bloque es un solo find_one_and_update que
+    suma el tamaño del bloque, así dos workers nunca reciben ids repetidos.
+    Los ids que un worker no alcanza a usar antes de terminar quedan como
+    huecos; la secuencia es única y creciente por worker, no continua.
+    """
+
+    def __init__(self, contador: str, tamaño_bloque: int):
+        self.contador = contador
+        self.tamaño_bloque = tamaño_bloque
+        self._siguiente = 0
+        self._fin = 0
+        self._lock = asyncio.Lock()
+        self.reservas = 0
+
+    def disponibles(self) -> int:
+        return self._fin - self._siguiente
+
+    async def _reservar_bloque(self, cantidad: int, piso: int) -> range:
+        # Pipeline de actualización: parte de max(valor, piso) para no repetir
+        # ids que ya existían antes de usar el contador, todo en una operación
+        documento = await get_db_async()[COLECCION_CONTADORES].find_one_and_update(
+            {"_id": self.contador},
+            [{"$set": {"valor": {"$add": [{"$max": [{"$ifNull": ["$valor", 0]}, piso]}, cantidad]}}}],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        self.reservas += 1
+        fin = documento["valor"] + 1
+        return range(fin - cantidad, fin)
+
+    async def reservar(self, cantidad: int, piso: int = 0) -> List[int]:
+        """
+        `cantidad` ids nuevos. Usa lo que quede del bloque local y, si falta,
+        reserva de una vez lo que falte (como mínimo un bloque completo).
+        `piso` es el mayor id ya usado fuera del contador.
+        """
+        async with self._lock:
+            ids = list(range(self._siguiente, self._siguiente + min(cantidad, self.disponibles())))
+            self._siguiente += len(ids)
+            faltan = cantidad - len(ids)
+            if faltan:
+                bloque = await self._reservar_bloque(max(faltan, self.tamaño_bloque), piso)
+                ids.extend(bloque[:faltan])
+                self._siguiente, self._fin = bloque.start + faltan, bloque.stop
+            return ids
+
+    async def siguiente(self, piso: int = 0) -> int:
+        return (await self.reservar(1, piso))[0]
+
+    def estadisticas(self) -> dict:
+        return {"contador": self.contador, "disponibles": self.disponibles(), "reservas": self.reservas}
+
+ASIGNADOR_CAMPAÑAS = AsignadorIds("campañas", IDS_TAMANO_BLOQUE)
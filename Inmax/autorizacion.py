@@ -0,0 +1,205 @@
+from fastapi import Depends, HTTPException, Request
+from typing import Dict, Iterable, List, Optional, Tuple
+import asyncio
+import logging
+import os
+
+from seguridad import usuario_actual
+
+# ---------------------------------------------------
+# Los roles viven en Mongo; cada worker relee la colección cada tanto
+ROLES_SINCRONIZACION_S = float(os.getenv("ROLES_SINCRONIZACION_S", "5"))
+COLECCION_ROLES = "roles"
+
+PERMISOS_DISPONIBLES = ["crear", "leer", "actualizar", "eliminar", "exportar"]
+
+# Cada permiso es un bit; un rol es la OR de sus permisos
+BITS_PERMISOS: Dict[str, int] = {permiso: 1 << i for i, permiso in enumerate(PERMISOS_DISPONIBLES)}
+
+class PermisoDesconocido(ValueError):
+    pass
+
+def compilar_permisos(permisos: Iterable[str]) -> int:
+    mascara = 0
+    for permiso in permisos:
+        bit = BITS_PERMISOS.get(permiso)
+        if bit is None:
+            raise PermisoDesconocido(f"Permiso desconocido: '{permiso}'.")
+        mascara |= bit
+    return mascara
+
+def normalizar_nombre(nombre: str) -> str:
+    return nombre.strip().lower()
+
+# ---------------------------------------------------
+class RegistroRoles:
+    """
+    Roles indexados por id y por nombre normalizado, con sus permisos
+    compilados a máscaras de bits.
+
+    Las decisiones (roles del token -> máscara) se guardan en una caché
+    que se descarta completa cada vez que cambia la versión del registro.
+
+    La colección "roles" de Mongo es la fuente: roles.py escribe ahí antes
+    de tocar la memoria y cada worker la relee cada ROLES_SINCRONIZACION_S,
+    así un cambio hecho en otro worker vale aquí a lo sumo ese plazo después.
+    """
+
+    def __init__(self):
+        self._por_id: Dict[int, dict] = {}
+        self._id_por_nombre: Dict[str, int] = {}
+        self._mascaras: Dict[str, int] = {}
+        self._siguiente_id = 1
+        self.version = 0
+        self._decisiones: Dict[Tuple[str, ...], int] = {}
+        self._tarea: Optional[asyncio.Task] = None
+
+    def _cambio(self):
+        self.version += 1
+        self._decisiones.clear()
+
+    def listar(self) -> List[dict]:
+        return list(self._por_id.values())
+
+    def obtener(self, id: int) -> Optional[dict]:
+        return self._por_id.get(id)
+
+    def id_por_nombre(self, nombre: str) -> Optional[int]:
+        return self._id_por_nombre.get(normalizar_nombre(nombre))
+
+    def crear(self, nombre: str, descripcion: str, permisos: List[str], id: Optional[int] = None) -> dict:
+        mascara = compilar_permisos(permisos)
+        if id is None:
+            id = self._siguiente_id
+        rol = {"id": id, "nombre": nombre.strip(), "descripcion": descripcion.strip(), "permisos": list(permisos)}
+        self._por_id[id] = rol
+        self._id_por_nombre[normalizar_nombre(nombre)] = id
+        self._mascaras[normalizar_nombre(nombre)] = mascara
+        self._siguiente_id = max(self._siguiente_id, id + 1)
+        self._cambio()
+        return rol
+
+    def actualizar(self, id: int, nombre: str, descripcion: str, permisos: List[str]) -> dict:
+        mascara = compilar_permisos(permisos)
+        rol = self._por_id[id]
+        anterior = normalizar_nombre(rol["nombre"])
+        del self._id_por_nombre[anterior]
+        del self._mascaras[anterior]
+        rol.update({"nombre": nombre.strip(), "descripcion": descripcion.strip(), "permisos": list(permisos)})
+        self._id_por_nombre[normalizar_nombre(nombre)] = id
+        self._mascaras[normalizar_nombre(nombre)] = mascara
+        self._cambio()
+        return rol
+
+    def eliminar(self, id: int) -> dict:
+        rol = self._por_id.pop(id)
+        nombre = normalizar_nombre(rol["nombre"])
+        del self._id_por_nombre[nombre]
+        del self._mascaras[nombre]
+        self._cambio()
+        return rol
+
+    def reemplazar(self, roles: List[dict]):
+        """
+        Deja el registro igual a `roles`; si nada cambió, la caché de decisiones se conserva.
+        """
+        vigentes = {r["id"]: (r["nombre"], r["descripcion"], tuple(r["permisos"])) for r in self._por_id.values()}
+        nuevos = {r["id"]: (r["nombre"], r["descripcion"], tuple(r["permisos"])) for r in roles}
+        if vigentes == nuevos:
+            return
+        self._por_id.clear()
+        self._id_por_nombre.clear()
+        self._mascaras.clear()
+        for rol in roles:
+            try:
+                self.crear(rol["nombre"], rol["descripcion"], rol["permisos"], id=rol["id"])
+            except PermisoDesconocido:
+                logging.exception(f"Rol {rol['id']} con permisos inválidos en Mongo")
+        self._cambio()
+
+    async def sincronizar(self, db):
+        coleccion = db[COLECCION_ROLES]
+        documentos = await coleccion.find().to_list(None)
+        if not documentos:
+            # Primera vez en esta base: se siembran los roles iniciales
+            await coleccion.create_index("clave", unique=True)
+            for rol in ROLES:
+                await coleccion.update_one(
+                    {"_id": rol["id"]},
+                    {"$setOnInsert": {**rol, "clave": normalizar_nombre(rol["nombre"])}},
+                    upsert=True,
+                )
+            documentos = await coleccion.find().to_list(None)
+        self.reemplazar([
+            {"id": d["_id"], "nombre": d["nombre"], "descripcion": d["descripcion"], "permisos": d["permisos"]}
+            for d in documentos
+        ])
+
+    async def _sincronizar_periodicamente(self):
+        # pymongo se importa recién aquí: login.py tiene presupuesto de importación
+        from pymongo.errors import PyMongoError
+        from db import get_db_async
+
+        while True:
+            try:
+                await self.sincronizar(get_db_async())
+            except PyMongoError:
+                logging.exception("No se pudieron leer los roles desde Mongo")
+            await asyncio.sleep(ROLES_SINCRONIZACION_S)
+
+    def asegurar_sincronizacion(self):
+        # Arranca con la primera petición autorizada: no todas las apps tienen lifespan
+        loop = asyncio.get_running_loop()
+        if self._tarea is None or self._tarea.done() or self._tarea.get_loop() is not loop:
+            self._tarea = loop.create_task(self._sincronizar_periodicamente())
+
+    def mascara(self, roles: Tuple[str, ...]) -> int:
+        mascara = self._decisiones.get(roles)
+        if mascara is None:
+            mascara = 0
+            for rol in roles:
+                mascara |= self._mascaras.get(normalizar_nombre(rol), 0)
+            self._decisiones[roles] = mascara
+        return mascara
+
+    def permite(self, roles: Tuple[str, ...], permiso: str) -> bool:
+        return bool(self.mascara(roles) & BITS_PERMISOS[permiso])
+
+# Roles con los que arranca cada proceso y con los que se siembra Mongo
+ROLES = [
+    {"id": 1, "nombre": "Admin", "descripcion": "Administrador del sistema", "permisos": ["crear", "leer", "actualizar", "eliminar", "exportar"]},
+    {"id": 2, "nombre": "Editor", "descripcion": "Editor de contenido", "permisos": ["leer", "actualizar"]},
+    {"id": 3, "nombre": "Usuario", "descripcion": "Usuario básico", "permisos": ["leer"]}
+]
+
+REGISTRO_ROLES = RegistroRoles()
+for _rol in ROLES:
+    REGISTRO_ROLES.crear(_rol["nombre"], _rol["descripcion"], _rol["permisos"], id=_rol["id"])
+
+# ---------------------------------------------------
+def roles_de(claims: dict) -> Tuple[str, ...]:
+    """
+    Roles del token: los del realm de Keycloak más el claim "rol" si viene.
+    """
+    roles = tuple(claims.get("realm_access", {}).get("roles", ()))
+    rol = claims.get("rol")
+    return roles + (rol,) if rol else roles
+
+def require(permiso: str):
+    """
+    Dependencia de FastAPI que exige `permiso` a quien trae el token.
+
+        @app.get("/ruta", dependencies=[Depends(require("leer"))])
+    """
+    bit = BITS_PERMISOS[permiso]
+
+    async def verificar(request: Request, claims: dict = Depends(usuario_actual)) -> dict:
+        REGISTRO_ROLES.asegurar_sincronizacion()
+        mascara = REGISTRO_ROLES.mascara(roles_de(claims))
+        if not mascara & bit:
+            raise HTTPException(status_code=403, detail=f"Se requiere el permiso '{permiso}'.")
+        # Quienes tienen los mismos permisos ven los mismos datos (lo usa cache_respuesta)
+        request.state.alcance = mascara
+        return claims
+
+    return verificar
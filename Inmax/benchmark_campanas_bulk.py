@@ -0,0 +1,83 @@
+"""
+Benchmark: crear N campañas una por una contra POST /campañas/bulk.
+
+Llama directo a los handlers de creacion_campana (sin HTTP ni token) para
+medir lo que cambia entre ambos caminos: una reserva de id, un insert_one y
+un upsert de presupuesto por campaña, contra ids reservados por bloque e
+insert_many / bulk_write de a CAMPAÑAS_LOTE_INSERCION.
+
+Necesita un Mongo real; usa la base MONGO_DB (por defecto
+"inmax_benchmark") y la borra al terminar.
+
+Uso (desde Inmax/):
+    python benchmark_campanas_bulk.py [campañas]
+"""
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("MONGO_DB", "inmax_benchmark")
+
+import db
+import creacion_campana
+from asignador_ids import ASIGNADOR_CAMPAÑAS
+
+CAMPAÑAS = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+
+
+def campaña(i):
+    inicio = datetime(2025, 1, 1) + timedelta(days=i % 365)
+    return {
+        "nombre": f"Campaña {i}",
+        "descripcion": f"Campaña de prueba número {i}",
+        "presupuesto": 1000.0 + i,
+        "demografia": "18-24",
+        "canal": ("social", "email", "direct")[i % 3],
+        "fecha_inicio": inicio.isoformat(),
+        "fecha_fin": (inicio + timedelta(days=30)).isoformat(),
+        "imagenes": [f"https://cdn.example.com/{i}.png"],
+    }
+
+
+async def una_por_una(items):
+    for item in items:
+        await creacion_campana.crear_campaña(creacion_campana.CrearCampañaRequest.parse_obj(item))
+
+
+async def en_bulk(items):
+    lote = creacion_campana.LoteCampañas()
+    for posicion, item in enumerate(items, 1):
+        await lote.agregar(posicion, item)
+    await lote.insertar()
+    assert not lote.errores, lote.errores[:3]
+
+
+async def medir(nombre, funcion, items):
+    reservas = ASIGNADOR_CAMPAÑAS.reservas
+    inicio = time.perf_counter()
+    await funcion(items)
+    duracion = time.perf_counter() - inicio
+    print(f"{nombre:<12} {len(items):,} campañas  {duracion:7.2f} s  {len(items) / duracion:9,.0f} campañas/s  "
+          f"{ASIGNADOR_CAMPAÑAS.reservas - reservas} reservas de ids")
+    return duracion
+
+
+async def main():
+    base = db.get_db_async()
+    try:
+        # Calentamiento: conexión y primer bloque de ids
+        await una_por_una([campaña(-1)])
+        uno = await medir("una por una", una_por_una, [campaña(i) for i in range(CAMPAÑAS)])
+        bulk = await medir("bulk", en_bulk, [campaña(i) for i in range(CAMPAÑAS, 2 * CAMPAÑAS)])
+        print(f"bulk es {uno / bulk:.1f}x más rápido")
+        ids = await base["campañas"].distinct("_id")
+        assert len(ids) == 2 * CAMPAÑAS + 1, "hay ids repetidos o campañas sin guardar"
+    finally:
+        await db.get_db_async().client.drop_database(db.MONGO_DB)
+        db.cerrar()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+"""
+Benchmark: imágenes por segundo al generar derivados según la cantidad de procesos.
+
+Crea imágenes JPEG sintéticas en un directorio temporal y mide `generar`
+(las mismas versiones que la cola de derivados) en un ProcessPoolExecutor
+con 1, 2, 4, ... procesos hasta os.cpu_count().
+
+Uso (desde Inmax/):
+    python benchmark_derivados.py [imagenes] [ancho] [alto]
+"""
+import hashlib
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+IMAGENES = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+ANCHO = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+ALTO = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+
+
+def crear_imagenes(directorio):
+    rutas = []
+    for i in range(IMAGENES):
+        ruta = os.path.join(directorio, f"{i}.jpg")
+        # Ruido para que el JPEG no sea trivial de decodificar
+        Image.effect_noise((ANCHO, ALTO), 40 + i % 20).convert("RGB").save(ruta, "JPEG", quality=90)
+        with open(ruta, "rb") as archivo:
+            rutas.append((ruta, hashlib.sha256(archivo.read()).hexdigest()))
+    return rutas
+
+
+def medir(procesos, rutas):
+    import derivados
+
+    shutil.rmtree(derivados.DERIVADOS_RUTA, ignore_errors=True)
+    with ProcessPoolExecutor(procesos, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # Calienta los procesos (spawn + import de PIL) fuera de la medición
+        list(pool.map(abs, range(procesos)))
+        inicio = time.perf_counter()
+        list(pool.map(derivados.generar, *zip(*rutas)))
+        return IMAGENES / (time.perf_counter() - inicio)
+
+
+def main():
+    directorio = tempfile.mkdtemp()
+    os.environ["MEDIOS_RUTA"] = directorio
+    try:
+        rutas = crear_imagenes(directorio)
+        procesos = 1
+        base = None
+        while procesos <= (os.cpu_count() or 1):
+            tasa = medir(procesos, rutas)
+            base = base or tasa
+            print(f"{procesos:3d} procesos: {tasa:7.1f} imágenes/s  (x{tasa / base:.2f})")
+            procesos *= 2
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark: envío de alertas contra un SMTP local de prueba y un receptor push falso.
+
+Levanta en el mismo proceso un servidor SMTP mínimo y un receptor HTTP que
+acepta los lotes push, dispara `alertas` alertas con `destinatarios`
+destinatarios cada una por correo y push, y mide mensajes por segundo y
+retraso hasta que los dos servidores reciben todo.
+
+Uso (desde Inmax/):
+    python benchmark_entrega_alertas.py [alertas] [destinatarios]
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+ALERTAS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+DESTINATARIOS = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+PUERTO_SMTP = 8025
+PUERTO_PUSH = 8026
+
+# Antes de importar entrega_alertas: apunta a los servidores de prueba y quita los límites de tasa
+os.environ.update({
+    "ALERTAS_SMTP_HOST": "127.0.0.1",
+    "ALERTAS_SMTP_PUERTO": str(PUERTO_SMTP),
+    "ALERTAS_PUSH_URL": f"http://127.0.0.1:{PUERTO_PUSH}/push",
+    "ALERTAS_CORREO_POR_SEGUNDO": "1e9",
+    "ALERTAS_PUSH_POR_SEGUNDO": "1e9",
+    "ALERTAS_CAPACIDAD_COLA": str(ALERTAS * DESTINATARIOS),
+})
+
+from entrega_alertas import EntregaAlertas, crear_canales  # noqa: E402
+
+recibidos = {"correo": 0, "push": 0}
+
+
+async def smtp_prueba(reader, writer):
+    writer.write(b"220 prueba\r\n")
+    en_datos = False
+    while linea := await reader.readline():
+        if en_datos:
+            if linea == b".\r\n":
+                en_datos = False
+                recibidos["correo"] += 1
+                writer.write(b"250 OK\r\n")
+        else:
+            comando = linea[:4].upper()
+            if comando == b"DATA":
+                en_datos = True
+                writer.write(b"354 fin con .\r\n")
+            elif comando == b"QUIT":
+                writer.write(b"221 chao\r\n")
+                await writer.drain()
+                break
+            else:
+                writer.write(b"250 OK\r\n")
+        await writer.drain()
+    writer.close()
+
+
+async def push_falso(reader, writer):
+    # HTTP/1.1 con keep-alive: lee cabeceras y cuerpo de cada POST
+    while await reader.readline():
+        largo = 0
+        while (cabecera := await reader.readline()) not in (b"\r\n", b""):
+            nombre, _, valor = cabecera.partition(b":")
+            if nombre.strip().lower() == b"content-length":
+                largo = int(valor)
+        cuerpo = await reader.readexactly(largo)
+        recibidos["push"] += len(json.loads(cuerpo)["mensajes"])
+        writer.write(b"HTTP/1.1 200 OK\r\ncontent-length: 0\r\n\r\n")
+        await writer.drain()
+    writer.close()
+
+
+async def main():
+    smtp = await asyncio.start_server(smtp_prueba, "127.0.0.1", PUERTO_SMTP)
+    push = await asyncio.start_server(push_falso, "127.0.0.1", PUERTO_PUSH)
+    entrega = EntregaAlertas(crear_canales(), ALERTAS * DESTINATARIOS)
+    entrega.iniciar()
+
+    alertas = [
+        {
+            "campaña_id": str(i), "anunciante": "general", "tipo_alerta": "precio",
+            "valor_actual": 60.0, "umbral": 50.0, "ubicacion": "Chile",
+            "tipo_recepcion": "correo,push", "fecha": datetime.utcnow(),
+            "destinatarios": [f"usuario{j}@prueba.local" for j in range(DESTINATARIOS)],
+        }
+        for i in range(ALERTAS)
+    ]
+    total = ALERTAS * DESTINATARIOS
+    inicio = time.perf_counter()
+    entrega.encolar(alertas)
+    while recibidos["correo"] < total or recibidos["push"] < total:
+        await asyncio.sleep(0.05)
+    duracion = time.perf_counter() - inicio
+
+    estadisticas = entrega.estadisticas()
+    print(f"{2 * total} mensajes en {duracion:.2f} s  ({2 * total / duracion:,.0f} mensajes/s)")
+    print(f"correo {recibidos['correo']}  push {recibidos['push']}")
+    print(f"retraso promedio {estadisticas['promedio_retraso_s'] * 1000:.0f} ms  máximo {estadisticas['maximo_retraso_s'] * 1000:.0f} ms")
+    await entrega.detener()
+    smtp.close()
+    push.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""
+Benchmark: throughput y memoria de la exportación de eventos por formato.
+
+Genera lotes sintéticos con la misma forma que entrega el cursor de Mongo
+(sin base de datos) y los pasa por los escritores de exportacion, midiendo
+MB/s y filas/s y la memoria máxima, que debe ser la de un lote y no
+crecer con el total de filas.
+
+Uso (desde Inmax/):
+    python benchmark_exportacion.py [filas]
+"""
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import exportacion
+
+FILAS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+REPORTE = exportacion.REPORTES["eventos"]
+
+
+def lotes(tamaño):
+    # El mismo lote una y otra vez: se mide la escritura, no la generación de filas
+    inicio = datetime(2025, 1, 1)
+    lote = [
+        {
+            "tipo": ("impresion", "click", "sesion")[i % 3],
+            "fecha": inicio + timedelta(seconds=i),
+            "campaña_id": i % 5000,
+            "usuario_id": f"u{i % 100000}",
+            "pais": ("Chile", "México", "Colombia")[i % 3],
+            "canal": "social",
+            "lat": -33.45,
+            "lon": -70.66,
+            "costo": 0.01,
+        }
+        for i in range(tamaño)
+    ]
+    for desde in range(0, FILAS, tamaño):
+        yield lote if desde + tamaño <= FILAS else lote[:FILAS - desde]
+
+
+def medir(nombre, crear):
+    inicio = time.perf_counter()
+    total = sum(len(trozo) for trozo in crear())
+    duracion = time.perf_counter() - inicio
+    # Segunda pasada solo para la memoria: tracemalloc hace lenta la primera
+    tracemalloc.start()
+    for _ in crear():
+        pass
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{nombre:<12} {total / 1e6:8.1f} MB  {total / 1e6 / duracion:7.1f} MB/s  "
+          f"{FILAS / duracion:11,.0f} filas/s  pico {pico / 1e6:6.1f} MB")
+
+
+def main():
+    lote = exportacion.EXPORTACION_FILAS_LOTE
+    medir("csv", lambda: exportacion._csv(REPORTE, lotes(lote)))
+    medir("csv.gz", lambda: exportacion._gzip(exportacion._csv(REPORTE, lotes(lote))))
+    medir("ndjson", lambda: exportacion._ndjson(REPORTE, lotes(lote)))
+    try:
+        exportacion.verificar_formato("parquet")
+    except exportacion.ExportacionNoDisponible as e:
+        print(f"parquet      omitido: {e}")
+        return
+    medir("parquet", lambda: exportacion._parquet(REPORTE, lotes(exportacion.EXPORTACION_FILAS_GRUPO), "snappy"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark: latencia del pedido de token a un IdP falso (p50 / p99 / máximo).
+
+Levanta en el mismo proceso un servidor HTTP mínimo que responde como el
+endpoint de token de Keycloak (con `latencia_ms` de demora simulada) y el
+de JWKS, y lanza `peticiones` llamadas a login.obtener_token_keycloak con
+`concurrencia` en vuelo a la vez, usando el cliente HTTP compartido de
+seguridad. Mide lo que agrega el lado del worker: pool de conexiones,
+keep-alive y el loop.
+
+Uso (desde Inmax/):
+    python benchmark_login.py [peticiones] [concurrencia] [latencia_ms]
+"""
+import asyncio
+import json
+import sys
+import time
+
+import login
+import seguridad
+
+PETICIONES = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+CONCURRENCIA = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+LATENCIA_S = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.005
+PUERTO_IDP = 8027
+
+TOKEN = json.dumps({"access_token": "x" * 800, "expires_in": 300, "token_type": "Bearer"}).encode()
+CERTS = json.dumps({"keys": [{"kid": "prueba", "kty": "RSA", "alg": "RS256", "n": "AQAB", "e": "AQAB"}]}).encode()
+
+
+async def idp_falso(reader, writer):
+    # HTTP/1.1 con keep-alive: lee la línea de pedido, cabeceras y cuerpo
+    while pedido := await reader.readline():
+        largo = 0
+        while (cabecera := await reader.readline()) not in (b"\r\n", b""):
+            nombre, _, valor = cabecera.partition(b":")
+            if nombre.strip().lower() == b"content-length":
+                largo = int(valor)
+        await reader.readexactly(largo)
+        if b"/certs" in pedido:
+            cuerpo = CERTS
+        else:
+            await asyncio.sleep(LATENCIA_S)
+            cuerpo = TOKEN
+        writer.write(b"HTTP/1.1 200 OK\r\ncontent-type: application/json\r\ncontent-length: %d\r\n\r\n" % len(cuerpo) + cuerpo)
+        await writer.drain()
+    writer.close()
+
+
+def percentil(valores, p):
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+async def main():
+    servidor = await asyncio.start_server(idp_falso, "127.0.0.1", PUERTO_IDP)
+    login.KEYCLOAK_URL = f"http://127.0.0.1:{PUERTO_IDP}/token"
+    seguridad.jwks.url = f"http://127.0.0.1:{PUERTO_IDP}/certs"
+    await seguridad.jwks.refrescar(seguridad.cliente_http())
+    assert len(seguridad.jwks) == 1, "el IdP falso no entregó las claves"
+
+    latencias = []
+    semaforo = asyncio.Semaphore(CONCURRENCIA)
+
+    async def pedir(i):
+        async with semaforo:
+            inicio = time.perf_counter()
+            await login.obtener_token_keycloak(f"usuario{i}@prueba.local", "secreta")
+            latencias.append(time.perf_counter() - inicio)
+
+    # Calentamiento: abre las conexiones del pool
+    await asyncio.gather(*(pedir(i) for i in range(CONCURRENCIA)))
+    latencias.clear()
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(pedir(i) for i in range(PETICIONES)))
+    duracion = time.perf_counter() - inicio
+
+    latencias.sort()
+    print(f"{PETICIONES} tokens, {CONCURRENCIA} en vuelo, IdP con {LATENCIA_S * 1000:.1f} ms: "
+          f"{duracion:.2f} s  ({PETICIONES / duracion:,.0f} tokens/s)")
+    print(f"p50 {percentil(latencias, 0.50) * 1000:6.1f} ms  p99 {percentil(latencias, 0.99) * 1000:6.1f} ms  "
+          f"máximo {latencias[-1] * 1000:6.1f} ms  (sobre la demora del IdP: "
+          f"p99 +{(percentil(latencias, 0.99) - LATENCIA_S) * 1000:.1f} ms)")
+    await seguridad.cerrar()
+    servidor.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,60 @@
+"""
+Benchmark: ranking de métricas de 100.000 campañas sobre 30 días de eventos.
+
+Carga el rollup de metricas con lotes de eventos sintéticos (como los entrega
+la cola de ingesta) y mide totales + cálculo + top_n + filas, que es lo que
+hace GET /reportes/metricas.
+
+Uso (desde Inmax/):
+    python benchmark_metricas.py [campañas] [eventos_por_dia]
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import metricas
+
+CAMPAÑAS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+EVENTOS_DIA = int(sys.argv[2]) if len(sys.argv) > 2 else 200_000
+DIAS = 30
+TAMANO_LOTE = 10_000
+REPETICIONES = 10
+
+
+def cargar(rollup):
+    rng = np.random.default_rng(0)
+    tipos = np.array(["impresion", "click", "conversion"])
+    inicio = datetime(2025, 1, 1)
+    for dia in range(DIAS):
+        fecha = inicio + timedelta(days=dia)
+        campañas = rng.integers(0, CAMPAÑAS, EVENTOS_DIA).tolist()
+        elegidos = tipos[rng.choice(3, EVENTOS_DIA, p=[0.9, 0.08, 0.02])].tolist()
+        costos = rng.gamma(2.0, 0.01, EVENTOS_DIA).tolist()
+        for i in range(0, EVENTOS_DIA, TAMANO_LOTE):
+            rollup.registrar([
+                {"tipo": tipo, "campaña_id": campaña_id, "fecha": fecha, "costo": costo, "valor": costo * 40}
+                for tipo, campaña_id, costo in zip(elegidos[i:i + TAMANO_LOTE], campañas[i:i + TAMANO_LOTE], costos[i:i + TAMANO_LOTE])
+            ])
+
+
+def main():
+    rollup = metricas.RollupCampañas()
+    inicio = time.perf_counter()
+    cargar(rollup)
+    print(f"carga de {DIAS * EVENTOS_DIA:,} eventos  {time.perf_counter() - inicio:7.2f} s")
+
+    for orden in ("ctr", "ctr_min", "roi"):
+        mejor = float("inf")
+        for _ in range(REPETICIONES):
+            inicio = time.perf_counter()
+            ids, totales = rollup.totales()
+            calculadas = metricas.calcular(totales)
+            metricas.filas(ids, calculadas, metricas.ranking(calculadas, orden, True, 100))
+            mejor = min(mejor, time.perf_counter() - inicio)
+        print(f"ranking por {orden:<8} ({len(ids):,} campañas)  {mejor * 1000:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
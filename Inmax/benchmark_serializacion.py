@@ -0,0 +1,96 @@
+"""
+Microbenchmark: serialización de respuestas List[...] con 1k, 10k y 100k filas.
+
+Compara el camino normal de FastAPI (validar cada fila con el
+response_model, jsonable_encoder y json.dumps) con respuestas_rapidas
+(proyección precalculada + orjson), en bytes completos y por partes.
+
+Uso (desde Inmax/):
+    python benchmark_serializacion.py [repeticiones]
+"""
+import json
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, parse_obj_as
+
+from respuestas_rapidas import Serializador, serializar
+
+REPETICIONES = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+TAMANOS = (1_000, 10_000, 100_000)
+
+
+class GastoPorFecha(BaseModel):
+    fecha: date
+    monto: float
+
+
+class Campaña(BaseModel):
+    id: int
+    nombre: str
+    descripcion: str
+    estado: str
+    fecha_inicio: datetime
+    fecha_fin: datetime
+    presupuesto: float
+    canal: str
+
+
+def filas_gastos(n):
+    inicio = date(2024, 1, 1)
+    return [{"fecha": inicio + timedelta(days=i % 3650), "monto": i * 1.5} for i in range(n)]
+
+
+def filas_campañas(n):
+    inicio = datetime(2024, 1, 1)
+    # Con un campo de más, como las campañas del repositorio
+    return [
+        {
+            "id": i, "nombre": f"Campaña {i}", "descripcion": "Promoción", "estado": "activa",
+            "fecha_inicio": inicio + timedelta(hours=i), "fecha_fin": inicio + timedelta(hours=i + 720),
+            "presupuesto": 1000.0 + i, "canal": "social", "id_campaña": i,
+        }
+        for i in range(n)
+    ]
+
+
+def fastapi_actual(modelo, filas):
+    validadas = parse_obj_as(List[modelo], filas)
+    return json.dumps(jsonable_encoder(validadas), ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def rapido(modelo, filas):
+    return serializar(Serializador(modelo).proyectar(filas))
+
+
+def rapido_streaming(modelo, filas):
+    return b"".join(Serializador(modelo).trozos(filas))
+
+
+def medir(funcion, modelo, filas):
+    mejor = float("inf")
+    for _ in range(REPETICIONES):
+        inicio = time.perf_counter()
+        funcion(modelo, filas)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+
+def main():
+    for nombre, modelo, generar in (("GastoPorFecha", GastoPorFecha, filas_gastos), ("Campaña", Campaña, filas_campañas)):
+        for n in TAMANOS:
+            filas = generar(n)
+            assert json.loads(rapido(modelo, filas)) == json.loads(rapido_streaming(modelo, filas))
+            base = medir(fastapi_actual, modelo, filas)
+            linea = f"{nombre:<14} {n:>7} filas  fastapi {base * 1000:8.1f} ms"
+            for etiqueta, funcion in (("orjson", rapido), ("streaming", rapido_streaming)):
+                t = medir(funcion, modelo, filas)
+                linea += f"  {etiqueta} {t * 1000:7.1f} ms (x{base / t:.0f})"
+            print(linea)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Benchmark: un año de gasto por minuto (525.600 registros) de una campaña.
+
+Escribe la serie con series_tiempo.agregar en un directorio temporal y mide
+leerla (memmap) y remuestrearla a cada resolución.
+
+Uso (desde Inmax/):
+    python benchmark_series.py [repeticiones]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPETICIONES = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+MINUTOS_AÑO = 365 * 24 * 60
+
+
+def medir(funcion):
+    mejor = float("inf")
+    for _ in range(REPETICIONES):
+        inicio = time.perf_counter()
+        funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor * 1000
+
+
+def main():
+    directorio = tempfile.mkdtemp()
+    os.environ["SERIES_RUTA"] = directorio
+    import series_tiempo
+
+    try:
+        instantes = 1_735_689_600 + 60 * np.arange(MINUTOS_AÑO, dtype=np.int64)
+        series_tiempo.agregar("gastos", 1, instantes, np.random.default_rng(0).gamma(2.0, 0.5, MINUTOS_AÑO))
+        print(f"lectura (memmap)      {medir(lambda: series_tiempo.leer('gastos', 1)):7.2f} ms")
+        for resolucion in ("hora", "dia", "semana"):
+            def remuestrear():
+                series_tiempo.remuestrear(*series_tiempo.leer("gastos", 1), resolucion)
+            print(f"lectura + {resolucion:<11} {medir(remuestrear):7.2f} ms")
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+from collections import OrderedDict
+from fastapi import Request, Response
+from typing import Dict, Hashable, Iterable, Set, Tuple
+import asyncio
+import functools
+import hashlib
+import inspect
+import logging
+import os
+import time
+
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+from db import get_db_async
+from entrega_archivos import coincide_etag
+from respuestas_rapidas import serializar
+
+# ---------------------------------------------------
+CACHE_RESPUESTAS_MAX_BYTES = int(os.getenv("CACHE_RESPUESTAS_MAX_BYTES", str(64 * 1024 * 1024)))
+# El navegador siempre revalida con If-None-Match; la respuesta depende del token
+CACHE_CONTROL = "private, no-cache"
+# Cada cuánto se publican y se leen en Mongo las generaciones de todos los workers
+GENERACIONES_SINCRONIZACION_S = float(os.getenv("GENERACIONES_SINCRONIZACION_S", "1.0"))
+COLECCION_GENERACIONES = "generaciones"
+
+# ---------------------------------------------------
+class Generaciones:
+    """
+    Un contador por fuente de datos que sube cuando la fuente cambia,
+    compartido entre workers en Mongo.
+
+    Un incremento vale de inmediato en este worker y se suma en Mongo con un
+    $inc en el siguiente ciclo, donde también se leen los de los demás: otro
+    worker sigue sirviendo su entrada cacheada a lo sumo `intervalo` segundos
+    de más. El valor local (Mongo + pendientes) nunca baja, así una entrada
+    invalidada no vuelve a valer.
+    """
+
+    def __init__(self, intervalo: float):
+        self.intervalo = intervalo
+        self._remotas: Dict[str, int] = {}
+        self._pendientes: Dict[str, int] = {}
+        self._tarea = None
+
+    def incrementar(self, fuente: str):
+        self._pendientes[fuente] = self._pendientes.get(fuente, 0) + 1
+        self._asegurar_ciclo()
+
+    def valor(self, fuente: str) -> int:
+        self._asegurar_ciclo()
+        return self._remotas.get(fuente, 0) + self._pendientes.get(fuente, 0)
+
+    def _asegurar_ciclo(self):
+        # Se arranca con el primer uso dentro del loop: los módulos que cachean no tienen lifespan
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._tarea is None or self._tarea.done() or self._tarea.get_loop() is not loop:
+            self._tarea = loop.create_task(self._ciclo())
+
+    async def sincronizar(self):
+        coleccion = get_db_async()[COLECCION_GENERACIONES]
+        for fuente, cantidad in list(self._pendientes.items()):
+            documento = await coleccion.find_one_and_update(
+                {"_id": fuente}, {"$inc": {"valor": cantidad}}, upsert=True, return_document=ReturnDocument.AFTER
+            )
+            # Pudo incrementarse mientras tanto: se descuenta solo lo publicado
+            restantes = self._pendientes[fuente] - cantidad
+            if restantes:
+                self._pendientes[fuente] = restantes
+            else:
+                del self._pendientes[fuente]
+            self._remotas[fuente] = max(self._remotas.get(fuente, 0), documento["valor"])
+        async for documento in coleccion.find():
+            self._remotas[documento["_id"]] = max(self._remotas.get(documento["_id"], 0), documento["valor"])
+
+    async def _ciclo(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                await self.sincronizar()
+            except PyMongoError:
+                logging.exception("No se pudieron sincronizar las generaciones del cache")
+
+    def a_dict(self) -> Dict[str, int]:
+        return {fuente: self.valor(fuente) for fuente in self._remotas.keys() | self._pendientes.keys()}
+
+GENERACIONES = Generaciones(GENERACIONES_SINCRONIZACION_S)
+
+def incrementar_generacion(fuente: str):
+    GENERACIONES.incrementar(fuente)
+
+def generacion(fuente: str) -> int:
+    return GENERACIONES.valor(fuente)
+
+# ---------------------------------------------------
+class Entrada:
+    __slots__ = ("cuerpo", "etag", "creada", "generaciones")
+
+    def __init__(self, cuerpo: bytes, etag: str, creada: float, generaciones: Tuple[int, ...]):
+        self.cuerpo = cuerpo
+        self.etag = etag
+        self.creada = creada
+        self.generaciones = generaciones
+
+class CacheRespuestas:
+    """
+    Cuerpos JSON ya serializados, en un LRU acotado por bytes.
+
+    Una entrada sirve mientras no venza su TTL y las generaciones de sus
+    fuentes no hayan cambiado. Vencida por TTL, se sigue sirviendo hasta
+    `revalidar` segundos más mientras se recalcula en segundo plano.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entradas: "OrderedDict[Hashable, Entrada]" = OrderedDict()
+        self._bytes = 0
+        self._en_vuelo: Dict[Hashable, asyncio.Future] = {}
+        self._tareas: Set[asyncio.Task] = set()
+        self.aciertos = 0
+        self.fallos = 0
+        self.coalescidos = 0
+        self.obsoletos = 0
+        self.no_modificados = 0
+        self.invalidados = 0
+        self.bytes_ahorrados = 0
+
+    def _guardar(self, clave: Hashable, entrada: Entrada):
+        anterior = self._entradas.pop(clave, None)
+        if anterior is not None:
+            self._bytes -= len(anterior.cuerpo)
+        if len(entrada.cuerpo) > self.max_bytes:
+            return
+        self._entradas[clave] = entrada
+        self._bytes += len(entrada.cuerpo)
+        while self._bytes > self.max_bytes:
+            _, expulsada = self._entradas.popitem(last=False)
+            self._bytes -= len(expulsada.cuerpo)
+
+    async def _calcular(self, clave: Hashable, calcular, generaciones) -> Entrada:
+        # Misses concurrentes de la misma clave esperan un solo cálculo
+        en_vuelo = self._en_vuelo.get(clave)
+        if en_vuelo is not None:
+            return await asyncio.shield(en_vuelo)
+        futuro = asyncio.get_running_loop().create_future()
+        self._en_vuelo[clave] = futuro
+        try:
+            # Las generaciones se leen antes de calcular: si cambian mientras tanto, la entrada ya nace vieja
+            vigentes = generaciones()
+            cuerpo = await calcular()
+            entrada = Entrada(cuerpo, f'"{hashlib.blake2b(cuerpo, digest_size=16).hexdigest()}"', time.monotonic(), vigentes)
+            self._guardar(clave, entrada)
+            futuro.set_result(entrada)
+            return entrada
+        except asyncio.CancelledError:
+            futuro.cancel()
+            raise
+        except Exception as e:
+            futuro.set_exception(e)
+            futuro.exception()
+            raise
+        finally:
+            del self._en_vuelo[clave]
+
+    def _revalidar(self, clave: Hashable, calcular, generaciones):
+        if clave in self._en_vuelo:
+            return
+        tarea = asyncio.create_task(self._calcular(clave, calcular, generaciones))
+        self._tareas.add(tarea)
+        tarea.add_done_callback(self._fin_revalidacion)
+
+    def _fin_revalidacion(self, tarea: asyncio.Task):
+        self._tareas.discard(tarea)
+        # Si falla, la entrada vieja vence sola y el próximo pedido verá el error
+        if not tarea.cancelled():
+            tarea.exception()
+
+    async def obtener(self, clave: Hashable, ttl: float, revalidar: float, calcular, generaciones) -> Entrada:
+        entrada = self._entradas.get(clave)
+        if entrada is not None:
+            if entrada.generaciones != generaciones():
+                self.invalidados += 1
+            else:
+                edad = time.monotonic() - entrada.creada
+                if edad < ttl + revalidar:
+                    self._entradas.move_to_end(clave)
+                    self.aciertos += 1
+                    self.bytes_ahorrados += len(entrada.cuerpo)
+                    if edad >= ttl:
+                        self.obsoletos += 1
+                        self._revalidar(clave, calcular, generaciones)
+                    return entrada
+        if clave in self._en_vuelo:
+            self.coalescidos += 1
+        else:
+            self.fallos += 1
+        return await self._calcular(clave, calcular, generaciones)
+
+    def limpiar(self):
+        self._entradas.clear()
+        self._bytes = 0
+
+    def estadisticas(self) -> dict:
+        total = self.aciertos + self.coalescidos + self.fallos
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "coalescidos": self.coalescidos,
+            "tasa_aciertos": (self.aciertos + self.coalescidos) / total if total else 0.0,
+            "servidos_obsoletos": self.obsoletos,
+            "invalidados_por_generacion": self.invalidados,
+            "no_modificados_304": self.no_modificados,
+            "bytes_ahorrados": self.bytes_ahorrados,
+            "entradas": len(self._entradas),
+            "bytes": self._bytes,
+            "generaciones": GENERACIONES.a_dict(),
+        }
+
+CACHE_RESPUESTAS = CacheRespuestas(CACHE_RESPUESTAS_MAX_BYTES)
+
+# ---------------------------------------------------
+def _clave(request: Request) -> Tuple:
+    # Parámetros vacíos y el orden en la URL no cambian la respuesta
+    parametros = tuple(sorted((k, v) for k, v in request.query_params.multi_items() if v != ""))
+    alcance = getattr(request.state, "alcance", ())
+    return (request.url.path, parametros, alcance)
+
+def cache_respuesta(ttl: float, fuentes: Iterable[str] = (), revalidar: float = 0.0):
+    """
+    Cachea el JSON de un endpoint con ETag fuerte y 304. Va debajo de @app.get:
+
+        @app.get("/reportes/x", response_model=List[X])
+        @cache_respuesta(ttl=30, fuentes=["eventos"], revalidar=60)
+        async def x(...): ...
+
+    La respuesta cacheada no vuelve a pasar por response_model: el endpoint
+    debe retornar ya los campos del modelo.
+    """
+    fuentes = tuple(fuentes)
+
+    def generaciones() -> Tuple[int, ...]:
+        return tuple(generacion(fuente) for fuente in fuentes)
+
+    def decorador(funcion):
+        firma = inspect.signature(funcion)
+        agrega_request = "request" not in firma.parameters
+        es_corrutina = inspect.iscoroutinefunction(funcion)
+
+        @functools.wraps(funcion)
+        async def envoltura(*args, **kwargs):
+            request: Request = kwargs.pop("request") if agrega_request else kwargs["request"]
+
+            async def calcular() -> bytes:
+                resultado = await funcion(*args, **kwargs) if es_corrutina else funcion(*args, **kwargs)
+                if isinstance(resultado, Response):
+                    return resultado.body
+                return serializar(resultado)
+
+            entrada = await CACHE_RESPUESTAS.obtener(_clave(request), ttl, revalidar, calcular, generaciones)
+            encabezados = {"ETag": entrada.etag, "Cache-Control": CACHE_CONTROL}
+            if coincide_etag(request.headers.get("if-none-match"), entrada.etag):
+                CACHE_RESPUESTAS.no_modificados += 1
+                return Response(status_code=304, headers=encabezados)
+            return Response(entrada.cuerpo, media_type="application/json", headers=encabezados)
+
+        if agrega_request:
+            parametros = list(firma.parameters.values())
+            parametros.append(inspect.Parameter("request", inspect.Parameter.KEYWORD_ONLY, annotation=Request))
+            envoltura.__signature__ = firma.replace(parameters=parametros)
+        return envoltura
+
+    return decorador
@@ -0,0 +1,114 @@
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Set
+import asyncio
+import time
+
+# ---------------------------------------------------
+class CacheTTL:
+    """
+    Caché LRU acotada con expiración por entrada.
+
+    - Las claves inexistentes (cargador retorna None) se guardan aparte en un
+      LRU más chico y con TTL propio, para que enumerar emails no desplace
+      a los usuarios reales.
+    - Los misses concurrentes de la misma clave comparten una sola carga.
+    """
+
+    def __init__(self, max_items: int, ttl: float, max_negativos: int = 1000, ttl_negativo: float = 30.0):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.max_negativos = max_negativos
+        self.ttl_negativo = ttl_negativo
+        self._items: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._negativos: "OrderedDict[Hashable, float]" = OrderedDict()
+        self._en_vuelo: Dict[Hashable, asyncio.Future] = {}
+        # Claves invalidadas mientras se cargaban: su resultado no se guarda
+        self._invalidadas_en_vuelo: Set[Hashable] = set()
+        self.aciertos = 0
+        self.aciertos_negativos = 0
+        self.fallos = 0
+        self.coalescidos = 0
+
+    def _leer(self, clave: Hashable, ahora: float):
+        entrada = self._items.get(clave)
+        if entrada is not None:
+            expira, valor = entrada
+            if expira > ahora:
+                self._items.move_to_end(clave)
+                self.aciertos += 1
+                return True, valor
+            del self._items[clave]
+        expira = self._negativos.get(clave)
+        if expira is not None:
+            if expira > ahora:
+                self._negativos.move_to_end(clave)
+                self.aciertos_negativos += 1
+                return True, None
+            del self._negativos[clave]
+        return False, None
+
+    def _guardar(self, clave: Hashable, valor, ahora: float):
+        if valor is None:
+            self._negativos[clave] = ahora + self.ttl_negativo
+            self._negativos.move_to_end(clave)
+            if len(self._negativos) > self.max_negativos:
+                self._negativos.popitem(last=False)
+        else:
+            self._items[clave] = (ahora + self.ttl, valor)
+            self._items.move_to_end(clave)
+            if len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    async def obtener(self, clave: Hashable, cargador: Callable[[], Awaitable[Optional[object]]]):
+        encontrado, valor = self._leer(clave, time.monotonic())
+        if encontrado:
+            return valor
+
+        en_vuelo = self._en_vuelo.get(clave)
+        if en_vuelo is not None:
+            self.coalescidos += 1
+            return await asyncio.shield(en_vuelo)
+
+        self.fallos += 1
+        futuro = asyncio.get_running_loop().create_future()
+        self._en_vuelo[clave] = futuro
+        try:
+            valor = await cargador()
+        except asyncio.CancelledError:
+            futuro.cancel()
+            raise
+        except Exception as e:
+            futuro.set_exception(e)
+            # Evita el aviso "exception was never retrieved" si nadie más esperaba
+            futuro.exception()
+            raise
+        else:
+            if clave not in self._invalidadas_en_vuelo:
+                self._guardar(clave, valor, time.monotonic())
+            futuro.set_result(valor)
+            return valor
+        finally:
+            del self._en_vuelo[clave]
+            self._invalidadas_en_vuelo.discard(clave)
+
+    def invalidar(self, clave: Hashable):
+        self._items.pop(clave, None)
+        self._negativos.pop(clave, None)
+        if clave in self._en_vuelo:
+            self._invalidadas_en_vuelo.add(clave)
+
+    def limpiar(self):
+        self._items.clear()
+        self._negativos.clear()
+
+    def estadisticas(self) -> dict:
+        total = self.aciertos + self.aciertos_negativos + self.fallos + self.coalescidos
+        return {
+            "aciertos": self.aciertos,
+            "aciertos_negativos": self.aciertos_negativos,
+            "fallos": self.fallos,
+            "coalescidos": self.coalescidos,
+            "tasa_aciertos": (self.aciertos + self.aciertos_negativos) / total if total else 0.0,
+            "entradas": len(self._items),
+            "entradas_negativas": len(self._negativos),
+        }
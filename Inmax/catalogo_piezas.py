@@ -0,0 +1,88 @@
+from typing import List, Optional, Tuple
+from datetime import datetime
+import os
+
+from pymongo.errors import DuplicateKeyError
+
+from db import get_db_async
+from asignador_ids import AsignadorIds
+
+# ---------------------------------------------------
+EXTENSIONES_VIDEO = {"mp4", "webm", "mov", "m4v"}
+EXTENSIONES_IMAGEN = {"jpg", "jpeg", "png", "gif", "webp"}
+COLECCION_PIEZAS = "piezas"
+
+def formato_y_tipo(nombre_archivo: str, tipo_contenido: Optional[str] = None) -> Tuple[str, str]:
+    formato = os.path.splitext(nombre_archivo)[1].lstrip(".").lower()
+    if formato in EXTENSIONES_VIDEO or (tipo_contenido or "").startswith("video/"):
+        return formato, "video"
+    if formato in EXTENSIONES_IMAGEN or (tipo_contenido or "").startswith("image/"):
+        return formato, "imagen"
+    return formato, "otro"
+
+def url_contenido(campaña_id: int, pieza_id: int, derivado: Optional[str] = None) -> str:
+    url = f"/campañas/{campaña_id}/piezas/{pieza_id}/contenido"
+    return f"{url}?derivado={derivado}" if derivado else url
+
+# ---------------------------------------------------
+class CatalogoPiezas:
+    """
+    Piezas multimedia por campaña, guardadas en Mongo para que todos los
+    workers vean las mismas. El índice único (campaña_id, sha256) evita
+    registrar dos veces el mismo archivo en una campaña, también cuando
+    dos workers lo suben a la vez.
+    """
+
+    def __init__(self, coleccion: str):
+        self.coleccion = coleccion
+        self._ids = AsignadorIds(coleccion, 100)
+
+    async def crear_indices(self, db):
+        await db[self.coleccion].create_index([("campaña_id", 1), ("pieza_id", 1)])
+        await db[self.coleccion].create_index(
+            [("campaña_id", 1), ("sha256", 1)],
+            unique=True,
+            partialFilterExpression={"sha256": {"$type": "string"}},
+        )
+
+    async def listar(self, campaña_id: int) -> Optional[List[dict]]:
+        cursor = get_db_async()[self.coleccion].find({"campaña_id": campaña_id}, {"_id": 0}).sort("pieza_id", 1)
+        piezas = await cursor.to_list(None)
+        return piezas or None
+
+    async def obtener(self, campaña_id: int, pieza_id: int) -> Optional[dict]:
+        return await get_db_async()[self.coleccion].find_one({"_id": pieza_id, "campaña_id": campaña_id}, {"_id": 0})
+
+    async def registrar(self, campaña_id: int, nombre_archivo: str, tipo_contenido: Optional[str], sha256: str, tamaño: int) -> Tuple[dict, bool]:
+        """
+        Retorna (pieza, nueva). Si la campaña ya tiene ese contenido, retorna la pieza existente.
+        """
+        coleccion = get_db_async()[self.coleccion]
+        existente = await coleccion.find_one({"campaña_id": campaña_id, "sha256": sha256}, {"_id": 0})
+        if existente is not None:
+            return existente, False
+        formato, tipo = formato_y_tipo(nombre_archivo, tipo_contenido)
+        pieza_id = await self._ids.siguiente()
+        pieza = {
+            "pieza_id": pieza_id,
+            "campaña_id": campaña_id,
+            "tipo": tipo,
+            "url": url_contenido(campaña_id, pieza_id),
+            "formato": formato,
+            "fecha_creacion": datetime.utcnow().isoformat(timespec="seconds"),
+            "sha256": sha256,
+            "tamaño": tamaño,
+            "nombre_archivo": nombre_archivo,
+            "tipo_contenido": tipo_contenido,
+        }
+        try:
+            await coleccion.insert_one({"_id": pieza_id, **pieza})
+        except DuplicateKeyError:
+            # Otro worker registró el mismo contenido entre la búsqueda y la inserción
+            existente = await coleccion.find_one({"campaña_id": campaña_id, "sha256": sha256}, {"_id": 0})
+            if existente is None:
+                raise
+            return existente, False
+        return pieza, True
+
+CATALOGO_PIEZAS = CatalogoPiezas(COLECCION_PIEZAS)
@@ -0,0 +1,305 @@
+from calendar import timegm
+from datetime import datetime, timedelta
+from math import floor
+from typing import Callable, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+import agregados
+import indice_geo
+import metricas
+
+# ---------------------------------------------------
+# Los reportes leen contadores por bucket guardados en Mongo, no el historial
+CONTADORES_SINCRONIZACION_S = float(os.getenv("CONTADORES_SINCRONIZACION_S", "5"))
+CONTADORES_ESPERA_MIGRACION_S = float(os.getenv("CONTADORES_ESPERA_MIGRACION_S", "600"))
+# Un $inc confirmado puede llevar una marca algo anterior a la última leída
+CONTADORES_MARGEN = timedelta(seconds=30)
+COLECCION_CONTADORES_EVENTOS = "contadores_eventos"
+COLECCION_CONTADORES_GEO = "contadores_geo"
+COLECCION_MIGRACIONES = "migraciones"
+SEGUNDOS_DIA = 86400
+
+Clave = Tuple
+Cambios = Dict[Clave, Dict[str, float]]
+
+# ---------------------------------------------------
+class ContadoresMongo:
+    """
+    Contadores por bucket en una colección de Mongo: `{_id: {claves...},
+    campos..., actualizado}`.
+
+    Cada worker suma lo de sus lotes con `$inc` después de guardarlos. Cada
+    proceso lee la colección completa al arrancar y después solo los
+    documentos que cambiaron, y entrega a `aplicar` la diferencia con lo
+    último leído: los reportes ven lo de todos los workers, también en un
+    proceso sin cola de eventos, sin recorrer el historial.
+
+    La primera vez, un worker arma la colección desde "eventos" con
+    `respaldo` (etapas de agregación que agrupan por las claves) y $merge,
+    del lado de Mongo; los demás esperan a que termine. Nadie suma con
+    `persistir` antes de eso: lo insertado hasta el corte lo cuenta la
+    migración.
+    """
+
+    def __init__(self, coleccion: str, claves: Tuple[str, ...], campos: Tuple[str, ...],
+                 contar: Callable[[List[dict]], Cambios], aplicar: Callable[[Cambios], None],
+                 respaldo: Optional[List[dict]] = None):
+        self.coleccion = coleccion
+        self.claves = claves
+        self.campos = campos
+        self.contar = contar
+        self.aplicar = aplicar
+        self.respaldo = respaldo
+        self._vistos: Dict[Clave, List[float]] = {}
+        self._ultima: Optional[datetime] = None
+        self._preparacion: Optional[asyncio.Task] = None
+        self._carga: Optional[asyncio.Task] = None
+        self._tarea: Optional[asyncio.Task] = None
+
+    def _id(self, clave: Clave) -> dict:
+        # El orden de los campos es parte de la igualdad del _id
+        return dict(zip(self.claves, clave))
+
+    async def persistir(self, db, eventos: List[dict]):
+        await self._preparar_una_vez(db)
+        cambios = self.contar(eventos)
+        if not cambios:
+            return
+        operaciones = [
+            UpdateOne({"_id": self._id(clave)}, {"$inc": valores, "$currentDate": {"actualizado": True}}, upsert=True)
+            for clave, valores in cambios.items()
+        ]
+        await db[self.coleccion].bulk_write(operaciones, ordered=False)
+
+    async def sincronizar(self, db):
+        # La marca es del reloj de Mongo ($currentDate): no depende de los workers
+        filtro = {} if self._ultima is None else {"actualizado": {"$gte": self._ultima - CONTADORES_MARGEN}}
+        cambios: Cambios = {}
+        async for documento in db[self.coleccion].find(filtro):
+            clave = tuple(documento["_id"].get(campo) for campo in self.claves)
+            valores = [documento.get(campo, 0) for campo in self.campos]
+            vistos = self._vistos.get(clave)
+            diferencia = valores if vistos is None else [valor - visto for valor, visto in zip(valores, vistos)]
+            if any(diferencia):
+                cambios[clave] = dict(zip(self.campos, diferencia))
+                self._vistos[clave] = valores
+            actualizado = documento.get("actualizado")
+            if actualizado is not None and (self._ultima is None or actualizado > self._ultima):
+                self._ultima = actualizado
+        if cambios:
+            self.aplicar(cambios)
+
+    # ---------------------------------------------------
+    async def _migrar(self, db):
+        if self.respaldo is None:
+            return
+        migraciones = db[COLECCION_MIGRACIONES]
+        migracion = await migraciones.find_one({"_id": self.coleccion})
+        if migracion is not None:
+            if not migracion.get("terminada"):
+                await self._esperar_migracion(migraciones)
+            return
+        # Lo insertado desde el corte ya pasa por persistir en algún worker
+        corte = ObjectId.from_datetime(datetime.utcnow())
+        try:
+            await migraciones.insert_one({"_id": self.coleccion, "corte": corte, "terminada": False})
+        except DuplicateKeyError:
+            await self._esperar_migracion(migraciones)
+            return
+        inicio = asyncio.get_running_loop().time()
+        suma = {campo: {"$add": [{"$ifNull": [f"${campo}", 0]}, f"$$new.{campo}"]} for campo in self.campos}
+        await db["eventos"].aggregate([
+            {"$match": {"_id": {"$lt": corte}}},
+            *self.respaldo,
+            {"$set": {"actualizado": "$$NOW"}},
+            {"$merge": {
+                "into": self.coleccion,
+                "whenMatched": [{"$set": {**suma, "actualizado": "$$NOW"}}],
+                "whenNotMatched": "insert",
+            }},
+        ]).to_list(None)
+        await migraciones.update_one({"_id": self.coleccion}, {"$set": {"terminada": True}})
+        logging.info(f"Contadores de {self.coleccion} armados desde el historial en {asyncio.get_running_loop().time() - inicio:.1f} s")
+
+    async def _esperar_migracion(self, migraciones):
+        # $$NOW es el inicio de la agregación: lo que deja $merge puede quedar
+        # antes de la marca de la primera lectura, por eso se espera a que termine
+        limite = asyncio.get_running_loop().time() + CONTADORES_ESPERA_MIGRACION_S
+        while asyncio.get_running_loop().time() < limite:
+            migracion = await migraciones.find_one({"_id": self.coleccion})
+            if migracion is None or migracion.get("terminada"):
+                return
+            await asyncio.sleep(1)
+        logging.error(f"La migración de {self.coleccion} no terminó en {CONTADORES_ESPERA_MIGRACION_S:.0f} s; los reportes pueden quedar parciales")
+
+    async def _preparar(self, db):
+        await db[self.coleccion].create_index("actualizado")
+        await self._migrar(db)
+
+    async def _preparar_una_vez(self, db):
+        # Una sola por proceso; si falló (Mongo caído), el próximo uso la reintenta
+        if self._preparacion is None or (self._preparacion.done() and self._preparacion.exception() is not None):
+            self._preparacion = asyncio.create_task(self._preparar(db))
+        await asyncio.shield(self._preparacion)
+
+    async def preparar(self, db_fabrica):
+        """
+        Índice y migración desde el historial. La ingesta la espera antes de
+        vaciar la cola de eventos.
+        """
+        try:
+            await self._preparar_una_vez(db_fabrica())
+        except PyMongoError:
+            logging.exception(f"No se pudieron preparar los contadores de {self.coleccion}")
+
+    async def _cargar(self, db):
+        try:
+            await self._preparar_una_vez(db)
+            await self.sincronizar(db)
+        except PyMongoError:
+            logging.exception(f"No se pudieron cargar los contadores de {self.coleccion}")
+
+    async def _sincronizar_periodicamente(self, db_fabrica):
+        while True:
+            await asyncio.sleep(CONTADORES_SINCRONIZACION_S)
+            try:
+                await self.sincronizar(db_fabrica())
+            except PyMongoError:
+                logging.exception(f"No se pudieron sincronizar los contadores de {self.coleccion}")
+
+    async def iniciar(self, db_fabrica):
+        """
+        La primera carga es una sola por proceso aunque la pidan varios
+        módulos; los demás esperan la misma carga.
+        """
+        if self._carga is None:
+            self._carga = asyncio.create_task(self._cargar(db_fabrica()))
+        await asyncio.shield(self._carga)
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._sincronizar_periodicamente(db_fabrica))
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+
+# ---------------------------------------------------
+# Contadores diarios por (día, país, canal, campaña): alimentan agregados y métricas
+CLAVES_EVENTOS = ("dia", "pais", "canal", "campaña")
+CAMPOS_EVENTOS = ("impresiones", "clicks", "sesiones", "usuarios", "duracion", "conversiones", "costo", "ingresos")
+
+def _dia(evento: dict) -> int:
+    return timegm(evento["fecha"].utctimetuple()) // SEGUNDOS_DIA
+
+# Día UTC de "fecha" dentro de una etapa de agregación
+DIA_MONGO = {"$toInt": {"$floor": {"$divide": [{"$toLong": "$fecha"}, SEGUNDOS_DIA * 1000]}}}
+
+def contar_eventos(eventos: List[dict]) -> Cambios:
+    cambios: Cambios = {}
+    for evento in eventos:
+        clave = (_dia(evento), evento.get("pais"), evento.get("canal"), evento.get("campaña_id"))
+        valores = cambios.get(clave)
+        if valores is None:
+            valores = cambios[clave] = dict.fromkeys(CAMPOS_EVENTOS, 0)
+        tipo = evento["tipo"]
+        if tipo == "impresion":
+            valores["impresiones"] += 1
+        elif tipo == "click":
+            valores["clicks"] += 1
+        elif tipo == "sesion":
+            valores["sesiones"] += 1
+            valores["duracion"] += evento.get("duracion") or 0.0
+            if evento.get("usuario_nuevo"):
+                valores["usuarios"] += 1
+        elif tipo == "conversion":
+            valores["conversiones"] += 1
+            valores["ingresos"] += evento.get("valor") or 0.0
+        valores["costo"] += evento.get("costo") or 0.0
+    return cambios
+
+def _es(tipo: str) -> dict:
+    return {"$eq": ["$tipo", tipo]}
+
+def _si(condicion, valor) -> dict:
+    return {"$sum": {"$cond": [condicion, valor, 0]}}
+
+# Lo mismo que contar_eventos, como etapa de agregación para armar los contadores desde el historial
+RESPALDO_EVENTOS = [
+    {"$group": {
+        "_id": {
+            "dia": DIA_MONGO,
+            "pais": {"$ifNull": ["$pais", None]},
+            "canal": {"$ifNull": ["$canal", None]},
+            "campaña": {"$ifNull": ["$campaña_id", None]},
+        },
+        "impresiones": _si(_es("impresion"), 1),
+        "clicks": _si(_es("click"), 1),
+        "sesiones": _si(_es("sesion"), 1),
+        "usuarios": _si({"$and": [_es("sesion"), {"$eq": ["$usuario_nuevo", True]}]}, 1),
+        "duracion": _si(_es("sesion"), {"$ifNull": ["$duracion", 0]}),
+        "conversiones": _si(_es("conversion"), 1),
+        "costo": {"$sum": {"$ifNull": ["$costo", 0]}},
+        "ingresos": _si(_es("conversion"), {"$ifNull": ["$valor", 0]}),
+    }},
+]
+
+def _aplicar_eventos(cambios: Cambios):
+    agregados.registrar_totales(cambios)
+    metricas.registrar_totales(cambios)
+
+CONTADORES_EVENTOS = ContadoresMongo(
+    COLECCION_CONTADORES_EVENTOS, CLAVES_EVENTOS, CAMPOS_EVENTOS, contar_eventos, _aplicar_eventos, RESPALDO_EVENTOS
+)
+
+# ---------------------------------------------------
+# Impresiones con coordenadas por celda del nivel más fino: alimentan el índice geográfico
+CLAVES_GEO = ("campaña", "dia", "x", "y", "ciudad")
+CAMPOS_GEO = ("impresiones", "suma_lat", "suma_lon")
+
+def contar_impresiones(eventos: List[dict]) -> Cambios:
+    cambios: Cambios = {}
+    for evento in eventos:
+        if evento["tipo"] != "impresion" or evento.get("campaña_id") is None:
+            continue
+        lat, lon = evento.get("lat"), evento.get("lon")
+        if lat is None or lon is None:
+            continue
+        clave = (
+            evento["campaña_id"], _dia(evento),
+            floor(lon / indice_geo.TAMAÑO_CELDA_MINIMO), floor(lat / indice_geo.TAMAÑO_CELDA_MINIMO),
+            evento.get("ciudad"),
+        )
+        valores = cambios.get(clave)
+        if valores is None:
+            valores = cambios[clave] = dict.fromkeys(CAMPOS_GEO, 0)
+        valores["impresiones"] += 1
+        valores["suma_lat"] += lat
+        valores["suma_lon"] += lon
+    return cambios
+
+RESPALDO_GEO = [
+    {"$match": {"tipo": "impresion", "campaña_id": {"$ne": None}, "lat": {"$ne": None}, "lon": {"$ne": None}}},
+    {"$group": {
+        "_id": {
+            "campaña": "$campaña_id",
+            "dia": DIA_MONGO,
+            "x": {"$toInt": {"$floor": {"$divide": ["$lon", indice_geo.TAMAÑO_CELDA_MINIMO]}}},
+            "y": {"$toInt": {"$floor": {"$divide": ["$lat", indice_geo.TAMAÑO_CELDA_MINIMO]}}},
+            "ciudad": {"$ifNull": ["$ciudad", None]},
+        },
+        "impresiones": {"$sum": 1},
+        "suma_lat": {"$sum": "$lat"},
+        "suma_lon": {"$sum": "$lon"},
+    }},
+]
+
+CONTADORES_GEO = ContadoresMongo(
+    COLECCION_CONTADORES_GEO, CLAVES_GEO, CAMPOS_GEO, contar_impresiones, indice_geo.registrar_totales, RESPALDO_GEO
+)
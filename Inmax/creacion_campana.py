@@ -1,12 +1,49 @@
-from fastapi import FastAPI, HTTPException, status, UploadFile, File, Form
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from fastapi import FastAPI, HTTPException, status, UploadFile, File, Form, Depends, Header, Path, Request, Response
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Tuple
+from contextlib import asynccontextmanager
 from datetime import datetime
+import asyncio
+import json
+import logging
+import os
+from urllib.parse import quote
+
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from db import get_db_async
+from asignador_ids import ASIGNADOR_CAMPAÑAS
+from repositorio_campanas import REPOSITORIO_CAMPAÑAS, fecha_utc, marca_actualizacion
+from respuestas_rapidas import RespuestaJSON
+from autorizacion import require
+from almacen_medios import ALMACEN_MEDIOS, TAMANO_BLOQUE, OffsetIncorrecto, SubidaEnCurso, SubidaInvalida
+from catalogo_piezas import CATALOGO_PIEZAS
+from derivados import COLA_DERIVADOS
+from ritmo_presupuesto import registrar_campaña, registrar_campañas
+
+# ---------------------------------------------------
+# Creación masiva: las campañas válidas se insertan de a CAMPAÑAS_LOTE_INSERCION
+CAMPAÑAS_LOTE_INSERCION = int(os.getenv("CAMPAÑAS_LOTE_INSERCION", "1000"))
+CAMPAÑAS_MAX_BULK = int(os.getenv("CAMPAÑAS_MAX_BULK", "100000"))
+COLECCION_CAMPAÑAS = "campañas"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    COLA_DERIVADOS.iniciar()
+    try:
+        await CATALOGO_PIEZAS.crear_indices(get_db_async())
+    except PyMongoError:
+        logging.exception("No se pudieron crear los índices de piezas")
+    await REPOSITORIO_CAMPAÑAS.iniciar(get_db_async)
+    yield
+    await REPOSITORIO_CAMPAÑAS.detener()
+    await COLA_DERIVADOS.detener()
 
 app = FastAPI(
     title="API de Campañas Publicitarias",
     description="Endpoint para la creación de campañas con medios, segmentación y fechas.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 class CrearCampañaRequest(BaseModel):
@@ -26,27 +63,86 @@ class CampañaCreadaResponse(BaseModel):
     mensaje: str
     confirmación: str
 
-CAMPAÑAS = []
-contador_campañas = 1
+class CampañaBulkCreada(BaseModel):
+    posicion: int = Field(..., description="Posición del item en el arreglo o línea del NDJSON (desde 1)")
+    id_campaña: int
 
-# ---------------------------------------------------
-#Endpoint para crear una campaña
-@app.post("/campañas", response_model=CampañaCreadaResponse, status_code=201, summary="Crea una nueva campaña")
-async def crear_campaña(data: CrearCampañaRequest):
-    global contador_campañas
+class ErrorCampañaBulk(BaseModel):
+    posicion: int = Field(..., description="Posición del item en el arreglo o línea del NDJSON (desde 1)")
+    errores: List[dict] = Field(..., description="Errores de validación del item (mismo formato que un 422)")
+
+class CampañasBulkResponse(BaseModel):
+    creadas: List[CampañaBulkCreada]
+    errores: List[ErrorCampañaBulk]
+
+class IniciarSubidaRequest(BaseModel):
+    nombre_archivo: str = Field(..., description="Nombre original del archivo")
+    tamaño: int = Field(..., gt=0, description="Tamaño total en bytes")
+    tipo_contenido: Optional[str] = Field(None, description="Tipo MIME (por ejemplo: 'video/mp4')")
 
-    # Validaciones adicionales mínimas
+class SubidaResponse(BaseModel):
+    subida_id: str
+    campaña_id: int
+    nombre_archivo: str
+    tamaño: Optional[int]
+    offset: int
+
+class PiezaSubidaResponse(BaseModel):
+    pieza_id: int
+    tipo: str
+    url: str
+    formato: str
+    sha256: str
+    tamaño: int
+    duplicada: bool = Field(..., description="True si el contenido ya estaba en el almacén o en la campaña")
+
+# ---------------------------------------------------
+def _validar_campaña(data: CrearCampañaRequest) -> List[dict]:
+    # Fechas con zona (p. ej. "...Z") a UTC sin zona, antes de compararlas o
+    # guardarlas: así se comparan con las demás en Mongo y en el repositorio
+    data.fecha_inicio = fecha_utc(data.fecha_inicio)
+    data.fecha_fin = fecha_utc(data.fecha_fin)
+    # Validaciones adicionales mínimas, en el formato de los errores de pydantic
+    errores = []
     if data.fecha_fin <= data.fecha_inicio:
-        raise HTTPException(status_code=422, detail="La fecha de fin debe ser posterior a la fecha de inicio.")
+        errores.append({"loc": ["fecha_fin"], "msg": "La fecha de fin debe ser posterior a la fecha de inicio.", "type": "value_error"})
     if data.presupuesto <= 0:
-        raise HTTPException(status_code=422, detail="El presupuesto debe ser positivo.")
+        errores.append({"loc": ["presupuesto"], "msg": "El presupuesto debe ser positivo.", "type": "value_error"})
+    return errores
 
-    # Simulación de creación y asignación de ID
+def _nueva_campaña(data: CrearCampañaRequest, id: int) -> dict:
     nueva_campaña = data.dict()
-    nueva_campaña["id_campaña"] = contador_campañas
+    nueva_campaña["id"] = nueva_campaña["id_campaña"] = id
     nueva_campaña["estado"] = "activa"
-    CAMPAÑAS.append(nueva_campaña)
-    contador_campañas += 1
+    # Los otros workers la leen de Mongo a partir de esta marca
+    nueva_campaña["actualizada"] = marca_actualizacion()
+    return nueva_campaña
+
+def _piso_ids() -> int:
+    # Campañas que ya estaban en Mongo antes de usar el contador
+    return REPOSITORIO_CAMPAÑAS.siguiente_id() - 1
+
+#Endpoint para crear una campaña
+@app.post("/campañas", response_model=CampañaCreadaResponse, status_code=201, summary="Crea una nueva campaña", dependencies=[Depends(require("crear"))])
+async def crear_campaña(data: CrearCampañaRequest):
+    errores = _validar_campaña(data)
+    if errores:
+        raise HTTPException(status_code=422, detail=errores[0]["msg"])
+
+    try:
+        # El id sale del bloque reservado por este worker: único entre workers
+        nueva_campaña = _nueva_campaña(data, await ASIGNADOR_CAMPAÑAS.siguiente(_piso_ids()))
+        await get_db_async()[COLECCION_CAMPAÑAS].insert_one({"_id": nueva_campaña["id"], **nueva_campaña})
+    except PyMongoError:
+        logging.exception("No se pudo guardar la campaña")
+        raise HTTPException(status_code=503, detail="No se pudo guardar la campaña.")
+    # Se registra en el repositorio compartido, que también actualiza el índice de búsqueda
+    REPOSITORIO_CAMPAÑAS.agregar(nueva_campaña)
+    try:
+        # Documento contra el que los contadores de gasto reservan cupos
+        await registrar_campaña(nueva_campaña["id"], data.presupuesto, data.fecha_inicio, data.fecha_fin)
+    except PyMongoError:
+        logging.exception(f"No se pudo registrar el presupuesto de la campaña {nueva_campaña['id']}")
 
     return {
         "id_campaña": nueva_campaña["id_campaña"],
@@ -55,6 +151,246 @@ async def crear_campaña(data: CrearCampañaRequest):
         "confirmación": f"Campaña '{data.nombre}' registrada con éxito."
     }
 
+# ---------------------------------------------------
+# Creación masiva
+class LoteCampañas:
+    """
+    Valida cada item por separado y acumula los válidos; cada
+    CAMPAÑAS_LOTE_INSERCION campañas reserva sus ids de una vez y las
+    inserta con un insert_many, así un NDJSON se procesa mientras llega.
+    """
+
+    def __init__(self):
+        self.pendientes: List[Tuple[int, CrearCampañaRequest]] = []
+        self.creadas: List[dict] = []
+        self.errores: List[dict] = []
+
+    def rechazar(self, posicion: int, errores: List[dict]):
+        self.errores.append({"posicion": posicion, "errores": errores})
+
+    async def agregar(self, posicion: int, datos):
+        try:
+            data = CrearCampañaRequest.parse_obj(datos)
+        except ValidationError as e:
+            self.rechazar(posicion, e.errors())
+            return
+        errores = _validar_campaña(data)
+        if errores:
+            self.rechazar(posicion, errores)
+            return
+        self.pendientes.append((posicion, data))
+        if len(self.pendientes) >= CAMPAÑAS_LOTE_INSERCION:
+            await self.insertar()
+
+    async def agregar_linea(self, posicion: int, linea: bytes):
+        try:
+            datos = json.loads(linea)
+        except json.JSONDecodeError:
+            self.rechazar(posicion, [{"loc": [], "msg": "JSON inválido.", "type": "value_error.json"}])
+            return
+        await self.agregar(posicion, datos)
+
+    def _fallaron(self, pendientes: List[Tuple[int, CrearCampañaRequest]], mensaje: str):
+        for posicion, _ in pendientes:
+            self.rechazar(posicion, [{"loc": [], "msg": mensaje, "type": "db_error"}])
+
+    async def insertar(self):
+        pendientes, self.pendientes = self.pendientes, []
+        if not pendientes:
+            return
+        try:
+            ids = await ASIGNADOR_CAMPAÑAS.reservar(len(pendientes), _piso_ids())
+        except PyMongoError:
+            logging.exception(f"No se pudieron reservar ids para {len(pendientes)} campañas")
+            self._fallaron(pendientes, "No se pudo reservar un id para la campaña.")
+            return
+        campañas = [_nueva_campaña(data, id) for (_, data), id in zip(pendientes, ids)]
+
+        fallidas = set()
+        try:
+            await get_db_async()[COLECCION_CAMPAÑAS].insert_many([{"_id": c["id"], **c} for c in campañas], ordered=False)
+        except BulkWriteError as e:
+            # ordered=False: el resto del lote se insertó igual
+            fallidas = {error["index"] for error in e.details.get("writeErrors", [])}
+            logging.error(f"No se pudieron guardar {len(fallidas)} de {len(campañas)} campañas")
+        except PyMongoError:
+            logging.exception(f"No se pudieron guardar {len(campañas)} campañas")
+            self._fallaron(pendientes, "No se pudo guardar la campaña.")
+            return
+
+        insertadas = []
+        for i, ((posicion, _), campaña) in enumerate(zip(pendientes, campañas)):
+            if i in fallidas:
+                self.rechazar(posicion, [{"loc": [], "msg": "No se pudo guardar la campaña.", "type": "db_error"}])
+                continue
+            try:
+                REPOSITORIO_CAMPAÑAS.agregar(campaña)
+            except (KeyError, TypeError, ValueError):
+                # Ya está en Mongo: la sincronización lo reintentará, pero se informa
+                logging.exception(f"No se pudo indexar la campaña {campaña['id']}")
+                self.rechazar(posicion, [{"loc": [], "msg": "La campaña se guardó pero no se pudo indexar.", "type": "index_error"}])
+                continue
+            insertadas.append(campaña)
+            self.creadas.append({"posicion": posicion, "id_campaña": campaña["id"]})
+        try:
+            await registrar_campañas(insertadas)
+        except PyMongoError:
+            logging.exception(f"No se pudo registrar el presupuesto de {len(insertadas)} campañas")
+
+    def reporte(self) -> dict:
+        return {"creadas": self.creadas, "errores": sorted(self.errores, key=lambda e: e["posicion"])}
+
+# Endpoint: POST /campañas/bulk
+@app.post("/campañas/bulk", response_model=CampañasBulkResponse, summary="Crea muchas campañas en una petición (JSON o NDJSON)", dependencies=[Depends(require("crear"))])
+async def crear_campañas_bulk(request: Request):
+    """
+    Acepta un arreglo JSON de campañas o un NDJSON con una campaña por línea
+    (Content-Type: application/x-ndjson), que se inserta mientras llega.
+    Cada item se valida por separado: los válidos se crean aunque otros
+    fallen, y la respuesta trae el id de cada creado y los errores de cada
+    rechazado, ambos por posición. Sobre CAMPAÑAS_MAX_BULK items se deja de
+    leer y el resto se informa como un error.
+    """
+    lote = LoteCampañas()
+    if request.headers.get("content-type", "").startswith(("application/x-ndjson", "application/ndjson")):
+        resto = b""
+        numero = 0
+        excedido = False
+        async for bloque in request.stream():
+            lineas = (resto + bloque).split(b"\n")
+            resto = lineas.pop()
+            for linea in lineas:
+                numero += 1
+                if numero > CAMPAÑAS_MAX_BULK:
+                    excedido = True
+                    break
+                if linea.strip():
+                    await lote.agregar_linea(numero, linea)
+            if excedido:
+                break
+        if excedido:
+            lote.rechazar(numero, [{"loc": [], "msg": f"Se superó el máximo de {CAMPAÑAS_MAX_BULK} campañas por petición.", "type": "value_error"}])
+        elif resto.strip():
+            await lote.agregar_linea(numero + 1, resto)
+    else:
+        try:
+            datos = await request.json()
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="JSON inválido.")
+        if not isinstance(datos, list):
+            raise HTTPException(status_code=422, detail="Se esperaba un arreglo de campañas.")
+        if len(datos) > CAMPAÑAS_MAX_BULK:
+            raise HTTPException(status_code=413, detail=f"El lote supera el máximo de {CAMPAÑAS_MAX_BULK} campañas por petición.")
+        for posicion, item in enumerate(datos, 1):
+            await lote.agregar(posicion, item)
+    await lote.insertar()
+    # Filas internas ya validadas: se serializan directo con orjson
+    return RespuestaJSON(lote.reporte())
+
+# ---------------------------------------------------
+# Subida de piezas: el contenido va a disco en bloques de TAMANO_BLOQUE y se
+# hashea mientras llega, así la memoria por subida no depende del tamaño del archivo
+def _verificar_campaña(id: int):
+    if REPOSITORIO_CAMPAÑAS.obtener(id) is None:
+        raise HTTPException(status_code=404, detail="Campaña no encontrada.")
+
+def _subida_de(id: int, subida_id: str) -> dict:
+    estado = ALMACEN_MEDIOS.estado(subida_id)
+    if estado is None or estado["campaña_id"] != id:
+        raise HTTPException(status_code=404, detail="Subida no encontrada.")
+    return estado
+
+async def _registrar(id: int, subida_id: str, nombre_archivo: str, tipo_contenido: Optional[str]) -> dict:
+    sha256, tamaño, en_almacen = await asyncio.to_thread(ALMACEN_MEDIOS.finalizar, subida_id)
+    try:
+        pieza, nueva = await CATALOGO_PIEZAS.registrar(id, nombre_archivo, tipo_contenido, sha256, tamaño)
+    except PyMongoError:
+        # El archivo ya quedó en el almacén por su hash: reintentar la subida no lo duplica
+        logging.exception(f"No se pudo registrar la pieza de la campaña {id}")
+        raise HTTPException(status_code=503, detail="No se pudo registrar la pieza.")
+    if pieza["tipo"] == "imagen":
+        # Miniaturas y tamaños reducidos fuera del request, en el pool de procesos
+        COLA_DERIVADOS.encolar(sha256, ALMACEN_MEDIOS.ruta_objeto(sha256))
+    return {**pieza, "duplicada": en_almacen or not nueva}
+
+# Endpoint: POST /campañas/{id}/piezas (multipart, en una sola petición)
+@app.post("/campañas/{id}/piezas", response_model=PiezaSubidaResponse, status_code=201, summary="Sube una pieza multimedia a la campaña", dependencies=[Depends(require("crear"))])
+async def subir_pieza(id: int = Path(..., description="ID de la campaña"), archivo: UploadFile = File(...)):
+    _verificar_campaña(id)
+
+    async def bloques():
+        while True:
+            bloque = await archivo.read(TAMANO_BLOQUE)
+            if not bloque:
+                return
+            yield bloque
+
+    estado = ALMACEN_MEDIOS.crear_subida(None, {"campaña_id": id, "nombre_archivo": archivo.filename})
+    try:
+        await ALMACEN_MEDIOS.escribir(estado["subida_id"], 0, bloques())
+    except SubidaInvalida as e:
+        ALMACEN_MEDIOS.cancelar(estado["subida_id"])
+        raise HTTPException(status_code=413, detail=str(e))
+    except BaseException:
+        ALMACEN_MEDIOS.cancelar(estado["subida_id"])
+        raise
+    return await _registrar(id, estado["subida_id"], archivo.filename, archivo.content_type)
+
+# Endpoint: POST /campañas/{id}/piezas/subidas (subida reanudable)
+@app.post("/campañas/{id}/piezas/subidas", response_model=SubidaResponse, status_code=201, summary="Inicia una subida reanudable", dependencies=[Depends(require("crear"))])
+async def iniciar_subida(response: Response, id: int = Path(..., description="ID de la campaña"), data: IniciarSubidaRequest = ...):
+    _verificar_campaña(id)
+    try:
+        estado = ALMACEN_MEDIOS.crear_subida(data.tamaño, {"campaña_id": id, "nombre_archivo": data.nombre_archivo, "tipo_contenido": data.tipo_contenido})
+    except SubidaInvalida as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    # Los encabezados van en latin-1: la ñ de la ruta se codifica
+    response.headers["Location"] = quote(f"/campañas/{id}/piezas/subidas/{estado['subida_id']}")
+    response.headers["Upload-Offset"] = "0"
+    return estado
+
+# Endpoint: GET|HEAD /campañas/{id}/piezas/subidas/{subida_id}
+@app.api_route("/campañas/{id}/piezas/subidas/{subida_id}", methods=["GET", "HEAD"], response_model=SubidaResponse, summary="Offset desde el que retomar la subida", dependencies=[Depends(require("crear"))])
+async def estado_subida(response: Response, id: int = Path(..., description="ID de la campaña"), subida_id: str = Path(..., description="ID de la subida")):
+    estado = _subida_de(id, subida_id)
+    response.headers["Upload-Offset"] = str(estado["offset"])
+    response.headers["Cache-Control"] = "no-store"
+    return estado
+
+# Endpoint: PATCH /campañas/{id}/piezas/subidas/{subida_id}
+@app.patch("/campañas/{id}/piezas/subidas/{subida_id}", summary="Envía bytes de la subida desde Upload-Offset", dependencies=[Depends(require("crear"))])
+async def continuar_subida(
+    request: Request,
+    response: Response,
+    id: int = Path(..., description="ID de la campaña"),
+    subida_id: str = Path(..., description="ID de la subida"),
+    upload_offset: int = Header(..., alias="Upload-Offset")
+):
+    estado = _subida_de(id, subida_id)
+    if ALMACEN_MEDIOS.en_curso(subida_id):
+        raise HTTPException(status_code=409, detail="Ya hay una petición escribiendo esta subida.")
+    try:
+        estado = await ALMACEN_MEDIOS.escribir(subida_id, upload_offset, request.stream())
+    except SubidaEnCurso as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except OffsetIncorrecto as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Upload-Offset": str(e.offset)})
+    except SubidaInvalida as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    if not ALMACEN_MEDIOS.completa(estado):
+        response.headers["Upload-Offset"] = str(estado["offset"])
+        return estado
+    response.status_code = 201
+    return await _registrar(id, subida_id, estado["nombre_archivo"], estado.get("tipo_contenido"))
+
+# Endpoint: DELETE /campañas/{id}/piezas/subidas/{subida_id}
+@app.delete("/campañas/{id}/piezas/subidas/{subida_id}", status_code=204, summary="Descarta una subida incompleta", dependencies=[Depends(require("crear"))])
+async def cancelar_subida(id: int = Path(..., description="ID de la campaña"), subida_id: str = Path(..., description="ID de la subida")):
+    _subida_de(id, subida_id)
+    ALMACEN_MEDIOS.cancelar(subida_id)
+    return Response(status_code=204)
+
 # ---------------------------------------------------
 # Endpoint raíz de prueba
 @app.get("/", summary="API de Campañas funcionando correctamente")
@@ -1,12 +1,32 @@
-from fastapi import FastAPI, Query, HTTPException
+from fastapi import FastAPI, Query, HTTPException, Depends, Path
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List
+from contextlib import asynccontextmanager
 from datetime import date
 
+from agregados import AGREGADOS_POR_DIA, CLICKS, DURACION, SESIONES, USUARIOS, top_n as top
+from contadores_eventos import CONTADORES_EVENTOS
+from db import get_db_async
+import exportacion
+import frecuentes
+import metricas
+from autorizacion import require
+from cache_respuestas import CACHE_RESPUESTAS, cache_respuesta
+from respuestas_rapidas import responder_filas
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Los reportes salen de los rollups en memoria, que siguen los contadores de Mongo
+    await CONTADORES_EVENTOS.iniciar(get_db_async)
+    yield
+    await CONTADORES_EVENTOS.detener()
+
 app = FastAPI(
     title="API de Dashboard",
     description="Endpoints para reportes de usuarios, sesiones y más",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 class PaisUsuarios(BaseModel):
@@ -29,39 +49,40 @@ class GrupoClicks(BaseModel):
     grupo: str
     clicks: int
 
-# Datos de ejemplo
-DATA_USUARIOS = [
-    {"pais": "Chile", "usuarios": 1200},
-    {"pais": "México", "usuarios": 950},
-    {"pais": "Colombia", "usuarios": 800}
-]
-
-DATA_SESIONES = [
-    {"pais": "Chile", "sesiones": 3000},
-    {"pais": "Colombia", "sesiones": 2500},
-    {"pais": "México", "sesiones": 1800}
-]
-
-DATA_DURACION = [
-    {"pais": "Chile", "duracion": 120},
-    {"pais": "México", "duracion": 90},
-    {"pais": "Colombia", "duracion": 150}
-]
-
-DATA_ADQUISICION = [
-    {"canal": "social", "usuarios": 400},
-    {"canal": "direct", "usuarios": 300},
-    {"canal": "email", "usuarios": 200}
-]
-
-DATA_CLICKS = [
-    {"grupo": "Chile", "clicks": 700},
-    {"grupo": "México", "clicks": 600},
-    {"grupo": "Colombia", "clicks": 500}
-]
+class ClaveFrecuente(BaseModel):
+    clave: str
+    clicks: int
+    cota_inferior: int
+
+class TopClicksResponse(BaseModel):
+    dimension: str
+    ventana_segundos: int
+    total_clicks: int
+    epsilon: float
+    delta: float
+    error_maximo: float
+    resultados: List[ClaveFrecuente]
+
+class MetricasCampaña(BaseModel):
+    campaña_id: int
+    impresiones: int
+    clicks: int
+    conversiones: int
+    costo: float
+    ingresos: float
+    ctr: Optional[float]
+    ctr_min: Optional[float]
+    ctr_max: Optional[float]
+    conversion: Optional[float]
+    conversion_min: Optional[float]
+    conversion_max: Optional[float]
+    cpc: Optional[float]
+    cpm: Optional[float]
+    roi: Optional[float]
 
 # 4) /reportes/usuarios-top-paises
-@app.get("/reportes/usuarios-top-paises", response_model=List[PaisUsuarios], summary="Top países con más usuarios únicos")
+@app.get("/reportes/usuarios-top-paises", response_model=List[PaisUsuarios], summary="Top países con más usuarios únicos", dependencies=[Depends(require("leer"))])
+@cache_respuesta(ttl=30, fuentes=["eventos"], revalidar=60)
 async def usuarios_top_paises(
     top_n: int = Query(..., description="Cantidad de países a retornar"),
     fecha_inicio: Optional[date] = Query(None, description="Fecha de inicio"),
@@ -69,10 +90,12 @@ async def usuarios_top_paises(
 ):
     if top_n < 1:
         raise HTTPException(status_code=400, detail="El parámetro top_n debe ser mayor que 0")
-    return DATA_USUARIOS[:top_n]
+    filas = [{"pais": p, "usuarios": int(v[USUARIOS])} for p, v in AGREGADOS_POR_DIA.resumen("pais", fecha_inicio, fecha_fin).items()]
+    return top(filas, top_n, "usuarios")
 
 # 5) /reportes/sesiones-top-paises
-@app.get("/reportes/sesiones-top-paises", response_model=List[PaisSesiones], summary="Top países con más sesiones activas")
+@app.get("/reportes/sesiones-top-paises", response_model=List[PaisSesiones], summary="Top países con más sesiones activas", dependencies=[Depends(require("leer"))])
+@cache_respuesta(ttl=30, fuentes=["eventos"], revalidar=60)
 async def sesiones_top_paises(
     top_n: int = Query(..., description="Cantidad de países a retornar"),
     fecha_inicio: Optional[date] = Query(None, description="Fecha de inicio"),
@@ -80,31 +103,123 @@ async def sesiones_top_paises(
 ):
     if top_n < 1:
         raise HTTPException(status_code=400, detail="El parámetro top_n debe ser mayor que 0")
-    return DATA_SESIONES[:top_n]
+    filas = [{"pais": p, "sesiones": int(v[SESIONES])} for p, v in AGREGADOS_POR_DIA.resumen("pais", fecha_inicio, fecha_fin).items()]
+    return top(filas, top_n, "sesiones")
 
 # 7) /reportes/duracion-promedio-pais
-@app.get("/reportes/duracion-promedio-pais", response_model=List[PaisDuracion], summary="Duración promedio de usuarios por país")
+@app.get("/reportes/duracion-promedio-pais", response_model=List[PaisDuracion], summary="Duración promedio de usuarios por país", dependencies=[Depends(require("leer"))])
+@cache_respuesta(ttl=30, fuentes=["eventos"], revalidar=60)
 async def duracion_promedio_pais(
     fecha_inicio: Optional[date] = Query(None, description="Fecha de inicio"),
     fecha_fin: Optional[date] = Query(None, description="Fecha de fin")
 ):
-    return DATA_DURACION
+    return [
+        {"pais": p, "duracion": v[DURACION] / v[SESIONES]}
+        for p, v in AGREGADOS_POR_DIA.resumen("pais", fecha_inicio, fecha_fin).items() if v[SESIONES]
+    ]
 
 # 8) /reportes/adquisicion-usuarios
-@app.get("/reportes/adquisicion-usuarios", response_model=List[CanalUsuarios], summary="Muestra cómo se están adquiriendo usuarios")
+@app.get("/reportes/adquisicion-usuarios", response_model=List[CanalUsuarios], summary="Muestra cómo se están adquiriendo usuarios", dependencies=[Depends(require("leer"))])
+@cache_respuesta(ttl=30, fuentes=["eventos"], revalidar=60)
 async def adquisicion_usuarios(
     fecha_inicio: Optional[date] = Query(None, description="Fecha de inicio"),
     fecha_fin: Optional[date] = Query(None, description="Fecha de fin")
 ):
-    return DATA_ADQUISICION
+    return [{"canal": c, "usuarios": int(v[USUARIOS])} for c, v in AGREGADOS_POR_DIA.resumen("canal", fecha_inicio, fecha_fin).items()]
 
 # 9) /reportes/clicks-pais
-@app.get("/reportes/clicks-pais", response_model=List[GrupoClicks], summary="Distribuye clics o interacciones en campañas por país")
+@app.get("/reportes/clicks-pais", response_model=List[GrupoClicks], summary="Distribuye clics o interacciones en campañas por país", dependencies=[Depends(require("leer"))])
+@cache_respuesta(ttl=30, fuentes=["eventos"], revalidar=60)
 async def clicks_pais(
     fecha_inicio: Optional[date] = Query(None, description="Fecha de inicio"),
     fecha_fin: Optional[date] = Query(None, description="Fecha de fin")
 ):
-    return DATA_CLICKS
+    return [{"grupo": p, "clicks": int(v[CLICKS])} for p, v in AGREGADOS_POR_DIA.resumen("pais", fecha_inicio, fecha_fin).items()]
+
+# /reportes/clicks-top
+@app.get("/reportes/clicks-top", response_model=TopClicksResponse, summary="Claves con más clics en la ventana reciente (aproximado)", dependencies=[Depends(require("leer"))])
+async def clicks_top(
+    top_n: int = Query(10, description="Cantidad de claves a retornar"),
+    dimension: str = Query("pais", description="Dimensión: pais, campaña o pieza (campaña|pais|pieza)"),
+    ventana_segundos: int = Query(300, description="Largo de la ventana deslizante en segundos"),
+    todos_los_workers: bool = Query(False, description="Fusiona los sketches guardados por los demás workers")
+):
+    """
+    Estima los mayores contadores de clics con Count-Min + Space-Saving.
+    Cada conteo sobreestima el real en a lo más `error_maximo` con probabilidad 1 - delta.
+    """
+    if top_n < 1:
+        raise HTTPException(status_code=400, detail="El parámetro top_n debe ser mayor que 0")
+    if dimension not in frecuentes.DIMENSIONES:
+        raise HTTPException(status_code=400, detail="Dimensión inválida. Debe ser 'pais', 'campaña' o 'pieza'.")
+    if ventana_segundos < 1:
+        raise HTTPException(status_code=400, detail="La ventana debe ser de al menos 1 segundo")
+    db = get_db_async() if todos_los_workers else None
+    return await frecuentes.top_clicks(dimension, top_n, ventana_segundos, db)
+
+# /reportes/metricas
+@app.get("/reportes/metricas", response_model=List[MetricasCampaña], summary="CTR, conversión, CPC, CPM y ROI de todas las campañas", dependencies=[Depends(require("leer"))])
+@cache_respuesta(ttl=30, fuentes=["eventos"], revalidar=60)
+async def metricas_campañas(
+    orden: str = Query("ctr", description="Métrica por la que se ordena (ctr, ctr_min, conversion, roi, cpc, ...)"),
+    descendente: bool = Query(True, description="Ordena de mayor a menor"),
+    top_n: int = Query(100, description="Cantidad de campañas a retornar"),
+    min_impresiones: int = Query(0, description="Descarta campañas con menos impresiones"),
+    fecha_inicio: Optional[date] = Query(None, description="Fecha de inicio"),
+    fecha_fin: Optional[date] = Query(None, description="Fecha de fin")
+):
+    """
+    Calcula las métricas de todas las campañas en una pasada sobre los totales
+    diarios. Los *_min y *_max son el intervalo de Wilson al 95 %: ordenar por
+    ctr_min evita que una campaña con 1 click en 2 impresiones quede primera.
+    Las métricas sin denominador (p. ej. CPC sin clicks) vienen en null y se
+    ordenan al final.
+    """
+    if orden not in metricas.METRICAS:
+        raise HTTPException(status_code=400, detail=f"Métrica inválida, use una de: {', '.join(metricas.METRICAS)}.")
+    if top_n < 1:
+        raise HTTPException(status_code=400, detail="El parámetro top_n debe ser mayor que 0")
+    ids, totales = metricas.ROLLUP_CAMPAÑAS.totales(fecha_inicio, fecha_fin)
+    if min_impresiones > 0:
+        filtro = totales[:, metricas.IMPRESIONES] >= min_impresiones
+        ids, totales = ids[filtro], totales[filtro]
+    calculadas = metricas.calcular(totales)
+    posiciones = metricas.ranking(calculadas, orden, descendente, top_n)
+    return responder_filas(MetricasCampaña, metricas.filas(ids, calculadas, posiciones), streaming=False)
+
+# /reportes/{reporte}/export
+@app.get("/reportes/{reporte}/export", summary="Exporta un reporte completo en CSV, Parquet o NDJSON", dependencies=[Depends(require("exportar"))])
+async def exportar_reporte(
+    reporte: str = Path(..., description="Reporte: eventos, campañas o presupuestos"),
+    formato: str = Query("csv", description="Formato: csv, parquet o ndjson"),
+    gzip: bool = Query(False, description="Comprime CSV/NDJSON con gzip; en Parquet usa gzip por columna"),
+    fecha_inicio: Optional[date] = Query(None, description="Fecha de inicio"),
+    fecha_fin: Optional[date] = Query(None, description="Fecha de fin"),
+    campaña_id: Optional[int] = Query(None, description="Solo las filas de esta campaña")
+):
+    """
+    Envía el reporte por partes mientras se lee el cursor de Mongo, así
+    exportar meses de datos no los carga en memoria ni requiere paginar.
+    """
+    if reporte not in exportacion.REPORTES:
+        raise HTTPException(status_code=404, detail=f"Reporte desconocido, use uno de: {', '.join(exportacion.REPORTES)}.")
+    if formato not in exportacion.FORMATOS:
+        raise HTTPException(status_code=400, detail=f"Formato inválido, use uno de: {', '.join(exportacion.FORMATOS)}.")
+    try:
+        exportacion.verificar_formato(formato)
+    except exportacion.ExportacionNoDisponible as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    # Generador síncrono: Starlette lo itera en el threadpool, fuera del loop
+    return StreamingResponse(
+        exportacion.exportar(reporte, formato, gzip, fecha_inicio, fecha_fin, campaña_id),
+        media_type=exportacion.tipo_contenido(formato, gzip),
+        headers={"Content-Disposition": exportacion.disposicion(reporte, formato, gzip)}
+    )
+
+# /reportes/cache
+@app.get("/reportes/cache", summary="Tasa de aciertos y bytes ahorrados por la caché de respuestas", dependencies=[Depends(require("leer"))])
+async def metricas_cache():
+    return CACHE_RESPUESTAS.estadisticas()
 
 # Endpoint raíz
 @app.get("/", summary="Prueba del API")
@@ -0,0 +1,140 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+import asyncio
+import logging
+import multiprocessing
+import os
+
+from almacen_medios import MEDIOS_RUTA
+
+# ---------------------------------------------------
+# Lado mayor (px) de cada versión reducida de una imagen
+TAMANOS_DERIVADOS = {"miniatura": 160, "mediana": 640, "grande": 1280}
+DERIVADOS_RUTA = os.path.join(MEDIOS_RUTA, "derivados")
+DERIVADOS_PROCESOS = int(os.getenv("DERIVADOS_PROCESOS", str(os.cpu_count() or 1)))
+DERIVADOS_REINTENTOS = 3
+DERIVADOS_ESPERA_BASE_S = 1.0
+DERIVADOS_CAPACIDAD = 10000
+CALIDAD_WEBP = 80
+
+PENDIENTE = "pendiente"
+PROCESANDO = "procesando"
+LISTO = "listo"
+ERROR = "error"
+
+def ruta_derivado(sha256: str, nombre: str) -> str:
+    return os.path.join(DERIVADOS_RUTA, sha256[:2], sha256[2:4], f"{sha256}_{nombre}.webp")
+
+# ---------------------------------------------------
+def generar(origen: str, sha256: str) -> Dict[str, str]:
+    """
+    Genera todas las versiones de una imagen. Corre dentro de un proceso del
+    pool; si una versión ya existe en disco no se vuelve a generar.
+    """
+    from PIL import Image
+
+    faltantes = {n: t for n, t in TAMANOS_DERIVADOS.items() if not os.path.exists(ruta_derivado(sha256, n))}
+    if faltantes:
+        with Image.open(origen) as imagen:
+            # JPEG puede decodificarse directo a una escala reducida
+            imagen.draft("RGB", (max(faltantes.values()),) * 2)
+            imagen = imagen.convert("RGB")
+            # De mayor a menor, cada versión se reduce desde la anterior
+            for nombre, lado in sorted(faltantes.items(), key=lambda item: item[1], reverse=True):
+                imagen.thumbnail((lado, lado))
+                destino = ruta_derivado(sha256, nombre)
+                os.makedirs(os.path.dirname(destino), exist_ok=True)
+                temporal = f"{destino}.{os.getpid()}.tmp"
+                imagen.save(temporal, "WEBP", quality=CALIDAD_WEBP)
+                os.replace(temporal, destino)
+    return {nombre: ruta_derivado(sha256, nombre) for nombre in TAMANOS_DERIVADOS}
+
+def existen(sha256: str) -> bool:
+    return all(os.path.exists(ruta_derivado(sha256, nombre)) for nombre in TAMANOS_DERIVADOS)
+
+# ---------------------------------------------------
+class ColaDerivados:
+    """
+    Trabajos de derivados por hash de contenido, ejecutados en un
+    ProcessPoolExecutor con a lo sumo `procesos` trabajos a la vez.
+
+    El mismo hash se procesa una sola vez aunque se encole muchas veces, y
+    un hash cuyos archivos ya están en disco se da por listo sin encolarlo.
+    """
+
+    def __init__(self, procesos: int, reintentos: int, capacidad: int):
+        self.procesos = procesos
+        self.reintentos = reintentos
+        self._cola: asyncio.Queue = asyncio.Queue(capacidad)
+        self._estados: Dict[str, dict] = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._workers = []
+
+    def _nuevo_pool(self) -> ProcessPoolExecutor:
+        # spawn: el hijo no hereda hilos ni el loop del servidor
+        return ProcessPoolExecutor(self.procesos, mp_context=multiprocessing.get_context("spawn"))
+
+    def iniciar(self):
+        if self._pool is None:
+            self._pool = self._nuevo_pool()
+            self._workers = [asyncio.create_task(self._trabajar()) for _ in range(self.procesos)]
+
+    async def detener(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def estado(self, sha256: Optional[str]) -> Optional[dict]:
+        if not sha256:
+            return None
+        estado = self._estados.get(sha256)
+        if estado is None and existen(sha256):
+            estado = self._estados[sha256] = {"estado": LISTO, "intentos": 0, "error": None}
+        return estado
+
+    def encolar(self, sha256: str, origen: str) -> dict:
+        estado = self.estado(sha256)
+        if estado is not None and estado["estado"] != ERROR:
+            return estado
+        estado = self._estados[sha256] = {"estado": PENDIENTE, "intentos": 0, "error": None}
+        try:
+            self._cola.put_nowait((sha256, origen))
+        except asyncio.QueueFull:
+            estado.update({"estado": ERROR, "error": "Cola de derivados llena"})
+        return estado
+
+    async def _trabajar(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            sha256, origen = await self._cola.get()
+            estado = self._estados[sha256]
+            estado["estado"] = PROCESANDO
+            while True:
+                estado["intentos"] += 1
+                pool = self._pool
+                try:
+                    await loop.run_in_executor(pool, generar, origen, sha256)
+                except BrokenProcessPool:
+                    # Un hijo murió (p. ej. sin memoria): se rehace el pool una vez y se reintenta
+                    if self._pool is pool:
+                        pool.shutdown(wait=False)
+                        self._pool = self._nuevo_pool()
+                    error = "Proceso de derivados interrumpido"
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                else:
+                    estado.update({"estado": LISTO, "error": None})
+                    break
+                if estado["intentos"] >= self.reintentos:
+                    logging.error(f"Derivados de {sha256} fallaron: {error}")
+                    estado.update({"estado": ERROR, "error": error})
+                    break
+                await asyncio.sleep(DERIVADOS_ESPERA_BASE_S * 2 ** (estado["intentos"] - 1))
+            self._cola.task_done()
+
+COLA_DERIVADOS = ColaDerivados(DERIVADOS_PROCESOS, DERIVADOS_REINTENTOS, DERIVADOS_CAPACIDAD)
@@ -0,0 +1,418 @@
+from collections import deque
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from typing import Dict, List, Optional
+import asyncio
+import logging
+import os
+import queue
+import random
+import smtplib
+import time
+
+import httpx
+from pymongo.errors import PyMongoError
+
+from db import get_db_async
+
+# ---------------------------------------------------
+# Configuración por canal (variables de entorno con valores por defecto)
+ALERTAS_SMTP_HOST = os.getenv("ALERTAS_SMTP_HOST", "localhost")
+ALERTAS_SMTP_PUERTO = int(os.getenv("ALERTAS_SMTP_PUERTO", "25"))
+ALERTAS_SMTP_USUARIO = os.getenv("ALERTAS_SMTP_USUARIO")
+ALERTAS_SMTP_CLAVE = os.getenv("ALERTAS_SMTP_CLAVE")
+ALERTAS_SMTP_TLS = os.getenv("ALERTAS_SMTP_TLS", "0") == "1"
+ALERTAS_SMTP_REMITENTE = os.getenv("ALERTAS_SMTP_REMITENTE", "alertas@inmax.local")
+ALERTAS_SMS_URL = os.getenv("ALERTAS_SMS_URL")
+ALERTAS_PUSH_URL = os.getenv("ALERTAS_PUSH_URL")
+ALERTAS_TIMEOUT_S = float(os.getenv("ALERTAS_TIMEOUT_S", "10"))
+
+# Trabajadores, tamaño de lote y mensajes por segundo de cada canal
+CANALES = {
+    "correo": {
+        "trabajadores": int(os.getenv("ALERTAS_CORREO_TRABAJADORES", "4")),
+        "lote": int(os.getenv("ALERTAS_CORREO_LOTE", "50")),
+        "por_segundo": float(os.getenv("ALERTAS_CORREO_POR_SEGUNDO", "200")),
+    },
+    "sms": {
+        "trabajadores": int(os.getenv("ALERTAS_SMS_TRABAJADORES", "2")),
+        "lote": int(os.getenv("ALERTAS_SMS_LOTE", "100")),
+        "por_segundo": float(os.getenv("ALERTAS_SMS_POR_SEGUNDO", "50")),
+    },
+    "push": {
+        "trabajadores": int(os.getenv("ALERTAS_PUSH_TRABAJADORES", "4")),
+        "lote": int(os.getenv("ALERTAS_PUSH_LOTE", "500")),
+        "por_segundo": float(os.getenv("ALERTAS_PUSH_POR_SEGUNDO", "2000")),
+    },
+}
+ALERTAS_CAPACIDAD_COLA = int(os.getenv("ALERTAS_CAPACIDAD_COLA", "10000"))
+ALERTAS_INTERVALO_LOTE_S = 0.2
+ALERTAS_MAX_INTENTOS = int(os.getenv("ALERTAS_MAX_INTENTOS", "6"))
+ALERTAS_ESPERA_BASE_S = 2.0
+ALERTAS_ESPERA_MAXIMA_S = 3600.0
+ALERTAS_REVISION_REINTENTOS_S = 5.0
+COLECCION_REINTENTOS = "alertas_reintentos"
+VENTANA_RENDIMIENTO_S = 60.0
+
+# ---------------------------------------------------
+class LimiteTasa:
+    """
+    Cubeta de fichas: a lo sumo `por_segundo` mensajes por segundo en promedio.
+    Un lote más grande que la cubeta deja deuda y el siguiente espera.
+    """
+
+    def __init__(self, por_segundo: float):
+        self.por_segundo = por_segundo
+        self._fichas = por_segundo
+        self._ultimo = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def esperar(self, cantidad: int):
+        async with self._lock:
+            ahora = time.monotonic()
+            self._fichas = min(self.por_segundo, self._fichas + (ahora - self._ultimo) * self.por_segundo)
+            self._ultimo = ahora
+            self._fichas -= cantidad
+            if self._fichas < 0:
+                await asyncio.sleep(-self._fichas / self.por_segundo)
+
+# ---------------------------------------------------
+def _texto(alerta: dict) -> tuple:
+    asunto = f"Alerta de {alerta['tipo_alerta']} en la campaña {alerta['campaña_id']}"
+    cuerpo = (
+        f"El {alerta['tipo_alerta']} actual de la campaña {alerta['campaña_id']} es {alerta['valor_actual']:g}, "
+        f"sobre el umbral de {alerta['umbral']:g}"
+        + (f" en {alerta['ubicacion']}." if alerta.get("ubicacion") else ".")
+    )
+    return asunto, cuerpo
+
+class CanalCorreo:
+    """
+    Envío por SMTP con conexiones reutilizadas entre lotes: cada lote toma una
+    conexión libre (o abre una), envía todos sus mensajes y la devuelve.
+    """
+
+    def __init__(self, conexiones: int):
+        self._libres: "queue.LifoQueue[smtplib.SMTP]" = queue.LifoQueue(conexiones)
+
+    def _conectar(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(ALERTAS_SMTP_HOST, ALERTAS_SMTP_PUERTO, timeout=ALERTAS_TIMEOUT_S)
+        if ALERTAS_SMTP_TLS:
+            smtp.starttls()
+        if ALERTAS_SMTP_USUARIO:
+            smtp.login(ALERTAS_SMTP_USUARIO, ALERTAS_SMTP_CLAVE or "")
+        return smtp
+
+    def _enviar(self, mensajes: List[dict]) -> List[dict]:
+        try:
+            smtp = self._libres.get_nowait()
+        except queue.Empty:
+            smtp = self._conectar()
+        fallidos = []
+        for i, mensaje in enumerate(mensajes):
+            correo = EmailMessage()
+            correo["From"] = ALERTAS_SMTP_REMITENTE
+            correo["To"] = mensaje["destinatario"]
+            correo["Subject"] = mensaje["asunto"]
+            correo.set_content(mensaje["cuerpo"])
+            try:
+                try:
+                    smtp.send_message(correo)
+                except smtplib.SMTPServerDisconnected:
+                    # El servidor cierra las conexiones ociosas: se reabre una vez y se reenvía
+                    smtp.close()
+                    smtp = self._conectar()
+                    smtp.send_message(correo)
+            except smtplib.SMTPRecipientsRefused as e:
+                # Un 5xx es definitivo (buzón inexistente, dominio inválido): no se reintenta
+                if all(codigo >= 500 for codigo, _ in e.recipients.values()):
+                    mensaje["permanente"] = True
+                fallidos.append(mensaje)
+            except (smtplib.SMTPDataError, smtplib.SMTPSenderRefused):
+                # Rechazo de este mensaje: la conexión sigue sirviendo
+                fallidos.append(mensaje)
+            except (smtplib.SMTPException, OSError):
+                # Conexión caída: falla este y los que quedan
+                logging.exception("Conexión SMTP perdida")
+                smtp.close()
+                return fallidos + mensajes[i:]
+        try:
+            self._libres.put_nowait(smtp)
+        except queue.Full:
+            smtp.quit()
+        return fallidos
+
+    async def enviar(self, mensajes: List[dict]) -> List[dict]:
+        return await asyncio.to_thread(self._enviar, mensajes)
+
+    async def cerrar(self):
+        while True:
+            try:
+                smtp = self._libres.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                await asyncio.to_thread(smtp.quit)
+            except (smtplib.SMTPException, OSError):
+                smtp.close()
+
+class CanalHTTP:
+    """
+    Proveedor HTTP (SMS o push): cada lote va en un solo POST con
+    {"mensajes": [{destinatario, asunto, cuerpo}, ...]}.
+    """
+
+    def __init__(self, url: Optional[str], conexiones: int):
+        self.url = url
+        self._conexiones = conexiones
+        self._cliente: Optional[httpx.AsyncClient] = None
+
+    def _cliente_http(self) -> httpx.AsyncClient:
+        if self._cliente is None:
+            self._cliente = httpx.AsyncClient(
+                timeout=ALERTAS_TIMEOUT_S,
+                limits=httpx.Limits(max_connections=self._conexiones, max_keepalive_connections=self._conexiones),
+            )
+        return self._cliente
+
+    async def enviar(self, mensajes: List[dict]) -> List[dict]:
+        cuerpo = {"mensajes": [{clave: m[clave] for clave in ("destinatario", "asunto", "cuerpo")} for m in mensajes]}
+        try:
+            respuesta = await self._cliente_http().post(self.url, json=cuerpo)
+            respuesta.raise_for_status()
+        except httpx.HTTPError:
+            logging.exception(f"Falló el envío de {len(mensajes)} alertas a {self.url}")
+            return mensajes
+        return []
+
+    async def cerrar(self):
+        if self._cliente is not None:
+            await self._cliente.aclose()
+            self._cliente = None
+
+# ---------------------------------------------------
+class EntregaAlertas:
+    """
+    Reparte cada alerta a los destinatarios del anunciante por su canal
+    (correo, sms o push). Cada canal tiene su cola acotada, su grupo de
+    trabajadores que envían por lotes y su límite de mensajes por segundo.
+
+    Los mensajes que fallan, o que no caben en la cola, se guardan en Mongo
+    con su próximo intento (espera exponencial) y vuelven a la cola cuando vencen.
+    """
+
+    def __init__(self, canales: Dict[str, object], capacidad: int):
+        self.canales = canales
+        self._colas = {nombre: asyncio.Queue(capacidad) for nombre in canales}
+        self._limites = {nombre: LimiteTasa(CANALES[nombre]["por_segundo"]) for nombre in canales}
+        self._tareas: List[asyncio.Task] = []
+        self._pendientes: set = set()
+        self._enviados_recientes: deque = deque()
+        self.enviados = {nombre: 0 for nombre in canales}
+        self.reintentos = 0
+        self.fallidos = 0
+        self.descartados = 0
+        self.desbordados = 0
+        self.ultimo_retraso_s = 0.0
+        self.maximo_retraso_s = 0.0
+        self._suma_retraso_s = 0.0
+
+    # -----------------------------------------------
+    def encolar(self, alertas: List[dict]):
+        """
+        Destino del evaluador: arma un mensaje por (alerta, canal, destinatario)
+        sin esperar; nunca bloquea el tick.
+        """
+        creado = time.time()
+        desborde = []
+        for alerta in alertas:
+            asunto, cuerpo = _texto(alerta)
+            for canal in (c.strip().lower() for c in alerta["tipo_recepcion"].split(",")):
+                if canal not in self._colas or not alerta.get("destinatarios"):
+                    self.descartados += len(alerta.get("destinatarios") or [None])
+                    continue
+                for destinatario in alerta["destinatarios"]:
+                    mensaje = {
+                        "canal": canal,
+                        "destinatario": destinatario,
+                        "asunto": asunto,
+                        "cuerpo": cuerpo,
+                        "campaña_id": alerta["campaña_id"],
+                        "creado": creado,
+                        "intentos": 0,
+                    }
+                    try:
+                        self._colas[canal].put_nowait(mensaje)
+                    except asyncio.QueueFull:
+                        desborde.append(mensaje)
+        if desborde:
+            # Contrapresión: lo que no cabe espera en Mongo en vez de crecer en memoria
+            self.desbordados += len(desborde)
+            self._en_segundo_plano(self._guardar_reintentos(desborde, reintento=False))
+
+    def _en_segundo_plano(self, corrutina):
+        tarea = asyncio.create_task(corrutina)
+        self._pendientes.add(tarea)
+        tarea.add_done_callback(self._pendientes.discard)
+
+    async def _siguiente_lote(self, cola: asyncio.Queue, tamaño: int) -> List[dict]:
+        lote = [await cola.get()]
+        limite = time.monotonic() + ALERTAS_INTERVALO_LOTE_S
+        while len(lote) < tamaño:
+            try:
+                lote.append(cola.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(await asyncio.wait_for(cola.get(), restante))
+            except asyncio.TimeoutError:
+                break
+        return lote
+
+    async def _trabajador(self, nombre: str):
+        canal = self.canales[nombre]
+        cola = self._colas[nombre]
+        tamaño = CANALES[nombre]["lote"]
+        while True:
+            lote = await self._siguiente_lote(cola, tamaño)
+            await self._limites[nombre].esperar(len(lote))
+            try:
+                fallidos = await canal.enviar(lote)
+            except Exception:
+                logging.exception(f"Error enviando alertas por {nombre}")
+                fallidos = lote
+            self._contar_enviados(nombre, lote, fallidos)
+            if fallidos:
+                await self._guardar_reintentos(fallidos, reintento=True)
+
+    def _contar_enviados(self, nombre: str, lote: List[dict], fallidos: List[dict]):
+        enviados = len(lote) - len(fallidos)
+        if not enviados:
+            return
+        ahora = time.time()
+        fallidos_ids = {id(m) for m in fallidos}
+        for mensaje in lote:
+            if id(mensaje) in fallidos_ids:
+                continue
+            retraso = ahora - mensaje["creado"]
+            self.ultimo_retraso_s = retraso
+            self.maximo_retraso_s = max(self.maximo_retraso_s, retraso)
+            self._suma_retraso_s += retraso
+        self.enviados[nombre] += enviados
+        self._enviados_recientes.append((time.monotonic(), enviados))
+
+    # -----------------------------------------------
+    async def _guardar_reintentos(self, mensajes: List[dict], reintento: bool):
+        ahora = datetime.utcnow()
+        documentos = []
+        for mensaje in mensajes:
+            if reintento:
+                mensaje["intentos"] += 1
+                if mensaje.pop("permanente", False):
+                    self.fallidos += 1
+                    logging.error(f"Alerta a {mensaje['destinatario']} por {mensaje['canal']} rechazada de forma permanente")
+                    continue
+                if mensaje["intentos"] >= ALERTAS_MAX_INTENTOS:
+                    self.fallidos += 1
+                    logging.error(f"Alerta a {mensaje['destinatario']} por {mensaje['canal']} descartada tras {mensaje['intentos']} intentos")
+                    continue
+                self.reintentos += 1
+                # Espera exponencial con jitter para no reintentar todos juntos
+                espera = min(ALERTAS_ESPERA_MAXIMA_S, ALERTAS_ESPERA_BASE_S * 2 ** (mensaje["intentos"] - 1))
+                proximo = ahora + timedelta(seconds=espera * random.uniform(0.5, 1.0))
+            else:
+                proximo = ahora
+            documentos.append({**mensaje, "proximo_intento": proximo})
+        if not documentos:
+            return
+        try:
+            await get_db_async()[COLECCION_REINTENTOS].insert_many(documentos, ordered=False)
+        except PyMongoError:
+            logging.exception(f"No se pudieron guardar {len(documentos)} alertas para reintento")
+
+    async def _recuperar_reintentos(self):
+        coleccion = get_db_async()[COLECCION_REINTENTOS]
+        while True:
+            await asyncio.sleep(ALERTAS_REVISION_REINTENTOS_S)
+            try:
+                for nombre, cola in self._colas.items():
+                    # Solo se saca de Mongo lo que cabe en la cola del canal
+                    while not cola.full():
+                        documento = await coleccion.find_one_and_delete(
+                            {"canal": nombre, "proximo_intento": {"$lte": datetime.utcnow()}},
+                            sort=[("proximo_intento", 1)],
+                        )
+                        if documento is None:
+                            break
+                        documento.pop("_id", None)
+                        documento.pop("proximo_intento", None)
+                        cola.put_nowait(documento)
+            except PyMongoError:
+                logging.exception("No se pudieron leer las alertas pendientes de reintento")
+
+    # -----------------------------------------------
+    async def _crear_indice(self):
+        try:
+            await get_db_async()[COLECCION_REINTENTOS].create_index([("canal", 1), ("proximo_intento", 1)])
+        except PyMongoError:
+            logging.exception("No se pudo crear el índice de reintentos de alertas")
+
+    def iniciar(self):
+        if self._tareas:
+            return
+        self._en_segundo_plano(self._crear_indice())
+        for nombre in self.canales:
+            for _ in range(CANALES[nombre]["trabajadores"]):
+                self._tareas.append(asyncio.create_task(self._trabajador(nombre)))
+        self._tareas.append(asyncio.create_task(self._recuperar_reintentos()))
+
+    async def detener(self):
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas = []
+        # Lo que quedó en memoria se guarda para el próximo arranque
+        pendientes = []
+        for cola in self._colas.values():
+            while not cola.empty():
+                pendientes.append(cola.get_nowait())
+        if pendientes:
+            await self._guardar_reintentos(pendientes, reintento=False)
+        await asyncio.gather(*self._pendientes, return_exceptions=True)
+        for canal in self.canales.values():
+            await canal.cerrar()
+
+    def estadisticas(self) -> dict:
+        ahora = time.monotonic()
+        while self._enviados_recientes and ahora - self._enviados_recientes[0][0] > VENTANA_RENDIMIENTO_S:
+            self._enviados_recientes.popleft()
+        total = sum(self.enviados.values())
+        return {
+            "enviados": dict(self.enviados),
+            "en_cola": {nombre: cola.qsize() for nombre, cola in self._colas.items()},
+            "reintentos_programados": self.reintentos,
+            "fallidos": self.fallidos,
+            "descartados": self.descartados,
+            "desbordados_a_mongo": self.desbordados,
+            "mensajes_por_segundo": sum(n for _, n in self._enviados_recientes) / VENTANA_RENDIMIENTO_S,
+            "ultimo_retraso_s": self.ultimo_retraso_s,
+            "maximo_retraso_s": self.maximo_retraso_s,
+            "promedio_retraso_s": self._suma_retraso_s / total if total else 0.0,
+        }
+
+def crear_canales() -> Dict[str, object]:
+    """
+    Canales configurados; SMS y push solo si tienen URL de proveedor.
+    """
+    canales = {"correo": CanalCorreo(CANALES["correo"]["trabajadores"])}
+    if ALERTAS_SMS_URL:
+        canales["sms"] = CanalHTTP(ALERTAS_SMS_URL, CANALES["sms"]["trabajadores"])
+    if ALERTAS_PUSH_URL:
+        canales["push"] = CanalHTTP(ALERTAS_PUSH_URL, CANALES["push"]["trabajadores"])
+    return canales
+
+ENTREGA_ALERTAS = EntregaAlertas(crear_canales(), ALERTAS_CAPACIDAD_COLA)
@@ -0,0 +1,116 @@
+from fastapi import Request, Response
+from typing import Optional, Tuple
+import asyncio
+import os
+import re
+
+from almacen_medios import MEDIOS_RUTA
+
+# ---------------------------------------------------
+# Si hay un nginx delante, MEDIOS_X_ACCEL_PREFIJO (p. ej. "/_medios/") hace que
+# él envíe el archivo con sendfile y resuelva los Range; Python solo pone cabeceras
+MEDIOS_X_ACCEL_PREFIJO = os.getenv("MEDIOS_X_ACCEL_PREFIJO")
+# El contenido de una pieza nunca cambia: uno nuevo es otra pieza
+CACHE_INMUTABLE = "public, max-age=31536000, immutable"
+TAMANO_LECTURA = 256 * 1024
+RANGO = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def coincide_etag(cabecera: Optional[str], etag: str) -> bool:
+    if not cabecera:
+        return False
+    for valor in cabecera.split(","):
+        valor = valor.strip()
+        if valor == "*" or valor.removeprefix("W/") == etag:
+            return True
+    return False
+
+def rango_pedido(cabecera: Optional[str], tamaño: int) -> Optional[Tuple[int, int]]:
+    """
+    (inicio, fin) inclusivo de un Range de un solo tramo, None si no aplica.
+    Lanza ValueError si el rango no se puede satisfacer.
+    """
+    if not cabecera:
+        return None
+    coincidencia = RANGO.match(cabecera.strip())
+    if not coincidencia:
+        # Varios tramos o unidades desconocidas: se ignora y va el archivo completo
+        return None
+    desde, hasta = coincidencia.groups()
+    if not desde:
+        if not hasta or int(hasta) == 0:
+            raise ValueError
+        return max(0, tamaño - int(hasta)), tamaño - 1
+    inicio = int(desde)
+    fin = min(int(hasta), tamaño - 1) if hasta else tamaño - 1
+    if inicio >= tamaño or fin < inicio:
+        raise ValueError
+    return inicio, fin
+
+# ---------------------------------------------------
+class RespuestaArchivo(Response):
+    """
+    Envía un tramo de archivo sin cargarlo en memoria: con la extensión ASGI
+    "http.response.zerocopysend" (sendfile) si el servidor la ofrece, y si no
+    con os.pread en bloques de TAMANO_LECTURA.
+    """
+
+    def __init__(self, ruta: str, inicio: int, cuenta: int, status_code: int, headers: dict, solo_encabezados: bool):
+        self.ruta = ruta
+        self.inicio = inicio
+        self.cuenta = cuenta
+        self.solo_encabezados = solo_encabezados
+        self.status_code = status_code
+        self.background = None
+        self.init_headers({**headers, "content-length": str(cuenta)})
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.solo_encabezados or not self.cuenta:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        fd = await asyncio.to_thread(os.open, self.ruta, os.O_RDONLY)
+        try:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": fd, "offset": self.inicio, "count": self.cuenta})
+                return
+            posicion, restante = self.inicio, self.cuenta
+            while restante:
+                bloque = await asyncio.to_thread(os.pread, fd, min(TAMANO_LECTURA, restante), posicion)
+                if not bloque:
+                    break
+                posicion += len(bloque)
+                restante -= len(bloque)
+                await send({"type": "http.response.body", "body": bloque, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            os.close(fd)
+
+def responder_archivo(request: Request, ruta: str, etag: str, tipo_contenido: str) -> Response:
+    """
+    Respuesta para GET/HEAD de un archivo con ETag fuerte, 304, Range y 416.
+    """
+    encabezados = {"etag": etag, "cache-control": CACHE_INMUTABLE, "accept-ranges": "bytes"}
+    if coincide_etag(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=encabezados)
+
+    encabezados["content-type"] = tipo_contenido
+    if MEDIOS_X_ACCEL_PREFIJO:
+        relativa = os.path.relpath(ruta, MEDIOS_RUTA).replace(os.sep, "/")
+        return Response(headers={**encabezados, "x-accel-redirect": MEDIOS_X_ACCEL_PREFIJO + relativa})
+
+    tamaño = os.path.getsize(ruta)
+    rango = None
+    # If-Range: el tramo solo vale si el cliente tiene la misma versión
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range == etag:
+        try:
+            rango = rango_pedido(request.headers.get("range"), tamaño)
+        except ValueError:
+            return Response(status_code=416, headers={**encabezados, "content-range": f"bytes */{tamaño}"})
+
+    solo_encabezados = request.method == "HEAD"
+    if rango is None:
+        return RespuestaArchivo(ruta, 0, tamaño, 200, encabezados, solo_encabezados)
+    inicio, fin = rango
+    encabezados["content-range"] = f"bytes {inicio}-{fin}/{tamaño}"
+    return RespuestaArchivo(ruta, inicio, fin - inicio + 1, 206, encabezados, solo_encabezados)
@@ -0,0 +1,132 @@
+"""
+Prueba de estrés de los contadores de presupuesto contra un Mongo real.
+
+Lanza `workers` procesos, cada uno con sus propios ContadoresPresupuesto y
+su ColaEventos, que sirven sin pausa la misma campaña (consultando
+`agotado` antes de cada impresión) hasta que ya no queda nada por reservar.
+El cargo de cada impresión se encola como evento y llega a los contadores
+cuando la cola vacía el lote, igual que en eventos.py. Mientras tanto el
+proceso principal mide cuánto va atrasado el gasto en Mongo.
+
+Verifica las cotas de ritmo_presupuesto:
+  - gasto total <= presupuesto + por worker, latencia de la cola ×
+    impresiones/s × cargo máximo (más un cargo);
+  - al detener, Mongo tiene exactamente lo que gastaron los workers;
+  - el atraso de Mongo no supera lo gastado en RITMO_INTERVALO_S más la
+    latencia de la cola (con holgura).
+
+Los eventos de prueba quedan en la colección "eventos" y se borran al terminar.
+
+Uso (desde Inmax/, con MONGO_URI apuntando a una base de prueba):
+    python estres_presupuesto.py [workers] [presupuesto] [cargo_maximo]
+"""
+import asyncio
+import multiprocessing
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from pymongo import MongoClient
+
+import db
+from eventos import EVENTOS_CAPACIDAD, EVENTOS_INTERVALO_S, EVENTOS_TAMANO_LOTE, ColaEventos
+from ritmo_presupuesto import COLECCION_PRESUPUESTOS, RITMO_INTERVALO_S, ContadoresPresupuesto
+
+WORKERS = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+PRESUPUESTO = float(sys.argv[2]) if len(sys.argv) > 2 else 100_000.0
+CARGO_MAXIMO = float(sys.argv[3]) if len(sys.argv) > 3 else 5.0
+CAMPAÑA = -1
+
+
+async def gastar_hasta_agotar(total_local, fraccion_cupo):
+    contadores = ContadoresPresupuesto(RITMO_INTERVALO_S, fraccion_cupo)
+    cola = ColaEventos(EVENTOS_TAMANO_LOTE, EVENTOS_INTERVALO_S, EVENTOS_CAPACIDAD)
+    cola.registrar_consumidor(contadores.registrar_eventos)
+    contadores.iniciar()
+    cola.iniciar()
+    gastado = 0.0
+    impresiones = 0
+    inicio = time.perf_counter()
+    while not contadores.sin_presupuesto(CAMPAÑA):
+        if contadores.agotado(CAMPAÑA):
+            await asyncio.sleep(0.001)
+            continue
+        cargo = random.uniform(0.01, CARGO_MAXIMO)
+        # Se sirve ya; el cargo llega a los contadores cuando la cola vacía el lote
+        while not cola.encolar([{"tipo": "impresion", "fecha": datetime.utcnow(), "campaña_id": CAMPAÑA, "costo": cargo}]):
+            await asyncio.sleep(0.001)
+        gastado += cargo
+        impresiones += 1
+        with total_local.get_lock():
+            total_local.value += cargo
+        # Cede el loop como lo haría un servidor entre peticiones
+        await asyncio.sleep(0)
+    duracion = time.perf_counter() - inicio
+    await cola.detener()
+    await contadores.detener()
+    return gastado, impresiones / duracion
+
+
+def worker(total_local, fraccion_cupo, resultados):
+    resultados.put(asyncio.run(gastar_hasta_agotar(total_local, fraccion_cupo)))
+
+
+def main():
+    coleccion = MongoClient(db.MONGO_URI)[db.MONGO_DB][COLECCION_PRESUPUESTOS]
+    ahora = datetime.utcnow()
+    coleccion.replace_one(
+        {"_id": CAMPAÑA},
+        {"presupuesto": PRESUPUESTO, "gastado": 0.0, "reservado": 0.0, "fecha_inicio": ahora, "fecha_fin": ahora + timedelta(days=1)},
+        upsert=True,
+    )
+    contexto = multiprocessing.get_context("spawn")
+    total_local = contexto.Value("d", 0.0)
+    resultados = contexto.Queue()
+    # Cupos chicos para que los workers compitan por muchas reservas
+    procesos = [contexto.Process(target=worker, args=(total_local, 0.001, resultados)) for _ in range(WORKERS)]
+    inicio = time.perf_counter()
+    for proceso in procesos:
+        proceso.start()
+
+    atraso_maximo = 0.0
+    tasa_maxima = 0.0
+    anterior = (time.perf_counter(), 0.0)
+    while any(proceso.is_alive() for proceso in procesos) and resultados.qsize() < WORKERS:
+        time.sleep(0.05)
+        local = total_local.value
+        en_mongo = coleccion.find_one({"_id": CAMPAÑA})["gastado"]
+        atraso_maximo = max(atraso_maximo, local - en_mongo)
+        ahora_s = time.perf_counter()
+        tasa_maxima = max(tasa_maxima, (local - anterior[1]) / (ahora_s - anterior[0]))
+        anterior = (ahora_s, local)
+    gastados, tasas = zip(*(resultados.get() for _ in range(WORKERS)))
+    for proceso in procesos:
+        proceso.join()
+    duracion = time.perf_counter() - inicio
+
+    documento = coleccion.find_one({"_id": CAMPAÑA})
+    total = sum(gastados)
+    exceso = total - PRESUPUESTO
+    # Lo que cada worker sirve mientras su cargo espera en la cola (un lote
+    # completo o EVENTOS_INTERVALO_S, con holgura por el vaciado mismo)
+    latencia_cola = EVENTOS_INTERVALO_S * 2
+    cota_exceso = sum((tasa * latencia_cola + 1) * CARGO_MAXIMO for tasa in tasas)
+    # Lo que se puede gastar en un intervalo de escritura más la cola, con holgura
+    cota_atraso = tasa_maxima * (RITMO_INTERVALO_S * 2 + latencia_cola) + WORKERS * CARGO_MAXIMO
+    print(f"{WORKERS} workers, {duracion:.1f} s, {total / duracion:,.0f} de gasto/s, "
+          f"{sum(tasas) / WORKERS:,.0f} impresiones/s por worker")
+    print(f"gastado {total:,.2f} de {PRESUPUESTO:,.2f}  exceso {exceso:,.2f} (cota {cota_exceso:,.2f})")
+    print(f"en Mongo {documento['gastado']:,.2f}  reservado {documento['reservado']:,.2f}")
+    print(f"atraso máximo de Mongo {atraso_maximo:,.2f} (cota {cota_atraso:,.2f})")
+    coleccion.delete_one({"_id": CAMPAÑA})
+    coleccion.database["eventos"].delete_many({"campaña_id": CAMPAÑA})
+
+    assert exceso <= cota_exceso, "el gasto superó la cota de exceso"
+    assert abs(documento["gastado"] - total) < 1e-6 * max(1.0, total), "Mongo no tiene todo el gasto"
+    assert atraso_maximo <= cota_atraso, "el atraso de Mongo superó la cota"
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+import asyncio
+import logging
+import os
+import time
+
+import numpy as np
+from pymongo.errors import BulkWriteError, PyMongoError
+
+# ---------------------------------------------------
+ALERTAS_INTERVALO_S = float(os.getenv("ALERTAS_INTERVALO_S", "5.0"))
+# Una alerta disparada se rearma cuando el valor baja de umbral * (1 - histéresis)
+ALERTAS_HISTERESIS = float(os.getenv("ALERTAS_HISTERESIS", "0.05"))
+ALERTAS_RECIENTES = 1000
+# Cada cuánto se releen las configuraciones que otros workers guardaron
+ALERTAS_SINCRONIZACION_S = float(os.getenv("ALERTAS_SINCRONIZACION_S", "30"))
+CAPACIDAD_INICIAL = 1024
+COLECCION_CONFIGURACIONES = "alertas_configuracion"
+# Un documento por (campaña, métrica) mientras la alerta está disparada
+COLECCION_DISPARADAS = "alertas_disparadas"
+DUPLICADO = 11000
+
+# Columnas de la matriz de valores y umbrales
+PRECIO, USO = range(2)
+METRICAS = ("precio", "uso")
+
+ANUNCIANTE_GENERAL = "general"
+
+def _clave(campaña_id: str, tipo_alerta: str) -> str:
+    return f"{campaña_id}:{tipo_alerta}"
+
+# ---------------------------------------------------
+class EvaluadorAlertas:
+    """
+    Estado de todas las campañas en arreglos columnares y reglas por
+    anunciante (umbrales de precio y uso, ubicaciones y tipo de recepción).
+
+    Cada tick compara todas las campañas contra sus umbrales con operaciones
+    de NumPy. Una alerta se dispara una vez al cruzar el umbral y no se
+    repite hasta que el valor vuelve a bajar de la banda de histéresis.
+
+    Configuraciones y alertas disparadas se guardan en Mongo: sobreviven a
+    un reinicio y una alerta que ya disparó un worker no la repite otro.
+    Los valores de las campañas no: llegan por PUT /avisador/campañas/estado.
+    """
+
+    def __init__(self, intervalo: float, histeresis: float):
+        self.intervalo = intervalo
+        self.histeresis = histeresis
+        self._slots: Dict[str, int] = {}
+        self._libres: List[int] = []
+        self._ids: List[Optional[str]] = []
+        self._n = 0
+        self._valores = np.full((CAPACIDAD_INICIAL, 2), np.nan)
+        self._anunciante = np.zeros(CAPACIDAD_INICIAL, dtype=np.int32)
+        self._ubicacion = np.zeros(CAPACIDAD_INICIAL, dtype=np.int32)
+        self._activa = np.zeros(CAPACIDAD_INICIAL, dtype=bool)
+        self._disparada = np.zeros((CAPACIDAD_INICIAL, 2), dtype=bool)
+        # Disparadas leídas de Mongo para campañas que aún no reportan estado
+        self._guardadas: Dict[str, List[bool]] = {}
+        # Claves rearmadas que falta borrar de Mongo
+        self._rearmes: List[str] = []
+        # Anunciantes y ubicaciones se guardan como índices
+        self._anunciantes: Dict[str, int] = {ANUNCIANTE_GENERAL: 0}
+        self._nombres_anunciantes: List[str] = [ANUNCIANTE_GENERAL]
+        self._ubicaciones: Dict[str, int] = {}
+        self._nombres_ubicaciones: List[str] = []
+        self._configuraciones: Dict[str, dict] = {}
+        self._reglas_vigentes = False
+        self._umbrales = np.zeros((1, 2))
+        self._permitidas = np.zeros((1, 1), dtype=bool)
+        self._destinos: List[Callable[[List[dict]], None]] = []
+        self.recientes: deque = deque(maxlen=ALERTAS_RECIENTES)
+        self._tarea: Optional[asyncio.Task] = None
+        self._db_fabrica = None
+        self.ticks = 0
+        self.disparadas = 0
+        self.ultimo_tick_ms = 0.0
+        self.maximo_tick_ms = 0.0
+        self._suma_tick_ms = 0.0
+
+    # -----------------------------------------------
+    # Reglas
+    def _indice(self, indices: Dict[str, int], nombres: List[str], nombre: str) -> int:
+        indice = indices.get(nombre)
+        if indice is None:
+            indice = indices[nombre] = len(nombres)
+            nombres.append(nombre)
+            self._reglas_vigentes = False
+        return indice
+
+    def configurar(self, anunciante: str, configuracion: dict):
+        if self._configuraciones.get(anunciante) == configuracion:
+            return
+        self._configuraciones[anunciante] = dict(configuracion)
+        self._indice(self._anunciantes, self._nombres_anunciantes, anunciante)
+        for ubicacion in configuracion["ubicaciones"]:
+            self._indice(self._ubicaciones, self._nombres_ubicaciones, ubicacion)
+        self._reglas_vigentes = False
+
+    def configuracion(self, anunciante: str) -> dict:
+        """
+        Configuración del anunciante, o la general si no tiene una propia.
+        """
+        return self._configuraciones.get(anunciante) or self._configuraciones[ANUNCIANTE_GENERAL]
+
+    def _compilar_reglas(self):
+        # Umbrales (anunciantes x métricas) y ubicaciones permitidas (anunciantes x ubicaciones)
+        umbrales = np.empty((len(self._nombres_anunciantes), 2))
+        permitidas = np.zeros((len(self._nombres_anunciantes), max(1, len(self._nombres_ubicaciones))), dtype=bool)
+        for indice, anunciante in enumerate(self._nombres_anunciantes):
+            configuracion = self.configuracion(anunciante)
+            umbrales[indice] = (configuracion["umbral_precio"], configuracion["umbral_uso"])
+            for ubicacion in configuracion["ubicaciones"]:
+                permitidas[indice, self._ubicaciones[ubicacion]] = True
+        self._umbrales = umbrales
+        self._permitidas = permitidas
+        self._reglas_vigentes = True
+
+    # -----------------------------------------------
+    # Campañas
+    def _crecer(self):
+        capacidad = len(self._activa) * 2
+        valores = np.full((capacidad, 2), np.nan)
+        valores[:self._n] = self._valores[:self._n]
+        self._valores = valores
+        for nombre in ("_anunciante", "_ubicacion", "_activa", "_disparada"):
+            actual = getattr(self, nombre)
+            nuevo = np.zeros((capacidad,) + actual.shape[1:], dtype=actual.dtype)
+            nuevo[:self._n] = actual[:self._n]
+            setattr(self, nombre, nuevo)
+
+    def _slot(self, campaña_id: str) -> int:
+        slot = self._slots.get(campaña_id)
+        if slot is not None:
+            return slot
+        if self._libres:
+            slot = self._libres.pop()
+            self._ids[slot] = campaña_id
+        else:
+            if self._n == len(self._activa):
+                self._crecer()
+            slot = self._n
+            self._n += 1
+            self._ids.append(campaña_id)
+        self._slots[campaña_id] = slot
+        self._valores[slot] = np.nan
+        self._disparada[slot] = self._guardadas.pop(campaña_id, False)
+        self._activa[slot] = True
+        return slot
+
+    def actualizar(self, campaña_id: str, anunciante: str, ubicacion: str,
+                   precio: Optional[float] = None, uso: Optional[float] = None):
+        """
+        Registra el valor actual de una campaña; las métricas en None no cambian.
+        """
+        slot = self._slot(campaña_id)
+        self._anunciante[slot] = self._indice(self._anunciantes, self._nombres_anunciantes, anunciante)
+        self._ubicacion[slot] = self._indice(self._ubicaciones, self._nombres_ubicaciones, ubicacion)
+        if precio is not None:
+            self._valores[slot, PRECIO] = precio
+        if uso is not None:
+            self._valores[slot, USO] = uso
+
+    def eliminar(self, campaña_id: str):
+        slot = self._slots.pop(campaña_id, None)
+        if slot is not None:
+            self._activa[slot] = False
+            self._ids[slot] = None
+            self._libres.append(slot)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    # -----------------------------------------------
+    # Evaluación
+    def registrar_destino(self, destino: Callable[[List[dict]], None]):
+        """
+        Registra una función que recibe cada lote de alertas nuevas.
+        """
+        self._destinos.append(destino)
+
+    def evaluar(self) -> List[dict]:
+        """
+        Un tick: compara todas las campañas contra los umbrales de su
+        anunciante y retorna solo las alertas que se disparan ahora, sin
+        publicarlas (eso lo hace `tick`, tras marcarlas en Mongo).
+        """
+        inicio = time.perf_counter()
+        if not self._reglas_vigentes:
+            self._compilar_reglas()
+        n = self._n
+        valores = self._valores[:n]
+        anunciantes = self._anunciante[:n]
+        umbrales = self._umbrales[anunciantes]
+        aplica = (self._activa[:n] & self._permitidas[anunciantes, self._ubicacion[:n]])[:, None]
+        # Comparaciones con NaN (métrica sin reportar) son False
+        sobre = aplica & (valores > umbrales)
+        rearmadas = ~aplica | (valores < umbrales * (1.0 - self.histeresis))
+        disparada = self._disparada[:n]
+        nuevas = sobre & ~disparada
+        for fila, metrica in zip(*np.nonzero(disparada & rearmadas)):
+            self._rearmes.append(_clave(self._ids[fila], METRICAS[metrica]))
+        disparada |= nuevas
+        disparada &= ~rearmadas
+        filas, metricas = np.nonzero(nuevas)
+
+        fecha = datetime.utcnow()
+        alertas = []
+        for fila, metrica in zip(filas.tolist(), metricas.tolist()):
+            anunciante = self._nombres_anunciantes[anunciantes[fila]]
+            configuracion = self.configuracion(anunciante)
+            alertas.append({
+                "campaña_id": self._ids[fila],
+                "anunciante": anunciante,
+                "tipo_alerta": METRICAS[metrica],
+                "valor_actual": float(valores[fila, metrica]),
+                "umbral": float(umbrales[fila, metrica]),
+                "ubicacion": self._nombres_ubicaciones[self._ubicacion[fila]],
+                "tipo_recepcion": configuracion["tipo_recepcion"],
+                "destinatarios": configuracion.get("destinatarios", []),
+                "fecha": fecha,
+            })
+
+        duracion = (time.perf_counter() - inicio) * 1000
+        self.ticks += 1
+        self.ultimo_tick_ms = duracion
+        self.maximo_tick_ms = max(self.maximo_tick_ms, duracion)
+        self._suma_tick_ms += duracion
+        return alertas
+
+    def publicar(self, alertas: List[dict]):
+        self.disparadas += len(alertas)
+        self.recientes.extend(alertas)
+        for destino in self._destinos:
+            try:
+                destino(alertas)
+            except Exception:
+                logging.exception("Error en destino de alertas")
+
+    # -----------------------------------------------
+    # Mongo
+    async def cargar_configuraciones(self, db):
+        async for documento in db[COLECCION_CONFIGURACIONES].find():
+            self.configurar(documento.pop("_id"), documento)
+
+    async def cargar(self, db):
+        """
+        Configuraciones y alertas que quedaron disparadas. Las de campañas
+        que aún no reportan estado se aplican con su primer reporte.
+        """
+        await self.cargar_configuraciones(db)
+        async for documento in db[COLECCION_DISPARADAS].find():
+            if documento.get("tipo_alerta") not in METRICAS:
+                continue
+            metrica = METRICAS.index(documento["tipo_alerta"])
+            slot = self._slots.get(documento["campaña_id"])
+            if slot is not None:
+                self._disparada[slot, metrica] = True
+            else:
+                self._guardadas.setdefault(documento["campaña_id"], [False, False])[metrica] = True
+
+    async def guardar_configuracion(self, db, anunciante: str, configuracion: dict):
+        await db[COLECCION_CONFIGURACIONES].replace_one({"_id": anunciante}, configuracion, upsert=True)
+        self.configurar(anunciante, configuracion)
+
+    async def marcar(self, db, alertas: List[dict]) -> List[dict]:
+        """
+        Borra de Mongo las alertas rearmadas y marca las nuevas. Retorna solo
+        las que nadie había marcado: si ya las disparó otro worker, o este
+        antes de reiniciarse, no se repiten. Sin Mongo se retornan todas.
+        """
+        coleccion = db[COLECCION_DISPARADAS]
+        rearmes, self._rearmes = self._rearmes, []
+        if rearmes:
+            try:
+                await coleccion.delete_many({"_id": {"$in": rearmes}})
+            except PyMongoError:
+                logging.exception(f"No se pudieron rearmar {len(rearmes)} alertas en Mongo")
+                # Van antes que las nuevas del próximo tick, que pueden tener la misma clave
+                self._rearmes[:0] = rearmes
+        if not alertas:
+            return alertas
+        documentos = [
+            {"_id": _clave(a["campaña_id"], a["tipo_alerta"]), "campaña_id": a["campaña_id"], "tipo_alerta": a["tipo_alerta"], "fecha": a["fecha"]}
+            for a in alertas
+        ]
+        try:
+            await coleccion.insert_many(documentos, ordered=False)
+        except BulkWriteError as e:
+            repetidas = {error["index"] for error in e.details.get("writeErrors", []) if error.get("code") == DUPLICADO}
+            alertas = [alerta for indice, alerta in enumerate(alertas) if indice not in repetidas]
+            if len(repetidas) < len(e.details.get("writeErrors", [])):
+                logging.error(f"No se pudieron marcar algunas alertas en Mongo: {e.details}")
+        except PyMongoError:
+            # Mejor una alerta repetida que una perdida
+            logging.exception(f"No se pudieron marcar {len(alertas)} alertas en Mongo")
+        return alertas
+
+    async def tick(self) -> List[dict]:
+        alertas = self.evaluar()
+        if self._db_fabrica is not None:
+            alertas = await self.marcar(self._db_fabrica(), alertas)
+        if alertas:
+            self.publicar(alertas)
+        return alertas
+
+    async def _ciclo(self):
+        ultima_carga = time.monotonic()
+        while True:
+            await asyncio.sleep(self.intervalo)
+            if time.monotonic() - ultima_carga >= ALERTAS_SINCRONIZACION_S:
+                ultima_carga = time.monotonic()
+                try:
+                    await self.cargar_configuraciones(self._db_fabrica())
+                except PyMongoError:
+                    logging.exception("No se pudieron leer las configuraciones de alertas")
+            try:
+                await self.tick()
+            except Exception:
+                logging.exception("Error evaluando alertas")
+
+    async def iniciar(self, db_fabrica):
+        self._db_fabrica = db_fabrica
+        try:
+            await self.cargar(db_fabrica())
+        except PyMongoError:
+            logging.exception("No se pudieron leer las alertas desde Mongo")
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._ciclo())
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+
+    def estadisticas(self) -> dict:
+        return {
+            "campañas": len(self._slots),
+            "anunciantes": len(self._nombres_anunciantes),
+            "reglas": len(self._slots) * len(METRICAS),
+            "ticks": self.ticks,
+            "alertas_disparadas": self.disparadas,
+            "ultimo_tick_ms": self.ultimo_tick_ms,
+            "maximo_tick_ms": self.maximo_tick_ms,
+            "promedio_tick_ms": self._suma_tick_ms / self.ticks if self.ticks else 0.0,
+            "intervalo_s": self.intervalo,
+        }
+
+EVALUADOR_ALERTAS = EvaluadorAlertas(ALERTAS_INTERVALO_S, ALERTAS_HISTERESIS)
@@ -0,0 +1,322 @@
+from fastapi import FastAPI, HTTPException, Path, Request, status
+from pydantic import BaseModel, Field, ValidationError
+from typing import Awaitable, Callable, List, Literal, Optional, Union
+from contextlib import asynccontextmanager
+from datetime import datetime
+import asyncio
+import inspect
+import json
+import logging
+import os
+
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from db import get_db_async
+from contadores_eventos import CONTADORES_EVENTOS, CONTADORES_GEO
+import frecuentes
+import teselas
+from ritmo_presupuesto import COLECCION_PRESUPUESTOS, CONTADORES_PRESUPUESTO, ritmo
+
+# ---------------------------------------------------
+# Configuración de la cola de ingesta
+EVENTOS_TAMANO_LOTE = int(os.getenv("EVENTOS_TAMANO_LOTE", "1000"))
+EVENTOS_INTERVALO_S = float(os.getenv("EVENTOS_INTERVALO_S", "1.0"))
+EVENTOS_CAPACIDAD = int(os.getenv("EVENTOS_CAPACIDAD", "100000"))
+EVENTOS_MAX_LOTE_PETICION = int(os.getenv("EVENTOS_MAX_LOTE_PETICION", "10000"))
+EVENTOS_REINTENTOS = int(os.getenv("EVENTOS_REINTENTOS", "3"))
+EVENTOS_ESPERA_REINTENTO_S = float(os.getenv("EVENTOS_ESPERA_REINTENTO_S", "0.5"))
+DUPLICADO = 11000
+
+# ---------------------------------------------------
+class Evento(BaseModel):
+    tipo: Literal["click", "impresion", "sesion", "conversion"] = Field(..., description="Tipo de interacción")
+    fecha: datetime = Field(default_factory=datetime.utcnow, description="Momento de la interacción (ISO, UTC)")
+    campaña_id: Optional[int] = Field(None, description="ID de la campaña")
+    pieza_id: Optional[int] = Field(None, description="ID de la pieza multimedia")
+    usuario_id: Optional[str] = Field(None, description="Identificador del usuario")
+    usuario_nuevo: bool = Field(False, description="Primera sesión registrada del usuario")
+    pais: Optional[str] = Field(None, description="País del usuario")
+    canal: Optional[str] = Field(None, description="Canal de adquisición (social, email, direct, ...)")
+    duracion: Optional[float] = Field(None, ge=0, description="Duración de la sesión en segundos")
+    lat: Optional[float] = Field(None, ge=-90, le=90, description="Latitud donde ocurrió la interacción")
+    lon: Optional[float] = Field(None, ge=-180, le=180, description="Longitud donde ocurrió la interacción")
+    ciudad: Optional[str] = Field(None, description="Ciudad donde ocurrió la interacción")
+    costo: Optional[float] = Field(None, ge=0, description="Costo cobrado a la campaña por la interacción")
+    valor: Optional[float] = Field(None, ge=0, description="Ingreso atribuido a una conversión")
+
+class EventosAceptadosResponse(BaseModel):
+    aceptados: int
+
+class EstadoPresupuesto(BaseModel):
+    campaña_id: int
+    agotado: bool = Field(..., description="True si este worker no debe servir la campaña")
+    disponible_local: float = Field(..., description="Cupo reservado que le queda a este worker")
+    pendiente_local: float = Field(..., description="Gasto de este worker aún no escrito en Mongo")
+
+class RitmoPresupuesto(BaseModel):
+    presupuesto: float
+    gastado: float
+    restante: float
+    reservado: float
+    gasto_por_hora: float
+    gasto_ideal_por_hora: float = Field(..., description="Gasto por hora que agota el presupuesto justo en fecha_fin")
+    horas_restantes: float
+    horas_hasta_agotar: Optional[float] = Field(None, description="Al gasto por hora actual; None si no hay gasto")
+    estado: str = Field(..., description="adelantado, en_ritmo, atrasado, agotado o finalizada")
+
+# ---------------------------------------------------
+class ColaEventos:
+    """
+    Cola en memoria que agrupa eventos y los escribe en Mongo con insert_many
+    cuando se junta un lote completo o vence el intervalo, lo que ocurra primero.
+
+    Los consumidores reciben cada lote recién cuando quedó guardado. Si Mongo
+    falla se reintenta con espera creciente y, si sigue fallando, el lote
+    vuelve a la cola: lo que cuentan los consumidores siempre está en Mongo.
+    """
+
+    def __init__(self, tamano_lote: int, intervalo: float, capacidad: int):
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self.capacidad = capacidad
+        self._cola: asyncio.Queue = asyncio.Queue(maxsize=capacidad)
+        self._consumidores: List[Callable[[List[dict]], Union[None, Awaitable[None]]]] = []
+        self._escrituras: List[Callable[..., Awaitable[None]]] = []
+        self._tarea: Optional[asyncio.Task] = None
+
+    def registrar_consumidor(self, consumidor: Callable[[List[dict]], Union[None, Awaitable[None]]]):
+        """
+        Registra una función que recibe cada lote después de escribirlo en Mongo.
+        Si es una corrutina (p. ej. para escribir a disco en un hilo), se espera.
+        """
+        self._consumidores.append(consumidor)
+
+    def registrar_escritura(self, escritura: Callable[..., Awaitable[None]]):
+        """
+        Registra una corrutina `escritura(db, lote)` que corre después de guardar cada lote.
+        """
+        self._escrituras.append(escritura)
+
+    def encolar(self, eventos: List[dict]) -> bool:
+        """
+        Encola el lote completo o nada. Retorna False si la cola no tiene espacio.
+        """
+        if self._cola.qsize() + len(eventos) > self.capacidad:
+            return False
+        for evento in eventos:
+            self._cola.put_nowait(evento)
+        return True
+
+    async def _siguiente_lote(self) -> List[dict]:
+        lote = [await self._cola.get()]
+        loop = asyncio.get_running_loop()
+        limite = loop.time() + self.intervalo
+        while len(lote) < self.tamano_lote:
+            try:
+                lote.append(self._cola.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            restante = limite - loop.time()
+            if restante <= 0:
+                break
+            try:
+                lote.append(await asyncio.wait_for(self._cola.get(), restante))
+            except asyncio.TimeoutError:
+                break
+        return lote
+
+    async def _insertar(self, db, lote: List[dict]) -> bool:
+        espera = EVENTOS_ESPERA_REINTENTO_S
+        for intento in range(EVENTOS_REINTENTOS + 1):
+            try:
+                await db["eventos"].insert_many(lote, ordered=False)
+                return True
+            except BulkWriteError as e:
+                # insert_many ya asignó los _id: en un reintento lo guardado antes vuelve como duplicado
+                errores = e.details.get("writeErrors", [])
+                if errores and all(error["code"] == DUPLICADO for error in errores) and not e.details.get("writeConcernErrors"):
+                    return True
+                logging.warning(f"Intento {intento + 1} de guardar {len(lote)} eventos fallido: {e}")
+            except PyMongoError as e:
+                logging.warning(f"Intento {intento + 1} de guardar {len(lote)} eventos fallido: {e}")
+            if intento < EVENTOS_REINTENTOS:
+                await asyncio.sleep(espera)
+                espera *= 2
+        return False
+
+    async def _escribir(self, lote: List[dict], reencolar: bool = True):
+        db = get_db_async()
+        if not await self._insertar(db, lote):
+            if reencolar and self.encolar(lote):
+                logging.error(f"No se pudieron guardar {len(lote)} eventos; vuelven a la cola")
+            else:
+                logging.error(f"Se descartan {len(lote)} eventos que no se pudieron guardar")
+            return
+        for consumidor in self._consumidores:
+            try:
+                resultado = consumidor(lote)
+                if inspect.isawaitable(resultado):
+                    await resultado
+            except Exception:
+                logging.exception("Error en consumidor de eventos")
+        for escritura in self._escrituras:
+            try:
+                await escritura(db, lote)
+            except PyMongoError:
+                logging.exception(f"No se pudieron sumar {len(lote)} eventos a los contadores")
+
+    async def _vaciar(self):
+        while True:
+            lote = await self._siguiente_lote()
+            try:
+                await self._escribir(lote)
+            except Exception:
+                # El loop sigue: si muere, la cola se llena y la ingesta responde 429 para siempre
+                logging.exception(f"Error al escribir {len(lote)} eventos")
+
+    def iniciar(self):
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._vaciar())
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+        # Escribe lo que quedó pendiente antes de apagar
+        pendientes = []
+        while not self._cola.empty():
+            pendientes.append(self._cola.get_nowait())
+        for i in range(0, len(pendientes), self.tamano_lote):
+            await self._escribir(pendientes[i:i + self.tamano_lote], reencolar=False)
+
+cola_eventos = ColaEventos(EVENTOS_TAMANO_LOTE, EVENTOS_INTERVALO_S, EVENTOS_CAPACIDAD)
+cola_eventos.registrar_consumidor(frecuentes.registrar_eventos)
+cola_eventos.registrar_consumidor(teselas.registrar_eventos)
+cola_eventos.registrar_consumidor(CONTADORES_PRESUPUESTO.registrar_eventos)
+# Agregados, métricas y el índice geográfico los leen todos los procesos desde estos contadores
+cola_eventos.registrar_escritura(CONTADORES_EVENTOS.persistir)
+cola_eventos.registrar_escritura(CONTADORES_GEO.persistir)
+
+# ---------------------------------------------------
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Antes de vaciar la cola: la primera vez, los contadores se arman desde el historial
+    await CONTADORES_EVENTOS.preparar(get_db_async)
+    await CONTADORES_GEO.preparar(get_db_async)
+    cola_eventos.iniciar()
+    CONTADORES_PRESUPUESTO.iniciar()
+    sincronizacion = asyncio.create_task(frecuentes.sincronizar_periodicamente(get_db_async))
+    yield
+    sincronizacion.cancel()
+    await cola_eventos.detener()
+    await CONTADORES_PRESUPUESTO.detener()
+
+app = FastAPI(
+    title="API de Eventos de Interacción",
+    description="Ingesta de clics, impresiones y sesiones de usuarios en lotes.",
+    version="1.0.0",
+    lifespan=lifespan
+)
+
+def _validar(datos, linea: Optional[int] = None) -> dict:
+    try:
+        return Evento.parse_obj(datos).dict()
+    except ValidationError as e:
+        detalle = e.errors() if linea is None else {"linea": linea, "errores": e.errors()}
+        raise HTTPException(status_code=422, detail=detalle)
+
+async def _leer_ndjson(request: Request) -> List[dict]:
+    eventos = []
+    resto = b""
+    numero = 0
+    async for bloque in request.stream():
+        lineas = (resto + bloque).split(b"\n")
+        resto = lineas.pop()
+        for linea in lineas:
+            numero += 1
+            if linea.strip():
+                eventos.append(_validar(json.loads(linea), numero))
+            if len(eventos) > EVENTOS_MAX_LOTE_PETICION:
+                raise HTTPException(status_code=413, detail="El lote supera el máximo de eventos por petición.")
+    if resto.strip():
+        eventos.append(_validar(json.loads(resto), numero + 1))
+    return eventos
+
+# ---------------------------------------------------
+# POST /eventos
+@app.post(
+    "/eventos",
+    response_model=EventosAceptadosResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Registra uno o varios eventos de interacción (JSON o NDJSON)"
+)
+async def registrar_eventos(request: Request):
+    """
+    Acepta un evento JSON, una lista JSON de eventos o un lote NDJSON
+    (Content-Type: application/x-ndjson). Responde 429 si la cola está llena.
+    """
+    try:
+        if request.headers.get("content-type", "").startswith(("application/x-ndjson", "application/ndjson")):
+            eventos = await _leer_ndjson(request)
+        else:
+            datos = await request.json()
+            if isinstance(datos, list):
+                if len(datos) > EVENTOS_MAX_LOTE_PETICION:
+                    raise HTTPException(status_code=413, detail="El lote supera el máximo de eventos por petición.")
+                eventos = [_validar(d, i + 1) for i, d in enumerate(datos)]
+            else:
+                eventos = [_validar(datos)]
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="JSON inválido.")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="El cuerpo no es UTF-8 válido.")
+
+    if not cola_eventos.encolar(eventos):
+        raise HTTPException(
+            status_code=429,
+            detail="Cola de eventos llena, reintente más tarde.",
+            headers={"Retry-After": str(max(1, int(cola_eventos.intervalo)))}
+        )
+    return {"aceptados": len(eventos)}
+
+# Endpoint raíz de prueba
+@app.get("/", summary="API de Eventos funcionando correctamente")
+def read_root():
+    return {"message": "API de Eventos de Interacción lista y operativa."}
+
+# ---------------------------------------------------
+# GET /campañas/{id}/presupuesto
+@app.get("/campañas/{id}/presupuesto", response_model=EstadoPresupuesto, summary="¿Se puede seguir sirviendo la campaña?")
+async def estado_presupuesto(id: int = Path(..., description="ID de la campaña")):
+    """
+    Chequeo O(1) en memoria para el camino de servicio. Solo la primera
+    consulta de cada campaña va a Mongo, para no reservar cupo de ids que no
+    existen.
+    """
+    if not CONTADORES_PRESUPUESTO.conocida(id):
+        try:
+            existe = await CONTADORES_PRESUPUESTO.descubrir(id)
+        except PyMongoError:
+            raise HTTPException(status_code=503, detail="No se pudo leer el presupuesto.")
+        if not existe:
+            raise HTTPException(status_code=404, detail="Campaña sin presupuesto registrado.")
+    return {"campaña_id": id, **CONTADORES_PRESUPUESTO.local(id)}
+
+# GET /campañas/{id}/ritmo
+@app.get("/campañas/{id}/ritmo", response_model=RitmoPresupuesto, summary="Ritmo de gasto contra el presupuesto")
+async def ritmo_presupuesto(id: int = Path(..., description="ID de la campaña")):
+    """
+    Gasto por hora contra el presupuesto restante y el tiempo hasta fecha_fin.
+    """
+    try:
+        documento = await get_db_async()[COLECCION_PRESUPUESTOS].find_one({"_id": id})
+    except PyMongoError:
+        raise HTTPException(status_code=503, detail="No se pudo leer el presupuesto.")
+    if documento is None:
+        raise HTTPException(status_code=404, detail="Campaña sin presupuesto registrado.")
+    return ritmo(documento, CONTADORES_PRESUPUESTO.pendiente(id), datetime.utcnow())
@@ -0,0 +1,230 @@
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+import csv
+import io
+import logging
+import os
+import zlib
+from urllib.parse import quote
+
+import orjson
+
+from db import get_db
+
+# ---------------------------------------------------
+# Filas que se leen del cursor y se serializan de una vez (CSV / NDJSON)
+EXPORTACION_FILAS_LOTE = int(os.getenv("EXPORTACION_FILAS_LOTE", "10000"))
+# Filas por row group de Parquet: lo único que se tiene en memoria a la vez
+EXPORTACION_FILAS_GRUPO = int(os.getenv("EXPORTACION_FILAS_GRUPO", "65536"))
+FORMATOS = ("csv", "parquet", "ndjson")
+TIPOS_CONTENIDO = {"csv": "text/csv; charset=utf-8", "parquet": "application/vnd.apache.parquet", "ndjson": "application/x-ndjson"}
+
+# (columna del archivo, campo en Mongo, tipo)
+Columna = Tuple[str, str, str]
+
+class Reporte(NamedTuple):
+    coleccion: str
+    campo_fecha: str
+    campo_campaña: str
+    columnas: Tuple[Columna, ...]
+
+REPORTES: Dict[str, Reporte] = {
+    "eventos": Reporte("eventos", "fecha", "campaña_id", (
+        ("tipo", "tipo", "str"),
+        ("fecha", "fecha", "fecha"),
+        ("campaña_id", "campaña_id", "int"),
+        ("pieza_id", "pieza_id", "int"),
+        ("usuario_id", "usuario_id", "str"),
+        ("usuario_nuevo", "usuario_nuevo", "bool"),
+        ("pais", "pais", "str"),
+        ("canal", "canal", "str"),
+        ("ciudad", "ciudad", "str"),
+        ("lat", "lat", "float"),
+        ("lon", "lon", "float"),
+        ("duracion", "duracion", "float"),
+        ("costo", "costo", "float"),
+        ("valor", "valor", "float"),
+    )),
+    "campañas": Reporte("campañas", "fecha_inicio", "_id", (
+        ("id", "_id", "int"),
+        ("nombre", "nombre", "str"),
+        ("descripcion", "descripcion", "str"),
+        ("estado", "estado", "str"),
+        ("canal", "canal", "str"),
+        ("demografia", "demografia", "str"),
+        ("presupuesto", "presupuesto", "float"),
+        ("fecha_inicio", "fecha_inicio", "fecha"),
+        ("fecha_fin", "fecha_fin", "fecha"),
+    )),
+    "presupuestos": Reporte("presupuestos", "fecha_inicio", "_id", (
+        ("campaña_id", "_id", "int"),
+        ("presupuesto", "presupuesto", "float"),
+        ("gastado", "gastado", "float"),
+        ("reservado", "reservado", "float"),
+        ("fecha_inicio", "fecha_inicio", "fecha"),
+        ("fecha_fin", "fecha_fin", "fecha"),
+    )),
+}
+
+class ExportacionNoDisponible(Exception):
+    pass
+
+def verificar_formato(formato: str):
+    """
+    Lanza ExportacionNoDisponible si falta la dependencia del formato.
+    pyarrow se importa recién aquí: es pesado y solo lo usa Parquet.
+    """
+    if formato == "parquet":
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise ExportacionNoDisponible("La exportación a Parquet requiere pyarrow.")
+
+# ---------------------------------------------------
+# Lectura: un cursor de Mongo que se consume de a lotes
+def _lotes(reporte: Reporte, fecha_inicio: Optional[date], fecha_fin: Optional[date],
+           campaña_id: Optional[int], tamaño: int) -> Iterator[List[dict]]:
+    filtro: dict = {}
+    if fecha_inicio or fecha_fin:
+        filtro[reporte.campo_fecha] = {}
+        if fecha_inicio:
+            filtro[reporte.campo_fecha]["$gte"] = datetime.combine(fecha_inicio, time.min)
+        if fecha_fin:
+            # fecha_fin es inclusiva
+            filtro[reporte.campo_fecha]["$lt"] = datetime.combine(fecha_fin + timedelta(days=1), time.min)
+    if campaña_id is not None:
+        filtro[reporte.campo_campaña] = campaña_id
+    proyeccion = {campo: 1 for _, campo, _ in reporte.columnas}
+    if "_id" not in proyeccion:
+        proyeccion["_id"] = 0
+    # Cliente síncrono: el generador corre en el threadpool de Starlette, fuera del loop
+    cursor = get_db()[reporte.coleccion].find(filtro, proyeccion, batch_size=tamaño)
+    try:
+        lote = []
+        for documento in cursor:
+            lote.append(documento)
+            if len(lote) >= tamaño:
+                yield lote
+                lote = []
+        if lote:
+            yield lote
+    finally:
+        cursor.close()
+
+def _columnas(reporte: Reporte, lote: List[dict]) -> List[list]:
+    return [[documento.get(campo) for documento in lote] for _, campo, _ in reporte.columnas]
+
+# ---------------------------------------------------
+# Escritura: cada formato convierte lotes en bytes
+def _csv(reporte: Reporte, lotes: Iterable[List[dict]]) -> Iterator[bytes]:
+    fechas = [i for i, (_, _, tipo) in enumerate(reporte.columnas) if tipo == "fecha"]
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, lineterminator="\n")
+    escritor.writerow([columna for columna, _, _ in reporte.columnas])
+    for lote in lotes:
+        columnas = _columnas(reporte, lote)
+        for i in fechas:
+            columnas[i] = [valor.isoformat() if valor is not None else None for valor in columnas[i]]
+        escritor.writerows(zip(*columnas))
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    # Solo encabezado si no hubo filas
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+def _ndjson(reporte: Reporte, lotes: Iterable[List[dict]]) -> Iterator[bytes]:
+    nombres = [columna for columna, _, _ in reporte.columnas]
+    for lote in lotes:
+        filas = [dict(zip(nombres, fila)) for fila in zip(*_columnas(reporte, lote))]
+        yield b"".join(orjson.dumps(fila) + b"\n" for fila in filas)
+
+class _Sumidero(io.RawIOBase):
+    """
+    Archivo de solo escritura para ParquetWriter: guarda lo escrito hasta
+    que el generador lo retira con `vaciar`.
+    """
+
+    def __init__(self):
+        self._trozos: List[bytes] = []
+        self._posicion = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, datos) -> int:
+        datos = bytes(datos)
+        self._trozos.append(datos)
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self) -> int:
+        return self._posicion
+
+    def vaciar(self) -> bytes:
+        datos = b"".join(self._trozos)
+        self._trozos.clear()
+        return datos
+
+def _parquet(reporte: Reporte, lotes: Iterable[List[dict]], compresion: str) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tipos = {"str": pa.string(), "int": pa.int64(), "float": pa.float64(), "bool": pa.bool_(), "fecha": pa.timestamp("ms")}
+    esquema = pa.schema([(columna, tipos[tipo]) for columna, _, tipo in reporte.columnas])
+    sumidero = _Sumidero()
+    escritor = pq.ParquetWriter(sumidero, esquema, compression=compresion)
+    try:
+        # Un row group por lote: la memoria no depende del total de filas
+        for lote in lotes:
+            escritor.write_table(pa.Table.from_arrays(
+                [pa.array(valores, type=tipo) for valores, tipo in zip(_columnas(reporte, lote), esquema.types)],
+                schema=esquema,
+            ))
+            yield sumidero.vaciar()
+    finally:
+        escritor.close()
+    yield sumidero.vaciar()
+
+def _gzip(trozos: Iterable[bytes]) -> Iterator[bytes]:
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for trozo in trozos:
+        comprimido = compresor.compress(trozo)
+        if comprimido:
+            yield comprimido
+    yield compresor.flush()
+
+# ---------------------------------------------------
+def disposicion(reporte: str, formato: str, comprimir: bool) -> str:
+    # En Parquet la compresión va dentro del archivo
+    nombre = f"{reporte}.{formato}.gz" if comprimir and formato != "parquet" else f"{reporte}.{formato}"
+    # filename* (RFC 5987) porque los nombres pueden tener ñ
+    return f"attachment; filename*=UTF-8''{quote(nombre)}"
+
+def tipo_contenido(formato: str, comprimir: bool) -> str:
+    return "application/gzip" if comprimir and formato != "parquet" else TIPOS_CONTENIDO[formato]
+
+def exportar(nombre: str, formato: str, comprimir: bool = False, fecha_inicio: Optional[date] = None,
+             fecha_fin: Optional[date] = None, campaña_id: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Generador síncrono con el reporte completo en `formato`, leyendo el
+    cursor de a lotes: la memoria es la de un lote, no la del reporte.
+    Con `comprimir`, CSV y NDJSON salen en gzip y Parquet usa gzip por columna
+    en vez de snappy.
+    """
+    reporte = REPORTES[nombre]
+    if formato == "parquet":
+        lotes = _lotes(reporte, fecha_inicio, fecha_fin, campaña_id, EXPORTACION_FILAS_GRUPO)
+        trozos = _parquet(reporte, lotes, "gzip" if comprimir else "snappy")
+    else:
+        lotes = _lotes(reporte, fecha_inicio, fecha_fin, campaña_id, EXPORTACION_FILAS_LOTE)
+        trozos = _csv(reporte, lotes) if formato == "csv" else _ndjson(reporte, lotes)
+        if comprimir:
+            trozos = _gzip(trozos)
+    try:
+        for trozo in trozos:
+            yield trozo
+    except Exception:
+        # La respuesta ya empezó: solo queda cortarla y dejar constancia
+        logging.exception(f"Exportación de {nombre} en {formato} interrumpida")
+        raise
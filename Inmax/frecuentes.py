@@ -0,0 +1,323 @@
+from array import array
+from calendar import timegm
+from datetime import datetime
+from hashlib import blake2b
+from math import ceil, e, log
+from typing import Dict, Iterable, List, Set, Tuple
+import asyncio
+import heapq
+import logging
+import os
+import socket
+import time
+
+from pymongo.errors import PyMongoError
+
+# ---------------------------------------------------
+# Configuración de los sketches (cotas de error configurables)
+FRECUENTES_EPSILON = float(os.getenv("FRECUENTES_EPSILON", "0.001"))
+FRECUENTES_DELTA = float(os.getenv("FRECUENTES_DELTA", "0.01"))
+FRECUENTES_K = int(os.getenv("FRECUENTES_K", "200"))
+FRECUENTES_SUBVENTANA_S = int(os.getenv("FRECUENTES_SUBVENTANA_S", "60"))
+FRECUENTES_SUBVENTANAS = int(os.getenv("FRECUENTES_SUBVENTANAS", "60"))
+FRECUENTES_SINCRONIZACION_S = float(os.getenv("FRECUENTES_SINCRONIZACION_S", "10"))
+
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}"
+
+# Claves que se cuentan para cada dimensión consultable
+DIMENSIONES = ("pais", "campaña", "pieza")
+
+def claves_de(evento: dict) -> Dict[str, str]:
+    return {
+        "pais": str(evento.get("pais")),
+        "campaña": str(evento.get("campaña_id")),
+        "pieza": f"{evento.get('campaña_id')}|{evento.get('pais')}|{evento.get('pieza_id')}",
+    }
+
+# ---------------------------------------------------
+class CountMin:
+    """
+    Sketch Count-Min: sobreestima cada conteo en a lo más epsilon * total
+    con probabilidad 1 - delta, usando memoria fija.
+    """
+
+    def __init__(self, epsilon: float, delta: float):
+        self.epsilon = epsilon
+        self.delta = delta
+        self.ancho = ceil(e / epsilon)
+        self.profundidad = ceil(log(1 / delta))
+        self.tabla = [array("q", bytes(8 * self.ancho)) for _ in range(self.profundidad)]
+        self.total = 0
+
+    def _posiciones(self, clave: str):
+        # Hash estable entre procesos para que los sketches de distintos workers se puedan fusionar
+        digest = blake2b(clave.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.ancho for i in range(self.profundidad)]
+
+    def sumar(self, clave: str, n: int = 1) -> int:
+        estimado = None
+        for fila, posicion in zip(self.tabla, self._posiciones(clave)):
+            fila[posicion] += n
+            if estimado is None or fila[posicion] < estimado:
+                estimado = fila[posicion]
+        self.total += n
+        return estimado
+
+    def estimar(self, clave: str) -> int:
+        return min(fila[posicion] for fila, posicion in zip(self.tabla, self._posiciones(clave)))
+
+    def fusionar(self, otro: "CountMin"):
+        if (self.ancho, self.profundidad) != (otro.ancho, otro.profundidad):
+            raise ValueError("Los sketches Count-Min tienen dimensiones distintas.")
+        for fila, fila_otro in zip(self.tabla, otro.tabla):
+            for i in range(self.ancho):
+                fila[i] += fila_otro[i]
+        self.total += otro.total
+
+    def a_dict(self) -> dict:
+        return {
+            "epsilon": self.epsilon,
+            "delta": self.delta,
+            "total": self.total,
+            "tabla": [fila.tobytes() for fila in self.tabla],
+        }
+
+    @classmethod
+    def desde_dict(cls, datos: dict) -> "CountMin":
+        sketch = cls(datos["epsilon"], datos["delta"])
+        sketch.total = datos["total"]
+        for fila, crudo in zip(sketch.tabla, datos["tabla"]):
+            fila[:] = array("q", crudo)
+        return sketch
+
+class SpaceSaving:
+    """
+    Resumen Space-Saving de las k claves más frecuentes. Cada clave guarda
+    su conteo y el error máximo con que entró al resumen.
+    """
+
+    def __init__(self, k: int):
+        self.k = k
+        self.contadores: Dict[str, List[int]] = {}
+        # Min-heap con una entrada por clave; el conteo guardado puede estar atrasado
+        self._heap: List[Tuple[int, str]] = []
+
+    def _reconstruir(self):
+        self._heap = [(n, c) for c, (n, _) in self.contadores.items()]
+        heapq.heapify(self._heap)
+
+    def minimo(self) -> int:
+        if len(self.contadores) < self.k:
+            return 0
+        return min(conteo for conteo, _ in self.contadores.values())
+
+    def sumar(self, clave: str, n: int = 1):
+        contador = self.contadores.get(clave)
+        if contador is not None:
+            contador[0] += n
+        elif len(self.contadores) < self.k:
+            self.contadores[clave] = [n, 0]
+            heapq.heappush(self._heap, (n, clave))
+        else:
+            # Refresca entradas atrasadas hasta que la cima sea el mínimo real
+            while True:
+                conteo_min, desplazada = self._heap[0]
+                actual = self.contadores[desplazada][0]
+                if actual == conteo_min:
+                    break
+                heapq.heapreplace(self._heap, (actual, desplazada))
+            del self.contadores[desplazada]
+            heapq.heapreplace(self._heap, (conteo_min + n, clave))
+            self.contadores[clave] = [conteo_min + n, conteo_min]
+
+    def fusionar(self, otro: "SpaceSaving"):
+        # Una clave ausente en un resumen lleno pudo tener hasta su mínimo
+        minimo_propio, minimo_otro = self.minimo(), otro.minimo()
+        fusion = {}
+        for clave in self.contadores.keys() | otro.contadores.keys():
+            conteo_a, error_a = self.contadores.get(clave, (minimo_propio, minimo_propio))
+            conteo_b, error_b = otro.contadores.get(clave, (minimo_otro, minimo_otro))
+            fusion[clave] = [conteo_a + conteo_b, error_a + error_b]
+        mayores = sorted(fusion.items(), key=lambda item: item[1][0], reverse=True)[:self.k]
+        self.contadores = dict(mayores)
+        self._reconstruir()
+
+    def a_dict(self) -> dict:
+        return {"k": self.k, "contadores": [[c, n, err] for c, (n, err) in self.contadores.items()]}
+
+    @classmethod
+    def desde_dict(cls, datos: dict) -> "SpaceSaving":
+        resumen = cls(datos["k"])
+        resumen.contadores = {c: [n, err] for c, n, err in datos["contadores"]}
+        resumen._reconstruir()
+        return resumen
+
+class Frecuentes:
+    """
+    Count-Min para estimar cualquier clave + Space-Saving para saber cuáles son las mayores.
+    """
+
+    def __init__(self, epsilon: float = FRECUENTES_EPSILON, delta: float = FRECUENTES_DELTA, k: int = FRECUENTES_K):
+        self.cm = CountMin(epsilon, delta)
+        self.ss = SpaceSaving(k)
+
+    def sumar(self, clave: str, n: int = 1):
+        self.cm.sumar(clave, n)
+        self.ss.sumar(clave, n)
+
+    def fusionar(self, otro: "Frecuentes"):
+        self.cm.fusionar(otro.cm)
+        self.ss.fusionar(otro.ss)
+
+    def top(self, n: int) -> List[Tuple[str, int, int]]:
+        """
+        Retorna (clave, estimado, cota_inferior) de las n claves más frecuentes.
+        """
+        filas = []
+        for clave, (conteo, error) in self.ss.contadores.items():
+            estimado = min(conteo, self.cm.estimar(clave))
+            filas.append((clave, estimado, max(0, conteo - error)))
+        filas.sort(key=lambda fila: fila[1], reverse=True)
+        return filas[:n]
+
+    def a_dict(self) -> dict:
+        return {"cm": self.cm.a_dict(), "ss": self.ss.a_dict()}
+
+    @classmethod
+    def desde_dict(cls, datos: dict) -> "Frecuentes":
+        sketch = cls.__new__(cls)
+        sketch.cm = CountMin.desde_dict(datos["cm"])
+        sketch.ss = SpaceSaving.desde_dict(datos["ss"])
+        return sketch
+
+# ---------------------------------------------------
+class VentanaClicks:
+    """
+    Anillo de sub-ventanas de tiempo, cada una con un sketch por dimensión.
+    Una consulta de los últimos N segundos fusiona solo las sub-ventanas que cubren ese lapso.
+    """
+
+    def __init__(self, segundos_subventana: int, subventanas: int):
+        self.segundos_subventana = segundos_subventana
+        self.subventanas = subventanas
+        self._datos: Dict[int, Dict[str, Frecuentes]] = {}
+        # Sub-ventanas con clicks nuevos desde la última sincronización
+        self._modificadas: Set[int] = set()
+
+    def _actual(self) -> int:
+        return int(time.time()) // self.segundos_subventana
+
+    def _subventana(self, numero: int) -> Dict[str, Frecuentes]:
+        sketches = self._datos.get(numero)
+        if sketches is None:
+            sketches = self._datos[numero] = {d: Frecuentes() for d in DIMENSIONES}
+            if len(self._datos) > self.subventanas:
+                del self._datos[min(self._datos)]
+        return sketches
+
+    def registrar(self, eventos: List[dict]):
+        actual = self._actual()
+        minima = actual - self.subventanas + 1
+        for evento in eventos:
+            if evento["tipo"] != "click":
+                continue
+            fecha: datetime = evento["fecha"]
+            # Una fecha futura del cliente cuenta en la sub-ventana actual: si
+            # no, abriría sub-ventanas que desplazan a las vigentes del anillo
+            numero = min(timegm(fecha.utctimetuple()) // self.segundos_subventana, actual)
+            if numero < minima:
+                continue
+            self._modificadas.add(numero)
+            sketches = self._subventana(numero)
+            for dimension, clave in claves_de(evento).items():
+                sketches[dimension].sumar(clave)
+
+    def rango(self, segundos: int) -> Tuple[int, int]:
+        actual = self._actual()
+        cantidad = max(1, min(self.subventanas, ceil(segundos / self.segundos_subventana)))
+        return actual - cantidad + 1, actual
+
+    def fusionar_rango(self, dimension: str, desde: int, hasta: int) -> Frecuentes:
+        resultado = Frecuentes()
+        for numero, sketches in self._datos.items():
+            if desde <= numero <= hasta:
+                resultado.fusionar(sketches[dimension])
+        return resultado
+
+    def exportar(self, desde: int) -> List[Tuple[int, dict]]:
+        """
+        Sub-ventanas vigentes modificadas desde la última exportación. Quedan
+        como sincronizadas; si no se alcanzan a guardar, `marcar` las devuelve.
+        """
+        modificadas, self._modificadas = self._modificadas, set()
+        return [
+            (numero, {d: s.a_dict() for d, s in self._datos[numero].items()})
+            for numero in sorted(modificadas) if numero >= desde and numero in self._datos
+        ]
+
+    def marcar(self, numeros: Iterable[int]):
+        self._modificadas.update(numeros)
+
+VENTANA_CLICKS = VentanaClicks(FRECUENTES_SUBVENTANA_S, FRECUENTES_SUBVENTANAS)
+
+def registrar_eventos(eventos: List[dict]):
+    VENTANA_CLICKS.registrar(eventos)
+
+# ---------------------------------------------------
+# Persistencia en Mongo para fusionar los sketches de varios workers
+async def sincronizar(db):
+    """
+    Guarda en Mongo las sub-ventanas de este worker que cambiaron desde la
+    última sincronización.
+    """
+    coleccion = db["frecuentes_clicks"]
+    desde, _ = VENTANA_CLICKS.rango(VENTANA_CLICKS.subventanas * VENTANA_CLICKS.segundos_subventana)
+    exportadas = VENTANA_CLICKS.exportar(desde)
+    for i, (numero, sketches) in enumerate(exportadas):
+        try:
+            await coleccion.replace_one(
+                {"_id": f"{WORKER_ID}:{numero}"},
+                {"worker": WORKER_ID, "subventana": numero, "sketches": sketches},
+                upsert=True
+            )
+        except PyMongoError:
+            VENTANA_CLICKS.marcar(numero for numero, _ in exportadas[i:])
+            raise
+    await coleccion.delete_many({"worker": WORKER_ID, "subventana": {"$lt": desde}})
+
+async def sincronizar_periodicamente(db_fabrica):
+    while True:
+        await asyncio.sleep(FRECUENTES_SINCRONIZACION_S)
+        try:
+            await sincronizar(db_fabrica())
+        except PyMongoError:
+            logging.exception("No se pudieron sincronizar los sketches de clicks")
+
+async def top_clicks(dimension: str, n: int, segundos: int, db=None) -> dict:
+    """
+    Top n claves por clicks en los últimos `segundos`. Si se entrega `db`,
+    se fusionan también los sketches guardados por los demás workers.
+    """
+    desde, hasta = VENTANA_CLICKS.rango(segundos)
+    sketch = VENTANA_CLICKS.fusionar_rango(dimension, desde, hasta)
+    if db is not None:
+        cursor = db["frecuentes_clicks"].find({
+            "worker": {"$ne": WORKER_ID},
+            "subventana": {"$gte": desde, "$lte": hasta}
+        })
+        async for documento in cursor:
+            sketch.fusionar(Frecuentes.desde_dict(documento["sketches"][dimension]))
+    return {
+        "dimension": dimension,
+        "ventana_segundos": (hasta - desde + 1) * VENTANA_CLICKS.segundos_subventana,
+        "total_clicks": sketch.cm.total,
+        "epsilon": sketch.cm.epsilon,
+        "delta": sketch.cm.delta,
+        "error_maximo": sketch.cm.epsilon * sketch.cm.total,
+        "resultados": [
+            {"clave": clave, "clicks": estimado, "cota_inferior": cota}
+            for clave, estimado, cota in sketch.top(n)
+        ],
+    }
@@ -1,12 +1,27 @@
-from fastapi import FastAPI, Query, HTTPException
+from fastapi import FastAPI, Query, HTTPException, Depends
 from pydantic import BaseModel
 from typing import Optional, List
+from contextlib import asynccontextmanager
 from datetime import date
 
+from agregados import AGREGADOS_POR_DIA, CLICKS, DURACION, SESIONES, USUARIOS, top_n as top
+from autorizacion import require
+from cache_respuestas import cache_respuesta
+from contadores_eventos import CONTADORES_EVENTOS
+from db import get_db_async
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Los indicadores salen de los rollups en memoria, que siguen los contadores de Mongo
+    await CONTADORES_EVENTOS.iniciar(get_db_async)
+    yield
+    await CONTADORES_EVENTOS.detener()
+
 app = FastAPI(
     title="API de Indicadores del Avisador",
     description="Endpoints de reportes e indicadores para campañas del avisador.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 class PaisCantidad(BaseModel):
@@ -42,24 +57,6 @@ class TransaccionesResponse(BaseModel):
     total_transacciones: int
 
 #datos de ejemplo
-DATA_USUARIOS = [
-    {"pais": "Chile", "usuarios": 1200, "sesiones": 3000, "duracion_promedio": 120},
-    {"pais": "México", "usuarios": 950, "sesiones": 1800, "duracion_promedio": 90},
-    {"pais": "Colombia", "usuarios": 800, "sesiones": 1500, "duracion_promedio": 150}
-]
-
-DATA_ADQUISICION = [
-    {"canal": "social", "usuarios": 400},
-    {"canal": "direct", "usuarios": 300},
-    {"canal": "email", "usuarios": 200}
-]
-
-DATA_CLICKS = [
-    {"pais": "Chile", "clicks": 700},
-    {"pais": "México", "clicks": 600},
-    {"pais": "Colombia", "clicks": 500}
-]
-
 DATA_ESTADISTICAS = [
     {"fecha": date(2025, 5, 27), "tipo": "activo", "cantidad": 300},
     {"fecha": date(2025, 5, 27), "tipo": "nuevo", "cantidad": 150},
@@ -72,44 +69,51 @@ async def read_root():
     return {"message": "API de Indicadores OK"}
 
 # 10) /avisador/mapa-usuarios
-@app.get("/avisador/mapa-usuarios", response_model=List[PaisCantidad])
+@app.get("/avisador/mapa-usuarios", response_model=List[PaisCantidad], dependencies=[Depends(require("leer"))])
+@cache_respuesta(ttl=30, fuentes=["eventos"], revalidar=60)
 async def mapa_usuarios(
     fecha_inicio: date,
     fecha_fin: Optional[date] = None
 ):
-    return [{"pais": d["pais"], "cantidad": d["usuarios"]} for d in DATA_USUARIOS]
+    return [{"pais": p, "cantidad": int(v[USUARIOS])} for p, v in AGREGADOS_POR_DIA.resumen("pais", fecha_inicio, fecha_fin).items()]
 
 # 11) /reportes/usuarios-top-paises
-@app.get("/reportes/usuarios-top-paises", response_model=List[PaisUsuarios])
+@app.get("/reportes/usuarios-top-paises", response_model=List[PaisUsuarios], dependencies=[Depends(require("leer"))])
+@cache_respuesta(ttl=30, fuentes=["eventos"], revalidar=60)
 async def usuarios_top_paises(
     fecha_inicio: date,
     top_n: int = Query(..., ge=1, description="Cantidad de países a retornar"),
     fecha_fin: Optional[date] = None
 ):
-    lista = [{"pais": d["pais"], "usuarios": d["usuarios"]} for d in DATA_USUARIOS]
-    return lista[:top_n]
+    lista = [{"pais": p, "usuarios": int(v[USUARIOS])} for p, v in AGREGADOS_POR_DIA.resumen("pais", fecha_inicio, fecha_fin).items()]
+    return top(lista, top_n, "usuarios")
 
 # 13) /reportes/sesiones-top-paises
-@app.get("/reportes/sesiones-top-paises", response_model=List[PaisSesiones])
+@app.get("/reportes/sesiones-top-paises", response_model=List[PaisSesiones], dependencies=[Depends(require("leer"))])
+@cache_respuesta(ttl=30, fuentes=["eventos"], revalidar=60)
 async def sesiones_top_paises(
     fecha_inicio: date,
     top_n: int = Query(..., ge=1, description="Cantidad de países a retornar"),
     fecha_fin: Optional[date] = None
 ):
-    lista = [{"pais": d["pais"], "sesiones": d["sesiones"]} for d in DATA_USUARIOS]
-    return lista[:top_n]
+    lista = [{"pais": p, "sesiones": int(v[SESIONES])} for p, v in AGREGADOS_POR_DIA.resumen("pais", fecha_inicio, fecha_fin).items()]
+    return top(lista, top_n, "sesiones")
 
 # 14) /avisador/duracion-promedio
-@app.get("/avisador/duracion-promedio", response_model=List[PaisDuracion])
+@app.get("/avisador/duracion-promedio", response_model=List[PaisDuracion], dependencies=[Depends(require("leer"))])
+@cache_respuesta(ttl=30, fuentes=["eventos"], revalidar=60)
 async def duracion_promedio(
     fecha_inicio: date,
     fecha_fin: date
 ):
-    lista = [{"pais": d["pais"], "duracion_promedio": d["duracion_promedio"]} for d in DATA_USUARIOS]
-    return lista
+    return [
+        {"pais": p, "duracion_promedio": v[DURACION] / v[SESIONES]}
+        for p, v in AGREGADOS_POR_DIA.resumen("pais", fecha_inicio, fecha_fin).items() if v[SESIONES]
+    ]
 
 # 15) /avisador/estadisticas-usuarios
-@app.get("/avisador/estadisticas-usuarios", response_model=List[EstadisticaUsuarios])
+@app.get("/avisador/estadisticas-usuarios", response_model=List[EstadisticaUsuarios], dependencies=[Depends(require("leer"))])
+@cache_respuesta(ttl=30, fuentes=["eventos"], revalidar=60)
 async def estadisticas_usuarios(
     fecha_inicio: date,
     fecha_fin: date
@@ -117,7 +121,8 @@ async def estadisticas_usuarios(
     return DATA_ESTADISTICAS
 
 # 17) /avisador/transacciones (extra)
-@app.get("/avisador/transacciones", response_model=TransaccionesResponse)
+@app.get("/avisador/transacciones", response_model=TransaccionesResponse, dependencies=[Depends(require("leer"))])
+@cache_respuesta(ttl=30, fuentes=["eventos"], revalidar=60)
 async def transacciones(
     fecha_inicio: date,
     fecha_fin: date
@@ -126,17 +131,19 @@ async def transacciones(
     return {"total_transacciones": total_transacciones}
 
 # 8) /reportes/adquisicion-usuarios
-@app.get("/reportes/adquisicion-usuarios", response_model=List[CanalUsuarios])
+@app.get("/reportes/adquisicion-usuarios", response_model=List[CanalUsuarios], dependencies=[Depends(require("leer"))])
+@cache_respuesta(ttl=30, fuentes=["eventos"], revalidar=60)
 async def adquisicion_usuarios(
     fecha_inicio: date,
     fecha_fin: date
 ):
-    return DATA_ADQUISICION
+    return [{"canal": c, "usuarios": int(v[USUARIOS])} for c, v in AGREGADOS_POR_DIA.resumen("canal", fecha_inicio, fecha_fin).items()]
 
 # 9) /reportes/clicks-pais
-@app.get("/reportes/clicks-pais", response_model=List[ClicksPais])
+@app.get("/reportes/clicks-pais", response_model=List[ClicksPais], dependencies=[Depends(require("leer"))])
+@cache_respuesta(ttl=30, fuentes=["eventos"], revalidar=60)
 async def clicks_pais(
     fecha_inicio: date,
     fecha_fin: date
 ):
-    return DATA_CLICKS
+    return [{"pais": p, "clicks": int(v[CLICKS])} for p, v in AGREGADOS_POR_DIA.resumen("pais", fecha_inicio, fecha_fin).items()]
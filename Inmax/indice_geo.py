@@ -0,0 +1,216 @@
+from bisect import bisect_left, insort
+from calendar import timegm
+from datetime import date, datetime
+from math import floor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from cache_respuestas import incrementar_generacion
+from indice_texto import normalizar
+
+# ---------------------------------------------------
+# Tamaño de celda en grados para cada nivel de detalle del mapa
+# (1° ~ 110 km, 0.1° ~ 11 km, 0.01° ~ 1 km)
+NIVELES_DETALLE = {"bajo": 1.0, "medio": 0.1, "alto": 0.01}
+# Las celdas del nivel más fino se guardan en Mongo; las demás se arman desde ellas
+TAMAÑO_CELDA_MINIMO = min(NIVELES_DETALLE.values())
+SEGUNDOS_DIA = 86400
+
+# Caja aproximada (lon_min, lat_min, lon_max, lat_max) de las regiones consultables
+REGIONES = {
+    "chile": (-75.7, -56.0, -66.4, -17.5),
+    "metropolitana": (-71.8, -34.3, -69.8, -32.9),
+    "valparaiso": (-72.0, -33.9, -70.0, -32.0),
+    "mexico": (-118.4, 14.5, -86.7, 32.7),
+    "colombia": (-79.0, -4.3, -66.8, 12.5),
+    "argentina": (-73.6, -55.1, -53.6, -21.8),
+    "peru": (-81.4, -18.4, -68.6, -0.03),
+}
+
+Caja = Tuple[float, float, float, float]
+Celda = Tuple[int, int]
+
+def caja_de_region(region: str) -> Optional[Caja]:
+    return REGIONES.get(normalizar(region.strip()))
+
+# ---------------------------------------------------
+class Cumulo:
+    """
+    Impresiones acumuladas de una celda: total, centroide ponderado y ciudades.
+    """
+
+    __slots__ = ("impresiones", "suma_lat", "suma_lon", "ciudades")
+
+    def __init__(self):
+        self.impresiones = 0
+        self.suma_lat = 0.0
+        self.suma_lon = 0.0
+        self.ciudades: Dict[str, int] = {}
+
+    def sumar(self, lat: float, lon: float, impresiones: int, ciudad: Optional[str]):
+        self.impresiones += impresiones
+        self.suma_lat += lat * impresiones
+        self.suma_lon += lon * impresiones
+        if ciudad:
+            self.ciudades[ciudad] = self.ciudades.get(ciudad, 0) + impresiones
+
+    def sumar_totales(self, impresiones: int, suma_lat: float, suma_lon: float, ciudad: Optional[str]):
+        self.impresiones += impresiones
+        self.suma_lat += suma_lat
+        self.suma_lon += suma_lon
+        if ciudad:
+            self.ciudades[ciudad] = self.ciudades.get(ciudad, 0) + impresiones
+
+    def combinar(self, otro: "Cumulo"):
+        self.impresiones += otro.impresiones
+        self.suma_lat += otro.suma_lat
+        self.suma_lon += otro.suma_lon
+        for ciudad, impresiones in otro.ciudades.items():
+            self.ciudades[ciudad] = self.ciudades.get(ciudad, 0) + impresiones
+
+    def punto(self) -> dict:
+        return {
+            "lat": round(self.suma_lat / self.impresiones, 6),
+            "lon": round(self.suma_lon / self.impresiones, 6),
+            "ciudad": max(self.ciudades, key=self.ciudades.get) if self.ciudades else "",
+            "impresiones": self.impresiones,
+        }
+
+def _celda(lat: float, lon: float, tamaño: float) -> Celda:
+    return floor(lon / tamaño), floor(lat / tamaño)
+
+def _en_caja(celdas: Dict[Celda, Cumulo], tamaño: float, caja: Optional[Caja]) -> Iterator[Tuple[Celda, Cumulo]]:
+    """
+    Celdas que tocan la caja. Si la caja cubre menos celdas de las que hay
+    guardadas se buscan una a una; si no, se recorren las guardadas.
+    """
+    if caja is None:
+        yield from celdas.items()
+        return
+    lon_min, lat_min, lon_max, lat_max = caja
+    x0, y0 = _celda(lat_min, lon_min, tamaño)
+    x1, y1 = _celda(lat_max, lon_max, tamaño)
+    if (x1 - x0 + 1) * (y1 - y0 + 1) < len(celdas):
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                cumulo = celdas.get((x, y))
+                if cumulo is not None:
+                    yield (x, y), cumulo
+        return
+    for (x, y), cumulo in celdas.items():
+        if x0 <= x <= x1 and y0 <= y <= y1:
+            yield (x, y), cumulo
+
+def _puntos(cumulos: Dict[Celda, Cumulo]) -> List[dict]:
+    puntos = [cumulo.punto() for cumulo in cumulos.values() if cumulo.impresiones]
+    puntos.sort(key=lambda punto: punto["impresiones"], reverse=True)
+    return puntos
+
+# ---------------------------------------------------
+class IndiceGeo:
+    """
+    Grilla de celdas por (campaña, día, nivel de detalle) con las impresiones
+    acumuladas de cada celda.
+
+    Cada impresión suma en su celda de los tres niveles, así que los clusters
+    de cualquier zoom ya están armados; una consulta solo visita las celdas
+    de la caja en los días del rango.
+    """
+
+    def __init__(self):
+        self._dias: Dict[int, Dict[int, Dict[str, Dict[Celda, Cumulo]]]] = {}
+        self._orden: Dict[int, List[int]] = {}
+
+    def tiene_datos(self, campaña_id: int) -> bool:
+        return campaña_id in self._dias
+
+    def _niveles(self, campaña_id: int, dia: int) -> Dict[str, Dict[Celda, Cumulo]]:
+        dias = self._dias.get(campaña_id)
+        if dias is None:
+            dias = self._dias[campaña_id] = {}
+            self._orden[campaña_id] = []
+        niveles = dias.get(dia)
+        if niveles is None:
+            niveles = dias[dia] = {nivel: {} for nivel in NIVELES_DETALLE}
+            insort(self._orden[campaña_id], dia)
+        return niveles
+
+    def sumar(self, campaña_id: int, fecha: datetime, lat: float, lon: float, impresiones: int = 1, ciudad: Optional[str] = None):
+        niveles = self._niveles(campaña_id, timegm(fecha.utctimetuple()) // SEGUNDOS_DIA)
+        for nivel, tamaño in NIVELES_DETALLE.items():
+            celdas = niveles[nivel]
+            celda = _celda(lat, lon, tamaño)
+            cumulo = celdas.get(celda)
+            if cumulo is None:
+                cumulo = celdas[celda] = Cumulo()
+            cumulo.sumar(lat, lon, impresiones, ciudad)
+
+    def sumar_celda(self, campaña_id: int, dia: int, celda: Celda, impresiones: int, suma_lat: float, suma_lon: float, ciudad: Optional[str] = None):
+        """
+        Suma totales de una celda del nivel más fino a la celda que la contiene en cada nivel.
+        """
+        niveles = self._niveles(campaña_id, dia)
+        x, y = celda
+        for nivel, tamaño in NIVELES_DETALLE.items():
+            # Los tamaños son múltiplos del mínimo: la división entera da la celda que la contiene
+            factor = round(tamaño / TAMAÑO_CELDA_MINIMO)
+            celdas = niveles[nivel]
+            contenedora = (x // factor, y // factor)
+            cumulo = celdas.get(contenedora)
+            if cumulo is None:
+                cumulo = celdas[contenedora] = Cumulo()
+            cumulo.sumar_totales(impresiones, suma_lat, suma_lon, ciudad)
+
+    def registrar(self, eventos: List[dict]) -> int:
+        """
+        Suma las impresiones con coordenadas de un lote. Retorna cuántas se indexaron.
+        """
+        indexadas = 0
+        for evento in eventos:
+            if evento["tipo"] != "impresion" or evento.get("lat") is None or evento.get("lon") is None:
+                continue
+            campaña_id = evento.get("campaña_id")
+            if campaña_id is None:
+                continue
+            self.sumar(campaña_id, evento["fecha"], evento["lat"], evento["lon"], 1, evento.get("ciudad"))
+            indexadas += 1
+        return indexadas
+
+    def _dias_en_rango(self, campaña_id: int, fecha_inicio: Optional[date], fecha_fin: Optional[date]):
+        orden = self._orden.get(campaña_id, [])
+        desde = 0
+        hasta = len(orden)
+        if fecha_inicio is not None:
+            desde = bisect_left(orden, timegm(fecha_inicio.timetuple()) // SEGUNDOS_DIA)
+        if fecha_fin is not None:
+            # fecha_fin es inclusiva
+            hasta = bisect_left(orden, timegm(fecha_fin.timetuple()) // SEGUNDOS_DIA + 1, desde)
+        dias = self._dias.get(campaña_id, {})
+        for i in range(desde, hasta):
+            yield dias[orden[i]]
+
+    def clusters(self, campaña_id: int, nivel: str, caja: Optional[Caja] = None,
+                 fecha_inicio: Optional[date] = None, fecha_fin: Optional[date] = None) -> List[dict]:
+        """
+        Clusters del nivel que tocan la caja, sumando los días del rango,
+        ordenados de más a menos impresiones.
+        """
+        tamaño = NIVELES_DETALLE[nivel]
+        totales: Dict[Celda, Cumulo] = {}
+        for niveles in self._dias_en_rango(campaña_id, fecha_inicio, fecha_fin):
+            for celda, cumulo in _en_caja(niveles[nivel], tamaño, caja):
+                total = totales.get(celda)
+                if total is None:
+                    total = totales[celda] = Cumulo()
+                total.combinar(cumulo)
+        return _puntos(totales)
+
+# ---------------------------------------------------
+INDICE_GEO = IndiceGeo()
+
+def registrar_totales(cambios: Dict[tuple, Dict[str, float]]):
+    """
+    Suma los cambios de los contadores de Mongo, por (campaña, día, x, y, ciudad) del nivel más fino.
+    """
+    for (campaña_id, dia, x, y, ciudad), valores in cambios.items():
+        INDICE_GEO.sumar_celda(campaña_id, dia, (x, y), int(valores["impresiones"]), valores["suma_lat"], valores["suma_lon"], ciudad)
+    incrementar_generacion("geolocalizacion")
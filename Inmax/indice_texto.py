@@ -0,0 +1,181 @@
+from collections import Counter
+from hashlib import blake2b
+from math import log
+from typing import Dict, List, Optional, Set
+import gzip
+import json
+import os
+import re
+import tempfile
+import unicodedata
+
+# ---------------------------------------------------
+TOKEN = re.compile(r"\w+")
+SIMILITUD_MINIMA = 0.4
+MAX_EXPANSIONES = 10
+
+def normalizar(texto: str) -> str:
+    """
+    Minúsculas y sin tildes: "Campaña" -> "campana".
+    """
+    descompuesto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in descompuesto if not unicodedata.combining(c))
+
+def tokenizar(texto: str) -> List[str]:
+    return TOKEN.findall(normalizar(texto))
+
+def huella(texto: str) -> str:
+    # Identifica el texto indexado de cada documento, también en el snapshot
+    return blake2b(texto.encode(), digest_size=8).hexdigest()
+
+def trigramas(termino: str) -> Set[str]:
+    relleno = f"  {termino} "
+    return {relleno[i:i + 3] for i in range(len(relleno) - 2)}
+
+# ---------------------------------------------------
+class IndiceTexto:
+    """
+    Índice invertido con ranking BM25, mantenido de forma incremental.
+
+    Cada término de la consulta se expande a los términos del vocabulario
+    que lo contienen o que se le parecen por trigramas, así se toleran
+    búsquedas parciales y errores de tipeo.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._largos: Dict[int, int] = {}
+        self._terminos: Dict[int, List[str]] = {}
+        self._huellas: Dict[int, str] = {}
+        self._largo_total = 0
+        self._por_trigrama: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._largos)
+
+    def __contains__(self, id: int) -> bool:
+        return id in self._largos
+
+    def ids(self) -> List[int]:
+        return list(self._largos)
+
+    def huella(self, id: int) -> Optional[str]:
+        return self._huellas.get(id)
+
+    def _indexar_termino(self, termino: str):
+        for trigrama in trigramas(termino):
+            self._por_trigrama.setdefault(trigrama, set()).add(termino)
+
+    def _olvidar_termino(self, termino: str):
+        del self._postings[termino]
+        for trigrama in trigramas(termino):
+            terminos = self._por_trigrama[trigrama]
+            terminos.discard(termino)
+            if not terminos:
+                del self._por_trigrama[trigrama]
+
+    def agregar(self, id: int, texto: str):
+        if id in self._largos:
+            self.eliminar(id)
+        tokens = tokenizar(texto)
+        frecuencias = Counter(tokens)
+        self._terminos[id] = list(frecuencias)
+        for termino, frecuencia in frecuencias.items():
+            postings = self._postings.get(termino)
+            if postings is None:
+                postings = self._postings[termino] = {}
+                self._indexar_termino(termino)
+            postings[id] = frecuencia
+        self._largos[id] = len(tokens)
+        self._largo_total += len(tokens)
+        self._huellas[id] = huella(texto)
+
+    def eliminar(self, id: int):
+        largo = self._largos.pop(id, None)
+        if largo is None:
+            return
+        self._largo_total -= largo
+        self._huellas.pop(id, None)
+        for termino in self._terminos.pop(id):
+            postings = self._postings[termino]
+            del postings[id]
+            if not postings:
+                self._olvidar_termino(termino)
+
+    def _expandir(self, token: str) -> Dict[str, float]:
+        if token in self._postings:
+            return {token: 1.0}
+        propios = trigramas(token)
+        compartidos: Counter = Counter()
+        for trigrama in propios:
+            for termino in self._por_trigrama.get(trigrama, ()):
+                compartidos[termino] += 1
+        pesos = {}
+        for termino, n in compartidos.items():
+            if token in termino:
+                peso = 0.9
+            else:
+                peso = n / (len(propios) + len(trigramas(termino)) - n)
+                if peso < SIMILITUD_MINIMA:
+                    continue
+            pesos[termino] = peso
+        mejores = sorted(pesos.items(), key=lambda item: item[1], reverse=True)[:MAX_EXPANSIONES]
+        return dict(mejores)
+
+    def buscar(self, consulta: str) -> Dict[int, float]:
+        """
+        Retorna {id: puntaje BM25} de los documentos que coinciden con la consulta.
+        """
+        n = len(self._largos)
+        if not n:
+            return {}
+        promedio = self._largo_total / n
+        puntajes: Dict[int, float] = {}
+        for token in set(tokenizar(consulta)):
+            for termino, peso in self._expandir(token).items():
+                postings = self._postings[termino]
+                idf = log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for id, frecuencia in postings.items():
+                    norma = self.k1 * (1 - self.b + self.b * self._largos[id] / promedio)
+                    puntaje = peso * idf * frecuencia * (self.k1 + 1) / (frecuencia + norma)
+                    puntajes[id] = puntajes.get(id, 0.0) + puntaje
+        return puntajes
+
+    # ---------------------------------------------------
+    # Snapshot en disco para no re-tokenizar el catálogo al arrancar
+    def guardar(self, ruta: str):
+        datos = {
+            "k1": self.k1,
+            "b": self.b,
+            "largos": self._largos,
+            "huellas": self._huellas,
+            "postings": {t: list(p.items()) for t, p in self._postings.items()},
+        }
+        # Un temporal propio por proceso: varios workers guardan la misma ruta al apagar
+        descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(ruta)), suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as crudo, gzip.open(crudo, "wt", encoding="utf-8") as archivo:
+                json.dump(datos, archivo, ensure_ascii=False)
+            os.replace(temporal, ruta)
+        except BaseException:
+            os.remove(temporal)
+            raise
+
+    @classmethod
+    def cargar(cls, ruta: str) -> "IndiceTexto":
+        with gzip.open(ruta, "rt", encoding="utf-8") as archivo:
+            datos = json.load(archivo)
+        indice = cls(datos["k1"], datos["b"])
+        indice._largos = {int(id): largo for id, largo in datos["largos"].items()}
+        indice._largo_total = sum(indice._largos.values())
+        # Snapshots sin huellas: todo cuenta como cambiado y se re-tokeniza
+        indice._huellas = {int(id): h for id, h in datos.get("huellas", {}).items()}
+        indice._terminos = {id: [] for id in indice._largos}
+        for termino, postings in datos["postings"].items():
+            indice._postings[termino] = {id: frecuencia for id, frecuencia in postings}
+            indice._indexar_termino(termino)
+            for id, _ in postings:
+                indice._terminos[id].append(termino)
+        return indice
@@ -1,12 +1,43 @@
-from fastapi import FastAPI, HTTPException, Query, Path, status
+from fastapi import FastAPI, HTTPException, Query, Path, status, Depends
 from pydantic import BaseModel, Field
 from typing import List, Optional
+from contextlib import asynccontextmanager
 from datetime import date, datetime
+import logging
+import os
+
+from pymongo.errors import PyMongoError
+
+from db import get_db_async
+from repositorio_campanas import REPOSITORIO_CAMPAÑAS, CursorInvalido, crear_indices_mongo, marca_actualizacion
+from autorizacion import require
+from respuestas_rapidas import responder_filas
+
+# Snapshot del índice de búsqueda para no reconstruirlo en cada arranque
+INDICE_TEXTO_RUTA = os.getenv("INDICE_TEXTO_RUTA", "indice_campanas.json.gz")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if os.path.exists(INDICE_TEXTO_RUTA):
+        REPOSITORIO_CAMPAÑAS.cargar_texto(INDICE_TEXTO_RUTA)
+    try:
+        # El de sincronización entre workers
+        await crear_indices_mongo(get_db_async())
+    except PyMongoError:
+        logging.exception("No se pudieron crear los índices de campañas")
+    # Las campañas viven en Mongo; cada worker las carga y sigue las de los demás
+    await REPOSITORIO_CAMPAÑAS.iniciar(get_db_async)
+    # El snapshot puede traer campañas borradas mientras el worker estaba apagado
+    REPOSITORIO_CAMPAÑAS.reconciliar_texto()
+    yield
+    await REPOSITORIO_CAMPAÑAS.detener()
+    REPOSITORIO_CAMPAÑAS.texto.guardar(INDICE_TEXTO_RUTA)
 
 app = FastAPI(
     title="API de Campañas",
     description="Endpoints para gestión completa de campañas publicitarias.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # ---------------------------------------------------
@@ -23,75 +54,67 @@ class Campaña(BaseModel):
 class MensajeResponse(BaseModel):
     message: str
 
-# ---------------------------------------------------
-CAMPAÑAS = [
-    {
-        "id": 1,
-        "nombre": "Campaña de verano",
-        "descripcion": "Promoción verano 2025",
-        "estado": "activa",
-        "fecha_inicio": datetime(2025, 6, 1, 10, 0),
-        "fecha_fin": datetime(2025, 6, 30, 23, 59),
-        "presupuesto": 10000,
-        "canal": "social"
-    },
-    {
-        "id": 2,
-        "nombre": "Campaña de invierno",
-        "descripcion": "Descuentos de invierno",
-        "estado": "inactiva",
-        "fecha_inicio": datetime(2025, 7, 1, 0, 0),
-        "fecha_fin": datetime(2025, 7, 31, 23, 59),
-        "presupuesto": 8000,
-        "canal": "email"
-    }
-]
-
 # ---------------------------------------------------
 # 32) GET /campañas
-@app.get("/campañas", response_model=List[Campaña], summary="Lista campañas con filtros")
+@app.get("/campañas", response_model=List[Campaña], summary="Lista campañas con filtros", dependencies=[Depends(require("leer"))])
 async def listar_campañas(
     estado: Optional[str] = Query(None, description="Estado de la campaña (activa, inactiva)"),
     fecha_inicio: Optional[date] = Query(None),
     fecha_fin: Optional[date] = Query(None),
-    orden: Optional[str] = Query(None, description="Campo para ordenar (ej: 'fecha_inicio')"),
+    orden: Optional[str] = Query(None, description="Campo para ordenar (id, fecha_inicio, fecha_fin, nombre, estado, canal, presupuesto, relevancia)"),
     limite: Optional[int] = Query(10, ge=1, le=100, description="Cantidad de resultados"),
-    buscar: Optional[str] = Query(None, description="Búsqueda por nombre o descripción")
+    buscar: Optional[str] = Query(None, description="Búsqueda por nombre o descripción (sin tildes, tolera errores)"),
+    canal: Optional[str] = Query(None, description="Canal de la campaña (social, email, ...)"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página siguiente (X-Siguiente-Cursor)")
 ):
-    resultados = CAMPAÑAS.copy()
-
-    if estado:
-        resultados = [c for c in resultados if c["estado"].lower() == estado.lower()]
-    if fecha_inicio:
-        resultados = [c for c in resultados if c["fecha_inicio"].date() >= fecha_inicio]
-    if fecha_fin:
-        resultados = [c for c in resultados if c["fecha_fin"].date() <= fecha_fin]
-    if buscar:
-        resultados = [c for c in resultados if buscar.lower() in c["nombre"].lower() or buscar.lower() in c["descripcion"].lower()]
-
-    if orden and orden in resultados[0]:
-        resultados.sort(key=lambda x: x[orden])
+    """
+    Retorna una página de campañas. Si hay más resultados, el cursor para
+    pedir la siguiente página viene en el encabezado `X-Siguiente-Cursor`.
+    Con `buscar` y sin `orden`, los resultados vienen ordenados por relevancia.
+    """
+    try:
+        resultados, siguiente = REPOSITORIO_CAMPAÑAS.buscar(
+            estado=estado,
+            canal=canal,
+            fecha_inicio=fecha_inicio,
+            fecha_fin=fecha_fin,
+            texto=buscar,
+            orden=orden,
+            limite=limite,
+            cursor=cursor
+        )
+    except CursorInvalido as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    return resultados[:limite]
+    # Las campañas del repositorio son internas: se proyectan al modelo sin re-validar
+    return responder_filas(Campaña, resultados, {"X-Siguiente-Cursor": siguiente} if siguiente else None)
 
 # 33) GET /campañas/{id}
-@app.get("/campañas/{id}", response_model=Campaña, summary="Detalle de una campaña por ID")
+@app.get("/campañas/{id}", response_model=Campaña, summary="Detalle de una campaña por ID", dependencies=[Depends(require("leer"))])
 async def obtener_campaña(id: int = Path(..., description="ID de la campaña a consultar")):
-    for c in CAMPAÑAS:
-        if c["id"] == id:
-            return c
-    raise HTTPException(status_code=404, detail="Campaña no encontrada.")
+    campaña = REPOSITORIO_CAMPAÑAS.obtener(id)
+    if campaña is None:
+        raise HTTPException(status_code=404, detail="Campaña no encontrada.")
+    return campaña
 
 # 34) DELETE /campañas/{id}
-@app.delete("/campañas/{id}", response_model=MensajeResponse, summary="Elimina o desactiva una campaña")
+@app.delete("/campañas/{id}", response_model=MensajeResponse, summary="Elimina o desactiva una campaña", dependencies=[Depends(require("eliminar"))])
 async def eliminar_campaña(id: int = Path(..., description="ID de la campaña a eliminar/desactivar")):
-    for c in CAMPAÑAS:
-        if c["id"] == id:
-            if c["estado"] == "activa":
-                raise HTTPException(status_code=403, detail="No se puede eliminar una campaña activa.")
-            CAMPAÑAS.remove(c)
-            return {"message": "Campaña eliminada correctamente."}
-    raise HTTPException(status_code=404, detail="Campaña no encontrada.")
+    campaña = REPOSITORIO_CAMPAÑAS.obtener(id)
+    if campaña is None:
+        raise HTTPException(status_code=404, detail="Campaña no encontrada.")
+    if campaña["estado"] == "activa":
+        raise HTTPException(status_code=403, detail="No se puede eliminar una campaña activa.")
+    try:
+        # Se marca en vez de borrar para que los otros workers la saquen al sincronizar
+        await get_db_async()["campañas"].update_one(
+            {"_id": id}, {"$set": {"eliminada": True, "actualizada": marca_actualizacion()}}
+        )
+    except PyMongoError:
+        logging.exception(f"No se pudo eliminar la campaña {id}")
+        raise HTTPException(status_code=503, detail="No se pudo eliminar la campaña.")
+    REPOSITORIO_CAMPAÑAS.eliminar(id)
+    return {"message": "Campaña eliminada correctamente."}
 
 # ---------------------------------------------------
 # Endpoint raíz
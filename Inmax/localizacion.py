@@ -1,12 +1,27 @@
 from fastapi import FastAPI, HTTPException, Path, Query
 from pydantic import BaseModel, Field
 from typing import List, Optional, Union
+from contextlib import asynccontextmanager
 from datetime import date
 
+from cache_respuestas import cache_respuesta
+from contadores_eventos import CONTADORES_GEO
+from db import get_db_async
+from indice_geo import INDICE_GEO, NIVELES_DETALLE, REGIONES, Caja, caja_de_region
+from respuestas_rapidas import responder_filas
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # El índice se arma con los contadores por celda de Mongo y los sigue
+    await CONTADORES_GEO.iniciar(get_db_async)
+    yield
+    await CONTADORES_GEO.detener()
+
 app = FastAPI(
     title="API de Geolocalización y Mapas Interactivos",
     description="Endpoints para métricas geográficas e interactivas de campañas publicitarias.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # ---------------------------------------------------
@@ -20,55 +35,81 @@ class DatosMapaInteractivo(BaseModel):
     zonas: List[str]
     nivel: str
     metricas: dict
+    clusters: List[PuntoGeografico] = []
 
 # ---------------------------------------------------
-GEODISTRIBUCION_CAMPAÑAS = {
-    1: [
-        {"lat": -33.4489, "lon": -70.6693, "ciudad": "Santiago", "impresiones": 1000},
-        {"lat": -32.8908, "lon": -71.2748, "ciudad": "Valparaíso", "impresiones": 500}
-    ]
-}
+def _nivel(nivel_detalle: str) -> str:
+    if nivel_detalle not in NIVELES_DETALLE:
+        raise HTTPException(status_code=400, detail=f"Nivel de detalle inválido, use uno de: {', '.join(NIVELES_DETALLE)}.")
+    return nivel_detalle
 
-MAPA_INTERACTIVO_CAMPAÑAS = {
-    1: {
-        "zonas": ["Zona A", "Zona B"],
-        "nivel": "medio",
-        "metricas": {"clics": 150, "impresiones": 2000}
-    }
-}
+def _caja(region: Optional[str], bbox: Optional[str]) -> Optional[Caja]:
+    """
+    Caja de la consulta: bbox explícito "lon_min,lat_min,lon_max,lat_max" o la de la región.
+    """
+    if bbox:
+        try:
+            lon_min, lat_min, lon_max, lat_max = (float(valor) for valor in bbox.split(","))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="bbox debe ser lon_min,lat_min,lon_max,lat_max.")
+        if not (-180 <= lon_min <= lon_max <= 180 and -90 <= lat_min <= lat_max <= 90):
+            raise HTTPException(status_code=400, detail="bbox fuera de rango o con mínimos mayores que máximos.")
+        return lon_min, lat_min, lon_max, lat_max
+    if region:
+        caja = caja_de_region(region)
+        if caja is None:
+            raise HTTPException(status_code=400, detail=f"Región desconocida, use una de: {', '.join(REGIONES)}.")
+        return caja
+    return None
 
-# ---------------------------------------------------
+def _clusters(id_campaña: int, nivel: str, caja: Optional[Caja], fecha_inicio: Optional[date], fecha_fin: Optional[date]) -> Optional[List[dict]]:
+    """
+    Clusters del índice. None si la campaña no tiene impresiones con coordenadas.
+    """
+    if not INDICE_GEO.tiene_datos(id_campaña):
+        return None
+    return INDICE_GEO.clusters(id_campaña, nivel, caja, fecha_inicio, fecha_fin)
 
 @app.get("/campañas/geolocalizacion", response_model=List[PuntoGeografico], summary="Puntos geográficos de impacto")
+@cache_respuesta(ttl=300, fuentes=["geolocalizacion"], revalidar=600)
 async def puntos_geograficos(
     id_campaña: int = Query(..., description="ID de la campaña"),
     region: Optional[str] = Query(None, description="Región específica"),
+    bbox: Optional[str] = Query(None, description="Caja lon_min,lat_min,lon_max,lat_max (tiene prioridad sobre region)"),
+    nivel_detalle: str = Query("alto", description="Nivel de agrupación (bajo, medio, alto)"),
     fecha_inicio: Optional[date] = Query(None),
     fecha_fin: Optional[date] = Query(None)
 ):
     """
-    Devuelve la lista de puntos geográficos con métricas de impacto de una campaña.
+    Devuelve los puntos geográficos con impresiones de una campaña, agrupados
+    en celdas del nivel de detalle pedido y ordenados por impresiones.
     """
-    puntos = GEODISTRIBUCION_CAMPAÑAS.get(id_campaña)
-    if not puntos:
+    puntos = _clusters(id_campaña, _nivel(nivel_detalle), _caja(region, bbox), fecha_inicio, fecha_fin)
+    if puntos is None:
         raise HTTPException(status_code=404, detail="Campaña no encontrada o sin datos geográficos.")
-    return puntos
+    return responder_filas(PuntoGeografico, puntos, streaming=False)
 
 # 36) GET /campañas/{id}/mapa-interactivo
 @app.get("/campañas/{id}/mapa-interactivo", response_model=DatosMapaInteractivo, summary="Mapa interactivo de la campaña")
+@cache_respuesta(ttl=300, fuentes=["geolocalizacion"], revalidar=600)
 async def mapa_interactivo(
     id: int = Path(..., description="ID de la campaña"),
-    nivel_detalle: Optional[str] = Query("medio", description="Nivel de detalle (bajo, medio, alto)")
+    nivel_detalle: Optional[str] = Query("medio", description="Nivel de detalle (bajo, medio, alto)"),
+    region: Optional[str] = Query(None, description="Región específica"),
+    bbox: Optional[str] = Query(None, description="Caja lon_min,lat_min,lon_max,lat_max (tiene prioridad sobre region)")
 ):
     """
-    Muestra el mapa interactivo asociado a la campaña, con zonas y métricas.
+    Muestra el mapa interactivo asociado a la campaña, con zonas, métricas y
+    los clusters de impresiones del nivel de detalle.
     """
-    datos = MAPA_INTERACTIVO_CAMPAÑAS.get(id)
-    if not datos:
+    nivel = _nivel(nivel_detalle)
+    caja = _caja(region, bbox)
+    if not INDICE_GEO.tiene_datos(id):
         raise HTTPException(status_code=404, detail="Campaña no encontrada o sin datos de mapa interactivo.")
-    # Ajustar nivel de detalle si se envía
-    datos["nivel"] = nivel_detalle
-    return datos
+    clusters = INDICE_GEO.clusters(id, nivel, caja)
+    ciudades = list(dict.fromkeys(cluster["ciudad"] for cluster in clusters if cluster["ciudad"]))
+    metricas = {"impresiones": sum(cluster["impresiones"] for cluster in clusters), "clusters": len(clusters)}
+    return {"zonas": ciudades, "nivel": nivel, "metricas": metricas, "clusters": clusters}
 
 # ---------------------------------------------------
 # Endpoint raíz
@@ -0,0 +1,147 @@
+from fastapi import FastAPI
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+import ast
+import asyncio
+import importlib
+import logging
+import os
+import re
+import time
+
+# ---------------------------------------------------
+# Prefijo -> módulo con un `app = FastAPI(...)`
+MONTAJES: Dict[str, str] = {
+    "/auth": "login",
+    "/roles": "roles",
+    "/campanas": "lista_campana",
+    "/creacion": "creacion_campana",
+    "/piezas": "ventana_piezas",
+    "/localizacion": "localizacion",
+    "/dashboard": "dashboard",
+    "/indicadores": "indicadores",
+    "/analisis": "analisis",
+    "/inversion": "setting_campaña",
+    "/alertas": "alerta",
+    "/eventos": "eventos",
+}
+
+# GATEWAY_PEREZOSO=0 importa todos los módulos al arrancar (como el despliegue anterior)
+GATEWAY_PEREZOSO = os.getenv("GATEWAY_PEREZOSO", "1") != "0"
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+METODOS = {"get", "post", "put", "patch", "delete", "head", "options"}
+PARAMETRO = re.compile(r"\{[^}]*\}")
+
+# ---------------------------------------------------
+# Rutas leídas del código fuente, sin importar el módulo
+def rutas_declaradas(modulo: str) -> List[Tuple[str, str]]:
+    with open(os.path.join(DIRECTORIO, f"{modulo}.py"), encoding="utf-8") as archivo:
+        arbol = ast.parse(archivo.read())
+    rutas = []
+    for nodo in ast.walk(arbol):
+        if not isinstance(nodo, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        for decorador in nodo.decorator_list:
+            if (
+                isinstance(decorador, ast.Call)
+                and isinstance(decorador.func, ast.Attribute)
+                and isinstance(decorador.func.value, ast.Name)
+                and decorador.func.value.id == "app"
+                and decorador.func.attr in METODOS
+                and decorador.args
+                and isinstance(decorador.args[0], ast.Constant)
+            ):
+                rutas.append((decorador.func.attr.upper(), decorador.args[0].value))
+    return rutas
+
+def colisiones(montajes: List[Tuple[str, str]]) -> Dict[Tuple[str, str], List[str]]:
+    """
+    (método, ruta) que atienden dos o más módulos montados en (prefijo, módulo).
+    Los parámetros se comparan por posición: /x/{id} y /x/{pieza_id} chocan.
+    """
+    dueños: Dict[Tuple[str, str], List[str]] = {}
+    for prefijo, modulo in montajes:
+        for metodo, ruta in rutas_declaradas(modulo):
+            completa = PARAMETRO.sub("{}", prefijo.rstrip("/") + ruta)
+            dueños.setdefault((metodo, completa), []).append(modulo)
+    return {clave: modulos for clave, modulos in dueños.items() if len(modulos) > 1}
+
+# ---------------------------------------------------
+class AppPerezosa:
+    """
+    ASGI que importa el módulo en la primera petición y corre su lifespan
+    dentro de la pila del gateway, para cerrarlo al apagar.
+    """
+
+    def __init__(self, modulo: str):
+        self.modulo = modulo
+        self.app = None
+        self.segundos_carga: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    async def cargar(self, pila: AsyncExitStack):
+        async with self._lock:
+            if self.app is not None:
+                return self.app
+            inicio = time.perf_counter()
+            modulo = await asyncio.to_thread(importlib.import_module, self.modulo)
+            app = modulo.app
+            await pila.enter_async_context(app.router.lifespan_context(app))
+            self.segundos_carga = time.perf_counter() - inicio
+            logging.info(f"Módulo {self.modulo} cargado en {self.segundos_carga * 1000:.0f} ms")
+            self.app = app
+            return app
+
+    async def __call__(self, scope, receive, send):
+        app = self.app or await self.cargar(_pila)
+        await app(scope, receive, send)
+
+_pila: Optional[AsyncExitStack] = None
+APPS = {prefijo: AppPerezosa(modulo) for prefijo, modulo in MONTAJES.items()}
+
+# ---------------------------------------------------
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _pila
+    async with AsyncExitStack() as pila:
+        _pila = pila
+        if not GATEWAY_PEREZOSO:
+            for perezosa in APPS.values():
+                await perezosa.cargar(pila)
+        yield
+        _pila = None
+
+def crear_gateway() -> FastAPI:
+    choques = colisiones(list(MONTAJES.items()))
+    if choques:
+        detalle = ", ".join(f"{m} {r} ({' / '.join(mods)})" for (m, r), mods in choques.items())
+        raise RuntimeError(f"Rutas duplicadas entre módulos: {detalle}")
+
+    gateway = FastAPI(
+        title="Gateway Inmax",
+        description="Un solo proceso ASGI con todos los módulos de Inmax montados bajo prefijos.",
+        version="1.0.0",
+        lifespan=lifespan
+    )
+
+    # Endpoint: /gateway/modulos
+    @gateway.get("/gateway/modulos", summary="Módulos montados, si ya se cargaron y rutas que se pisarían sin prefijo")
+    async def modulos():
+        sin_prefijo = colisiones([("", modulo) for modulo in MONTAJES.values()])
+        return {
+            "modulos": [
+                {"prefijo": prefijo, "modulo": perezosa.modulo, "cargado": perezosa.app is not None, "segundos_carga": perezosa.segundos_carga}
+                for prefijo, perezosa in APPS.items()
+            ],
+            "solapadas_sin_prefijo": [
+                {"metodo": metodo, "ruta": ruta, "modulos": mods}
+                for (metodo, ruta), mods in sin_prefijo.items() if ruta != "/"
+            ],
+        }
+
+    for prefijo, perezosa in APPS.items():
+        gateway.mount(prefijo, perezosa)
+    return gateway
+
+app = crear_gateway()
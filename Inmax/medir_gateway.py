@@ -0,0 +1,90 @@
+"""
+Medición: un proceso uvicorn por módulo vs. el gateway único (main.py).
+
+Para cada despliegue reporta el tiempo hasta que todos los procesos
+responden y la memoria residente (VmRSS) total, justo al arrancar y después
+de tocar una ruta de cada módulo (en el gateway perezoso eso los importa).
+
+Uso (desde Inmax/, Linux):
+    python medir_gateway.py [puerto_base]
+"""
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from main import MONTAJES
+
+PUERTO_BASE = int(sys.argv[1]) if len(sys.argv) > 1 else 8100
+
+
+def rss_kb(pid):
+    with open(f"/proc/{pid}/status") as archivo:
+        for linea in archivo:
+            if linea.startswith("VmRSS:"):
+                return int(linea.split()[1])
+    return 0
+
+
+def lanzar(modulo, puerto, entorno=None):
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{modulo}:app", "--port", str(puerto), "--log-level", "warning"],
+        env={**os.environ, **(entorno or {})},
+    )
+
+
+def get(url):
+    try:
+        urllib.request.urlopen(url, timeout=5).read()
+    except urllib.error.HTTPError:
+        pass  # 401/404 también prueba que el proceso ya atiende
+
+
+def esperar(url, limite=60.0):
+    fin = time.perf_counter() + limite
+    while time.perf_counter() < fin:
+        try:
+            get(url)
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.02)
+    raise TimeoutError(url)
+
+
+def medir(nombre, procesos, urls_arranque, urls_uso):
+    inicio = time.perf_counter()
+    try:
+        for url in urls_arranque:
+            esperar(url)
+        arranque = time.perf_counter() - inicio
+        rss_inicial = sum(rss_kb(p.pid) for p in procesos)
+        for url in urls_uso:
+            get(url)
+        rss_final = sum(rss_kb(p.pid) for p in procesos)
+    finally:
+        for p in procesos:
+            p.terminate()
+        for p in procesos:
+            p.wait()
+    print(f"{nombre:<24} arranque {arranque:6.2f} s   RSS inicial {rss_inicial / 1024:7.1f} MB   RSS con uso {rss_final / 1024:7.1f} MB")
+
+
+def main():
+    modulos = list(MONTAJES.values())
+
+    puertos = [PUERTO_BASE + i for i in range(len(modulos))]
+    procesos = [lanzar(modulo, puerto) for modulo, puerto in zip(modulos, puertos)]
+    urls = [f"http://127.0.0.1:{puerto}/" for puerto in puertos]
+    medir(f"{len(modulos)} procesos", procesos, urls, urls)
+
+    puerto = PUERTO_BASE + len(modulos)
+    urls_uso = [f"http://127.0.0.1:{puerto}{prefijo}/" for prefijo in MONTAJES]
+    for nombre, perezoso in (("gateway (todo al inicio)", "0"), ("gateway perezoso", "1")):
+        proceso = lanzar("main", puerto, {"GATEWAY_PEREZOSO": perezoso})
+        medir(nombre, [proceso], [f"http://127.0.0.1:{puerto}/gateway/modulos"], urls_uso)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Tiempo de importación de un módulo con `python -X importtime`.
+
+Muestra los paquetes que más tardan y termina con código 1 si el total
+supera el presupuesto o si se importó algún backend que debe cargarse
+recién en el primer uso. Pensado para correr en CI antes de desplegar.
+
+Uso (desde Inmax/):
+    python medir_importacion.py [modulo] [presupuesto_ms]
+"""
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+MODULO = sys.argv[1] if len(sys.argv) > 1 else "login"
+PRESUPUESTO_MS = float(sys.argv[2]) if len(sys.argv) > 2 else float(os.getenv("IMPORTACION_PRESUPUESTO_MS", "800"))
+# Paquetes que login.py solo debe importar al conectarse o validar un token
+PROHIBIDOS = ("pymongo", "motor", "sqlalchemy", "jose", "requests", "psycopg2")
+MOSTRAR = 15
+
+
+def medir(modulo):
+    salida = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if salida.returncode != 0:
+        sys.exit(salida.stderr)
+    acumulado = {}
+    for linea in salida.stderr.splitlines():
+        # "import time:   self [us] |  cumulative | imported package"
+        if not linea.startswith("import time:") or "imported package" in linea:
+            continue
+        _, acumulado_us, nombre = linea[len("import time:"):].split("|")
+        nombre = nombre.strip()
+        acumulado[nombre] = int(acumulado_us) / 1000
+    return acumulado
+
+
+def main():
+    acumulado = medir(MODULO)
+    total = acumulado.get(MODULO, 0.0)
+
+    # Agrupa por paquete raíz solo las importaciones de primer nivel de cada uno
+    por_paquete = defaultdict(float)
+    for nombre, ms in acumulado.items():
+        raiz = nombre.split(".")[0]
+        if nombre == raiz and raiz != MODULO:
+            por_paquete[raiz] += ms
+    print(f"import {MODULO}: {total:.1f} ms (presupuesto {PRESUPUESTO_MS:.0f} ms)")
+    for paquete, ms in sorted(por_paquete.items(), key=lambda item: item[1], reverse=True)[:MOSTRAR]:
+        print(f"  {ms:8.1f} ms  {paquete}")
+
+    errores = []
+    prohibidos = sorted({n.split(".")[0] for n in acumulado} & set(PROHIBIDOS))
+    if prohibidos:
+        errores.append(f"se importaron al arrancar: {', '.join(prohibidos)}")
+    if total > PRESUPUESTO_MS:
+        errores.append(f"{total:.1f} ms supera el presupuesto de {PRESUPUESTO_MS:.0f} ms")
+    if errores:
+        print("ERROR: " + "; ".join(errores))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+from bisect import bisect_left, insort
+from calendar import timegm
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# ---------------------------------------------------
+# Columnas del rollup por campaña
+IMPRESIONES, CLICKS, CONVERSIONES, COSTO, INGRESOS = range(5)
+N_COLUMNAS = 5
+SEGUNDOS_DIA = 86400
+# Sobre esta cantidad de trozos, los de un día se funden en uno
+MAX_TROZOS_DIA = 32
+# z de un intervalo de confianza de 95 %
+Z_95 = 1.959964
+
+# Métricas por las que se puede ordenar; *_min es la cota inferior de Wilson
+METRICAS = (
+    "impresiones", "clicks", "conversiones", "costo", "ingresos",
+    "ctr", "ctr_min", "ctr_max", "conversion", "conversion_min", "conversion_max",
+    "cpc", "cpm", "roi",
+)
+
+CONTEOS = ("impresiones", "clicks", "conversiones")
+
+Trozo = Tuple[np.ndarray, np.ndarray]
+
+# ---------------------------------------------------
+class RollupCampañas:
+    """
+    Totales diarios por campaña en trozos columnares: índices de campaña
+    (int32) y una matriz (campañas del trozo x N_COLUMNAS).
+
+    Cada lote de eventos agrega un trozo por día (una fila por campaña); una
+    consulta suma los trozos del rango sobre una matriz densa indexada por
+    campaña, sin recorrer las campañas en Python.
+    """
+
+    def __init__(self):
+        self._indices: Dict[int, int] = {}
+        self._ids: List[int] = []
+        self._dias: Dict[int, List[Trozo]] = {}
+        self._orden: List[int] = []
+
+    def _indice(self, campaña_id: int) -> int:
+        indice = self._indices.get(campaña_id)
+        if indice is None:
+            indice = self._indices[campaña_id] = len(self._ids)
+            self._ids.append(campaña_id)
+        return indice
+
+    def registrar(self, eventos: List[dict]):
+        dias, indices, columnas, valores = [], [], [], []
+
+        def sumar(dia, indice, columna, valor):
+            dias.append(dia)
+            indices.append(indice)
+            columnas.append(columna)
+            valores.append(valor)
+
+        for evento in eventos:
+            campaña_id = evento.get("campaña_id")
+            if campaña_id is None:
+                continue
+            dia = timegm(evento["fecha"].utctimetuple()) // SEGUNDOS_DIA
+            indice = self._indice(campaña_id)
+            tipo = evento["tipo"]
+            if tipo == "impresion":
+                sumar(dia, indice, IMPRESIONES, 1.0)
+            elif tipo == "click":
+                sumar(dia, indice, CLICKS, 1.0)
+            elif tipo == "conversion":
+                sumar(dia, indice, CONVERSIONES, 1.0)
+                if evento.get("valor"):
+                    sumar(dia, indice, INGRESOS, evento["valor"])
+            if evento.get("costo"):
+                sumar(dia, indice, COSTO, evento["costo"])
+        if not dias:
+            return
+
+        dias = np.array(dias, dtype=np.int64)
+        indices = np.array(indices, dtype=np.int32)
+        columnas = np.array(columnas, dtype=np.intp)
+        valores = np.array(valores, dtype=np.float64)
+        for dia in np.unique(dias).tolist():
+            en_dia = dias == dia
+            self._agregar_trozo(dia, _sumar_por_indice(indices[en_dia], columnas[en_dia], valores[en_dia]))
+
+    def sumar(self, dia: int, campaña_ids: List[int], matriz: np.ndarray):
+        """
+        Suma filas ya calculadas (campañas x N_COLUMNAS) al día; una campaña puede repetirse.
+        """
+        indices = np.array([self._indice(campaña_id) for campaña_id in campaña_ids], dtype=np.int32)
+        self._agregar_trozo(dia, _fundir([(indices, matriz)]))
+
+    def _agregar_trozo(self, dia: int, trozo: Trozo):
+        trozos = self._dias.get(dia)
+        if trozos is None:
+            trozos = self._dias[dia] = []
+            insort(self._orden, dia)
+        trozos.append(trozo)
+        if len(trozos) > MAX_TROZOS_DIA:
+            self._dias[dia] = [_fundir(trozos)]
+
+    def totales(self, fecha_inicio: Optional[date] = None, fecha_fin: Optional[date] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (ids de campaña, matriz campañas x N_COLUMNAS) sumando los días del rango.
+        Solo aparecen las campañas con algún registro en el rango.
+        """
+        desde = 0
+        hasta = len(self._orden)
+        if fecha_inicio is not None:
+            desde = bisect_left(self._orden, timegm(fecha_inicio.timetuple()) // SEGUNDOS_DIA)
+        if fecha_fin is not None:
+            # fecha_fin es inclusiva
+            hasta = bisect_left(self._orden, timegm(fecha_fin.timetuple()) // SEGUNDOS_DIA + 1, desde)
+        matriz = np.zeros((len(self._ids), N_COLUMNAS))
+        presentes = np.zeros(len(self._ids), dtype=bool)
+        for i in range(desde, hasta):
+            dia = self._orden[i]
+            trozos = self._dias[dia]
+            if len(trozos) > 1 and dia != self._orden[-1]:
+                # Un día pasado ya casi no recibe eventos: se funde una vez para las próximas consultas
+                trozos = self._dias[dia] = [_fundir(trozos)]
+            # Dentro de un trozo cada campaña aparece una vez: basta una suma indexada
+            for indices, valores in trozos:
+                matriz[indices] += valores
+                presentes[indices] = True
+        return np.array(self._ids, dtype=np.int64)[presentes], matriz[presentes]
+
+def _sumar_por_indice(indices: np.ndarray, columnas: np.ndarray, valores: np.ndarray) -> Trozo:
+    unicos, posicion = np.unique(indices, return_inverse=True)
+    matriz = np.zeros((len(unicos), N_COLUMNAS))
+    np.add.at(matriz, (posicion, columnas), valores)
+    return unicos, matriz
+
+def _fundir(trozos: List[Trozo]) -> Trozo:
+    indices = np.concatenate([trozo[0] for trozo in trozos])
+    matriz = np.concatenate([trozo[1] for trozo in trozos])
+    unicos, posicion = np.unique(indices, return_inverse=True)
+    fundida = np.empty((len(unicos), N_COLUMNAS))
+    for columna in range(N_COLUMNAS):
+        fundida[:, columna] = np.bincount(posicion, weights=matriz[:, columna], minlength=len(unicos))
+    return unicos, fundida
+
+# ---------------------------------------------------
+def _dividir(numerador: np.ndarray, denominador: np.ndarray) -> np.ndarray:
+    resultado = np.full(numerador.shape, np.nan)
+    np.divide(numerador, denominador, out=resultado, where=denominador > 0)
+    return resultado
+
+def _wilson(exitos: np.ndarray, intentos: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Intervalo de Wilson al 95 %: con pocos intentos es ancho en vez de extremo.
+    """
+    # Los éxitos pueden superar a los intentos (conversiones sin click propio):
+    # con p > 1 la raíz queda negativa. NaN se conserva
+    p = np.clip(_dividir(exitos, intentos), 0, 1)
+    z2 = Z_95 * Z_95
+    with np.errstate(invalid="ignore", divide="ignore"):
+        centro = (p + z2 / (2 * intentos)) / (1 + z2 / intentos)
+        radio = Z_95 * np.sqrt(p * (1 - p) / intentos + z2 / (4 * intentos * intentos)) / (1 + z2 / intentos)
+    return np.clip(centro - radio, 0, 1), np.clip(centro + radio, 0, 1)
+
+def calcular(matriz: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Todas las métricas para todas las campañas a la vez. NaN donde no hay
+    denominador (p. ej. CTR sin impresiones).
+    """
+    impresiones = matriz[:, IMPRESIONES]
+    clicks = matriz[:, CLICKS]
+    conversiones = matriz[:, CONVERSIONES]
+    costo = matriz[:, COSTO]
+    ingresos = matriz[:, INGRESOS]
+    ctr_min, ctr_max = _wilson(clicks, impresiones)
+    conversion_min, conversion_max = _wilson(conversiones, clicks)
+    return {
+        "impresiones": impresiones,
+        "clicks": clicks,
+        "conversiones": conversiones,
+        "costo": costo,
+        "ingresos": ingresos,
+        "ctr": _dividir(clicks, impresiones),
+        "ctr_min": ctr_min,
+        "ctr_max": ctr_max,
+        "conversion": _dividir(conversiones, clicks),
+        "conversion_min": conversion_min,
+        "conversion_max": conversion_max,
+        "cpc": _dividir(costo, clicks),
+        "cpm": _dividir(costo * 1000, impresiones),
+        "roi": _dividir(ingresos - costo, costo),
+    }
+
+def ranking(metricas: Dict[str, np.ndarray], orden: str, descendente: bool, n: int) -> np.ndarray:
+    """
+    Posiciones de las n mejores campañas según `orden`, con argpartition
+    (O(campañas)) y luego solo las n ordenadas. Los NaN quedan al final.
+    """
+    valores = metricas[orden]
+    clave = np.where(np.isnan(valores), np.inf, -valores if descendente else valores)
+    n = min(n, len(clave))
+    if n <= 0:
+        return np.empty(0, dtype=np.intp)
+    if n < len(clave):
+        candidatos = np.argpartition(clave, n - 1)[:n]
+    else:
+        candidatos = np.arange(len(clave))
+    return candidatos[np.argsort(clave[candidatos], kind="stable")]
+
+def filas(ids: np.ndarray, metricas: Dict[str, np.ndarray], posiciones: np.ndarray) -> List[dict]:
+    listas = {}
+    for nombre, valores in metricas.items():
+        valores = valores[posiciones]
+        if nombre in CONTEOS:
+            listas[nombre] = valores.astype(np.int64).tolist()
+        else:
+            # NaN -> None en la respuesta JSON
+            listas[nombre] = [None if v != v else v for v in valores.tolist()]
+    resultado = []
+    for i, campaña_id in enumerate(ids[posiciones].tolist()):
+        fila = {nombre: listas[nombre][i] for nombre in METRICAS}
+        fila["campaña_id"] = campaña_id
+        resultado.append(fila)
+    return resultado
+
+# ---------------------------------------------------
+ROLLUP_CAMPAÑAS = RollupCampañas()
+
+def registrar_totales(cambios: Dict[tuple, Dict[str, float]]):
+    """
+    Suma los cambios de los contadores diarios de Mongo, por (día, país, canal, campaña).
+    """
+    por_dia: Dict[int, Tuple[List[int], List[List[float]]]] = {}
+    for (dia, _, _, campaña_id), valores in cambios.items():
+        if campaña_id is None:
+            continue
+        ids, filas = por_dia.setdefault(dia, ([], []))
+        ids.append(campaña_id)
+        filas.append([valores["impresiones"], valores["clicks"], valores["conversiones"], valores["costo"], valores["ingresos"]])
+    for dia, (ids, filas) in por_dia.items():
+        ROLLUP_CAMPAÑAS.sumar(dia, ids, np.array(filas, dtype=np.float64))
@@ -0,0 +1,369 @@
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
+import base64
+import json
+import logging
+import os
+
+from pymongo.errors import PyMongoError
+
+from indice_texto import IndiceTexto, huella
+
+# ---------------------------------------------------
+# Campos con índice ordenado (todos los campos por los que se puede ordenar)
+ORDENES_INDEXADOS = ("id", "fecha_inicio", "fecha_fin", "nombre", "estado", "canal", "presupuesto")
+# Orden por puntaje BM25, disponible solo cuando se busca texto
+RELEVANCIA = "relevancia"
+
+# Cada worker relee de Mongo las campañas que crearon o borraron los demás
+CAMPAÑAS_SINCRONIZACION_S = float(os.getenv("CAMPAÑAS_SINCRONIZACION_S", "5"))
+# Se relee un poco antes de la última lectura: escrituras en vuelo y relojes desfasados
+CAMPAÑAS_MARGEN_S = 30
+
+# Las consultas se resuelven en memoria: en Mongo solo hace falta el de sincronización
+INDICES_MONGO = [
+    [("actualizada", 1)],
+]
+
+# Tipo del valor que guarda el cursor según el orden (el primer elemento de la clave)
+TIPOS_CURSOR = {
+    "id": (int,),
+    "fecha_inicio": (datetime,),
+    "fecha_fin": (datetime,),
+    "nombre": (str,),
+    "estado": (str,),
+    "canal": (str,),
+    "presupuesto": (int, float),
+    RELEVANCIA: (int, float),
+}
+
+class CursorInvalido(ValueError):
+    pass
+
+def fecha_utc(valor):
+    """
+    Datetimes con zona horaria a UTC sin zona, como los guarda Mongo y como
+    los compara el resto del repositorio; cualquier otro valor queda igual.
+    """
+    if isinstance(valor, datetime) and valor.tzinfo is not None:
+        return valor.astimezone(timezone.utc).replace(tzinfo=None)
+    return valor
+
+def _texto(campaña: dict) -> str:
+    return f"{campaña['nombre']} {campaña['descripcion']}"
+
+def marca_actualizacion() -> datetime:
+    # Milisegundos, como los guarda Mongo: la marca leída de vuelta es igual a la local
+    ahora = datetime.utcnow()
+    return ahora.replace(microsecond=ahora.microsecond // 1000 * 1000)
+
+def codificar_cursor(orden: str, valor, id: int) -> str:
+    if isinstance(valor, datetime):
+        valor = {"dt": valor.isoformat()}
+    crudo = json.dumps([orden, valor, id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(crudo).decode().rstrip("=")
+
+def decodificar_cursor(cursor: str) -> Tuple[str, object, int]:
+    try:
+        crudo = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        orden, valor, id = json.loads(crudo)
+        if isinstance(valor, dict):
+            valor = fecha_utc(datetime.fromisoformat(valor["dt"]))
+        tipos = TIPOS_CURSOR.get(orden)
+        # Un valor de otro tipo no se puede comparar con las claves del índice
+        if tipos is None or isinstance(valor, bool) or not isinstance(valor, tipos):
+            raise CursorInvalido("Cursor de paginación inválido.")
+        return orden, valor, int(id)
+    except (ValueError, TypeError, KeyError):
+        raise CursorInvalido("Cursor de paginación inválido.")
+
+# ---------------------------------------------------
+class RepositorioCampañas:
+    """
+    Campañas en memoria con índice hash por id, índices ordenados por
+    fecha_inicio/fecha_fin, conjuntos por estado/canal e índice de texto
+    sobre nombre y descripción.
+
+    Cada consulta elige la fuente de candidatos más barata: recorrer el
+    índice del orden pedido hasta juntar `limite` resultados, o materializar
+    el filtro más selectivo y ordenar solo esos candidatos.
+    """
+
+    def __init__(self):
+        self._por_id: Dict[int, dict] = {}
+        self._ordenados: Dict[str, List[Tuple[object, int]]] = {campo: [] for campo in ORDENES_INDEXADOS}
+        # Ids en el mismo orden que cada índice, para cortar rangos y convertirlos a conjuntos en C
+        self._ids: Dict[str, List[int]] = {campo: [] for campo in ORDENES_INDEXADOS}
+        self._por_estado: Dict[str, Set[int]] = {}
+        self._por_canal: Dict[str, Set[int]] = {}
+        self.texto = IndiceTexto()
+        self._sincronizado: Optional[datetime] = None
+        self._tarea: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._por_id)
+
+    def obtener(self, id: int) -> Optional[dict]:
+        return self._por_id.get(id)
+
+    def siguiente_id(self) -> int:
+        ids = self._ordenados["id"]
+        return ids[-1][1] + 1 if ids else 1
+
+    def agregar(self, campaña: dict):
+        """
+        Agrega o reemplaza la campaña en todos los índices, o en ninguno si
+        algún campo no se puede indexar.
+        """
+        id = campaña["id"]
+        for campo in ("fecha_inicio", "fecha_fin"):
+            campaña[campo] = fecha_utc(campaña[campo])
+        # Primero solo comparaciones: si un valor no se puede ordenar con los
+        # demás, falla aquí sin haber tocado nada
+        for campo in ORDENES_INDEXADOS:
+            bisect_right(self._ordenados[campo], (campaña[campo], id))
+        estado, canal = campaña["estado"].lower(), campaña["canal"].lower()
+        texto = _texto(campaña)
+
+        if id in self._por_id:
+            self._quitar(id)
+        self._por_id[id] = campaña
+        for campo in ORDENES_INDEXADOS:
+            indice = self._ordenados[campo]
+            posicion = bisect_right(indice, (campaña[campo], id))
+            indice.insert(posicion, (campaña[campo], id))
+            self._ids[campo].insert(posicion, id)
+        self._por_estado.setdefault(estado, set()).add(id)
+        self._por_canal.setdefault(canal, set()).add(id)
+        # Re-tokenizar es lo caro: solo si cambió el texto (o no estaba, p. ej. tras un snapshot)
+        if self.texto.huella(id) != huella(texto):
+            self.texto.agregar(id, texto)
+
+    def eliminar(self, id: int) -> Optional[dict]:
+        campaña = self._quitar(id)
+        if campaña is not None:
+            self.texto.eliminar(id)
+        return campaña
+
+    def _quitar(self, id: int) -> Optional[dict]:
+        # Todo menos el índice de texto
+        campaña = self._por_id.pop(id, None)
+        if campaña is None:
+            return None
+        for campo in ORDENES_INDEXADOS:
+            indice = self._ordenados[campo]
+            posicion = bisect_left(indice, (campaña[campo], id))
+            del indice[posicion]
+            del self._ids[campo][posicion]
+        self._por_estado[campaña["estado"].lower()].discard(id)
+        self._por_canal[campaña["canal"].lower()].discard(id)
+        return campaña
+
+    def cargar_texto(self, ruta: str):
+        """
+        Adopta un snapshot del índice de texto. Va antes de cargar las
+        campañas, que solo re-tokenizan lo que cambió desde el snapshot;
+        después `reconciliar_texto` saca lo que ya no existe.
+        """
+        self.texto = IndiceTexto.cargar(ruta)
+        self.reconciliar_texto(quitar=False)
+
+    def reconciliar_texto(self, quitar: bool = True):
+        """
+        Indexa las campañas que faltan o cambiaron y, con `quitar`, saca del
+        índice las que no están en el repositorio.
+        """
+        if quitar:
+            for id in self.texto.ids():
+                if id not in self._por_id:
+                    self.texto.eliminar(id)
+        for id, campaña in self._por_id.items():
+            texto = _texto(campaña)
+            if self.texto.huella(id) != huella(texto):
+                self.texto.agregar(id, texto)
+
+    async def sincronizar(self, db):
+        """
+        Trae de la colección "campañas" lo cambiado desde la última vez (todo
+        en la primera): altas de cualquier worker y bajas marcadas con
+        `eliminada`. Las campañas con la misma `actualizada` no se reindexan.
+        """
+        inicio = datetime.utcnow()
+        filtro = {}
+        if self._sincronizado is not None:
+            filtro["actualizada"] = {"$gte": self._sincronizado - timedelta(seconds=CAMPAÑAS_MARGEN_S)}
+        async for documento in db["campañas"].find(filtro):
+            documento.pop("_id", None)
+            id = documento["id"]
+            if documento.get("eliminada"):
+                self.eliminar(id)
+                continue
+            actual = self._por_id.get(id)
+            if actual is not None and actual.get("actualizada") == documento.get("actualizada"):
+                continue
+            try:
+                self.agregar(documento)
+            except (KeyError, TypeError, ValueError):
+                logging.exception(f"No se pudo indexar la campaña {id} leída de Mongo")
+        self._sincronizado = inicio
+
+    async def _sincronizar_periodicamente(self, db_fabrica):
+        while True:
+            await asyncio.sleep(CAMPAÑAS_SINCRONIZACION_S)
+            try:
+                await self.sincronizar(db_fabrica())
+            except PyMongoError:
+                logging.exception("No se pudieron sincronizar las campañas desde Mongo")
+
+    async def iniciar(self, db_fabrica):
+        # La primera carga se espera: el módulo no atiende con el repositorio vacío
+        if self._tarea is None:
+            try:
+                await self.sincronizar(db_fabrica())
+            except PyMongoError:
+                logging.exception("No se pudieron cargar las campañas desde Mongo")
+            self._tarea = asyncio.create_task(self._sincronizar_periodicamente(db_fabrica))
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+
+    def _rango(self, campo: str, desde=None, hasta=None) -> Tuple[int, int]:
+        indice = self._ordenados[campo]
+        i = 0 if desde is None else bisect_left(indice, (desde,))
+        j = len(indice) if hasta is None else bisect_left(indice, (hasta,), i)
+        return i, j
+
+    def buscar(
+        self,
+        estado: Optional[str] = None,
+        canal: Optional[str] = None,
+        fecha_inicio: Optional[date] = None,
+        fecha_fin: Optional[date] = None,
+        texto: Optional[str] = None,
+        orden: Optional[str] = None,
+        limite: int = 10,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        Retorna una página de campañas y el cursor de la siguiente (o None).
+        Si se busca texto y no se pide orden, se ordena por relevancia.
+        """
+        puntajes = self.texto.buscar(texto) if texto else None
+        if orden not in ORDENES_INDEXADOS:
+            orden = RELEVANCIA if puntajes is not None else "id"
+
+        if orden == RELEVANCIA:
+            clave = lambda c: (-puntajes[c["id"]], c["id"])
+        else:
+            clave = lambda c: (c[orden], c["id"])
+        despues = None
+        if cursor:
+            orden_cursor, valor, id_cursor = decodificar_cursor(cursor)
+            if orden_cursor != orden:
+                raise CursorInvalido("El cursor corresponde a otro orden.")
+            despues = (valor, id_cursor)
+
+        # Límites de fecha con la misma semántica que antes (por día, inclusivos)
+        inicio_desde = datetime.combine(fecha_inicio, time.min) if fecha_inicio else None
+        fin_hasta = datetime.combine(fecha_fin + timedelta(days=1), time.min) if fecha_fin else None
+
+        # Igualdades: un conjunto de ids por filtro
+        conjuntos: Dict[str, Set[int]] = {}
+        if puntajes is not None:
+            conjuntos["texto"] = puntajes.keys()
+        if estado:
+            conjuntos["estado"] = self._por_estado.get(estado.lower(), set())
+        if canal:
+            conjuntos["canal"] = self._por_canal.get(canal.lower(), set())
+
+        # Rangos: como fecha_fin > fecha_inicio, cada límite acota también el otro índice
+        rangos = {}
+        if inicio_desde or fin_hasta:
+            rangos["fecha_inicio"] = self._rango("fecha_inicio", desde=inicio_desde, hasta=fin_hasta)
+            rangos["fecha_fin"] = self._rango("fecha_fin", desde=inicio_desde, hasta=fin_hasta)
+
+        def cumple(c: dict) -> bool:
+            for conjunto in conjuntos.values():
+                if c["id"] not in conjunto:
+                    return False
+            if inicio_desde and c["fecha_inicio"] < inicio_desde:
+                return False
+            if fin_hasta and c["fecha_fin"] >= fin_hasta:
+                return False
+            return True
+
+        # Costo de materializar: tamaño de la fuente de candidatos más pequeña
+        total = len(self._por_id)
+        if not total:
+            return [], None
+        fuentes = {campo: j - i for campo, (i, j) in rangos.items()}
+        fuentes.update({nombre: len(conjunto) for nombre, conjunto in conjuntos.items()})
+        menor = min(fuentes, key=fuentes.get) if fuentes else None
+
+        # Costo de recorrer el índice del orden: pasos hasta juntar `limite`
+        # coincidencias, estimando la selectividad con filtros independientes
+        i, j = rangos.get(orden, (0, total))
+        esperados = float(j - i)
+        for nombre, tamaño in fuentes.items():
+            # El rango del propio índice ya está descontado en j - i
+            if not (nombre == orden and nombre in rangos):
+                esperados *= tamaño / total
+        costo_recorrido = (limite + 1) * (j - i) / esperados if esperados >= 1 else float(j - i)
+
+        if orden != RELEVANCIA and (menor is None or costo_recorrido < fuentes[menor]):
+            pagina = self._recorrer(orden, rangos.get(orden), despues, cumple, limite + 1)
+        else:
+            pagina = self._materializar(conjuntos, rangos, fuentes, clave, despues, cumple, limite + 1)
+
+        siguiente = None
+        if len(pagina) > limite:
+            pagina = pagina[:limite]
+            ultima = pagina[-1]
+            siguiente = codificar_cursor(orden, clave(ultima)[0], ultima["id"])
+        return pagina, siguiente
+
+    def _recorrer(self, orden, rango, despues, cumple, cuantos) -> List[dict]:
+        indice = self._ordenados[orden]
+        i, j = rango or (0, len(indice))
+        if despues is not None:
+            i = max(i, bisect_right(indice, despues))
+        resultados = []
+        while i < j and len(resultados) < cuantos:
+            campaña = self._por_id[indice[i][1]]
+            if cumple(campaña):
+                resultados.append(campaña)
+            i += 1
+        return resultados
+
+    def _materializar(self, conjuntos, rangos, fuentes, clave, despues, cumple, cuantos) -> List[dict]:
+        # Intersecta las fuentes de menor a mayor; las que son mucho más grandes
+        # que el resultado parcial se dejan a `cumple`, que es más barato ahí
+        resultado = None
+        for nombre in sorted(fuentes, key=fuentes.get):
+            if resultado is not None and fuentes[nombre] > 4 * len(resultado):
+                break
+            if nombre in conjuntos:
+                conjunto = conjuntos[nombre]
+            else:
+                i, j = rangos[nombre]
+                conjunto = set(self._ids[nombre][i:j])
+            resultado = conjunto if resultado is None else resultado & conjunto
+
+        filas = [c for c in map(self._por_id.__getitem__, resultado) if cumple(c)]
+        filas.sort(key=clave)
+        if despues is not None:
+            claves = [clave(c) for c in filas]
+            filas = filas[bisect_right(claves, despues):]
+        return filas[:cuantos]
+
+# ---------------------------------------------------
+async def crear_indices_mongo(db):
+    for claves in INDICES_MONGO:
+        await db["campañas"].create_index(claves)
+
+REPOSITORIO_CAMPAÑAS = RepositorioCampañas()
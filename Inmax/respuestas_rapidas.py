@@ -0,0 +1,81 @@
+from fastapi.responses import Response, StreamingResponse
+from functools import lru_cache
+from operator import itemgetter
+from pydantic import BaseModel
+from typing import Dict, Iterator, List, Optional, Type
+import os
+
+import orjson
+
+# ---------------------------------------------------
+# Sobre este número de filas la respuesta se envía como arreglo JSON por partes
+UMBRAL_STREAMING = int(os.getenv("RESPUESTAS_UMBRAL_STREAMING", "20000"))
+FILAS_POR_TROZO = 2000
+# Claves no str (p. ej. ids int) se escriben como texto, igual que json estándar
+OPCIONES_ORJSON = orjson.OPT_NON_STR_KEYS
+
+def _por_defecto(valor):
+    if isinstance(valor, BaseModel):
+        return valor.dict()
+    if isinstance(valor, (set, frozenset)):
+        return list(valor)
+    raise TypeError(f"No se puede serializar {type(valor).__name__}")
+
+def serializar(valor) -> bytes:
+    """
+    JSON con orjson; date/datetime salen en ISO 8601 como con FastAPI.
+    """
+    return orjson.dumps(valor, default=_por_defecto, option=OPCIONES_ORJSON)
+
+class RespuestaJSON(Response):
+    media_type = "application/json"
+
+    def render(self, contenido) -> bytes:
+        return serializar(contenido)
+
+# ---------------------------------------------------
+class Serializador:
+    """
+    Proyección precalculada de filas internas (dicts de confianza) a los
+    campos de un modelo, sin validar fila por fila con pydantic.
+
+    Si la primera fila ya tiene exactamente los campos del modelo, las filas
+    se pasan tal cual a orjson.
+    """
+
+    def __init__(self, modelo: Type[BaseModel]):
+        self.campos = tuple(modelo.__fields__)
+        self._conjunto = frozenset(self.campos)
+        self._extraer = itemgetter(*self.campos)
+
+    def proyectar(self, filas: List[dict]) -> List[dict]:
+        if not filas or filas[0].keys() == self._conjunto:
+            return filas
+        campos = self.campos
+        extraer = self._extraer
+        if len(campos) == 1:
+            return [{campos[0]: extraer(fila)} for fila in filas]
+        return [dict(zip(campos, extraer(fila))) for fila in filas]
+
+    def trozos(self, filas: List[dict]) -> Iterator[bytes]:
+        # "[" + filas separadas por "," + "]", serializando FILAS_POR_TROZO a la vez
+        yield b"["
+        for i in range(0, len(filas), FILAS_POR_TROZO):
+            trozo = serializar(self.proyectar(filas[i:i + FILAS_POR_TROZO]))[1:-1]
+            yield trozo if i == 0 else b"," + trozo
+        yield b"]"
+
+@lru_cache(maxsize=None)
+def serializador(modelo: Type[BaseModel]) -> Serializador:
+    return Serializador(modelo)
+
+def responder_filas(modelo: Type[BaseModel], filas: List[dict], headers: Optional[Dict[str, str]] = None, streaming: bool = True) -> Response:
+    """
+    Respuesta rápida para endpoints con response_model=List[modelo] cuyas
+    filas se arman internamente. FastAPI no re-valida un Response retornado.
+    """
+    s = serializador(modelo)
+    if streaming and len(filas) > UMBRAL_STREAMING:
+        # Generador síncrono: Starlette lo itera en el threadpool, fuera del loop
+        return StreamingResponse(s.trozos(filas), media_type="application/json", headers=headers)
+    return RespuestaJSON(s.proyectar(filas), headers=headers)
@@ -0,0 +1,293 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+import asyncio
+import logging
+import os
+import time
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import PyMongoError
+
+from db import get_db_async
+
+# ---------------------------------------------------
+# Cada worker gasta contra un cupo reservado en Mongo y escribe el gasto en lotes
+RITMO_INTERVALO_S = float(os.getenv("RITMO_INTERVALO_S", "1.0"))
+# Fracción del presupuesto que se reserva de una vez
+RITMO_FRACCION_CUPO = float(os.getenv("RITMO_FRACCION_CUPO", "0.01"))
+# Se pide un cupo nuevo cuando queda menos de esta fracción del anterior
+RITMO_UMBRAL_RECARGA = 0.5
+# Tras no poder reservar, no se reintenta hasta pasado este plazo: otro worker
+# puede devolver su cupo al detenerse o el presupuesto puede subir
+RITMO_SIN_PRESUPUESTO_TTL_S = float(os.getenv("RITMO_SIN_PRESUPUESTO_TTL_S", "30"))
+COLECCION_PRESUPUESTOS = "presupuestos"
+
+def _documento_presupuesto(presupuesto: float, fecha_inicio: datetime, fecha_fin: datetime) -> dict:
+    return {
+        "$set": {"presupuesto": presupuesto, "fecha_inicio": fecha_inicio, "fecha_fin": fecha_fin},
+        "$setOnInsert": {"gastado": 0.0, "reservado": 0.0},
+    }
+
+async def registrar_campaña(campaña_id: int, presupuesto: float, fecha_inicio: datetime, fecha_fin: datetime):
+    """
+    Crea o actualiza el documento de presupuesto de la campaña sin tocar lo ya gastado.
+    """
+    await get_db_async()[COLECCION_PRESUPUESTOS].update_one(
+        {"_id": campaña_id},
+        _documento_presupuesto(presupuesto, fecha_inicio, fecha_fin),
+        upsert=True,
+    )
+    CONTADORES_PRESUPUESTO.presupuesto_actualizado(campaña_id)
+
+async def registrar_campañas(campañas: List[dict]):
+    """
+    Igual que registrar_campaña para un lote, en un solo bulk_write.
+    """
+    if not campañas:
+        return
+    operaciones = [
+        UpdateOne({"_id": c["id"]}, _documento_presupuesto(c["presupuesto"], c["fecha_inicio"], c["fecha_fin"]), upsert=True)
+        for c in campañas
+    ]
+    await get_db_async()[COLECCION_PRESUPUESTOS].bulk_write(operaciones, ordered=False)
+    for c in campañas:
+        CONTADORES_PRESUPUESTO.presupuesto_actualizado(c["id"])
+
+# ---------------------------------------------------
+class ContadoresPresupuesto:
+    """
+    Gasto por campaña en memoria con chequeo O(1) de presupuesto agotado.
+
+    Cada worker reserva en Mongo un cupo (una fracción del presupuesto) con
+    un $inc condicionado a no pasar el presupuesto, y gasta localmente contra
+    ese cupo. El gasto real se acumula en memoria y se escribe cada
+    `intervalo` segundos con un bulk_write de $inc.
+
+    Cotas:
+      - reservado <= presupuesto siempre, y un worker deja de servir cuando
+        agota su cupo. Pero el cargo llega por ColaEventos, no al servir:
+        mientras un evento espera en la cola el worker sigue sirviendo contra
+        un cupo que ya no tiene. El gasto total supera el presupuesto a lo
+        sumo en, por worker, latencia de la cola (hasta EVENTOS_INTERVALO_S
+        más lo encolado delante) × impresiones servidas por segundo × costo
+        por impresión;
+      - el gasto en Mongo va atrasado a lo sumo `intervalo` segundos (más lo
+        que tarde una escritura fallida en reintentarse);
+      - queda sin gastar a lo sumo un cupo por worker, que se devuelve al detener.
+    """
+
+    def __init__(self, intervalo: float, fraccion_cupo: float):
+        self.intervalo = intervalo
+        self.fraccion_cupo = fraccion_cupo
+        self._disponible: Dict[int, float] = {}
+        self._cupo: Dict[int, float] = {}
+        self._pendiente: Dict[int, float] = {}
+        # campaña -> instante (monotónico) en que se vuelve a intentar reservar
+        self._sin_presupuesto: Dict[int, float] = {}
+        # Campañas con documento de presupuesto: las únicas que el GET hace reservar
+        self._conocidas: Set[int] = set()
+        self._reservando: Set[int] = set()
+        self._tareas: Set[asyncio.Task] = set()
+        self._tarea: Optional[asyncio.Task] = None
+        self.escrituras = 0
+        self.reservas = 0
+        self.excedido = 0.0
+
+    # -----------------------------------------------
+    # Camino de servicio: todo O(1) y sin esperar a Mongo
+    def agotado(self, campaña_id: int) -> bool:
+        """
+        True si este worker no debe servir la campaña: sin cupo local y, si
+        aún se puede reservar, mientras llega la reserva.
+        """
+        if self._disponible.get(campaña_id, 0.0) > 0:
+            return False
+        if not self.sin_presupuesto(campaña_id):
+            self._recargar(campaña_id)
+        return True
+
+    def sin_presupuesto(self, campaña_id: int) -> bool:
+        """
+        True cuando hace menos de RITMO_SIN_PRESUPUESTO_TTL_S no quedaba nada
+        por reservar en Mongo para la campaña.
+        """
+        reintento = self._sin_presupuesto.get(campaña_id)
+        if reintento is None:
+            return False
+        if reintento <= time.monotonic():
+            del self._sin_presupuesto[campaña_id]
+            return False
+        return True
+
+    def presupuesto_actualizado(self, campaña_id: int):
+        # Con un presupuesto nuevo se puede volver a reservar sin esperar el plazo
+        self._sin_presupuesto.pop(campaña_id, None)
+
+    def gastar(self, campaña_id: int, monto: float):
+        disponible = self._disponible.get(campaña_id, 0.0) - monto
+        if disponible < 0:
+            # Lo que pasa de cero: lo servido mientras el cargo esperaba en la cola
+            self.excedido += min(monto, -disponible)
+        self._disponible[campaña_id] = disponible
+        self._pendiente[campaña_id] = self._pendiente.get(campaña_id, 0.0) + monto
+        if disponible < self._cupo.get(campaña_id, 0.0) * RITMO_UMBRAL_RECARGA:
+            self._recargar(campaña_id)
+
+    def registrar_eventos(self, eventos: List[dict]):
+        for evento in eventos:
+            costo = evento.get("costo")
+            if costo and evento.get("campaña_id") is not None:
+                self.gastar(evento["campaña_id"], costo)
+
+    def pendiente(self, campaña_id: int) -> float:
+        return self._pendiente.get(campaña_id, 0.0)
+
+    def local(self, campaña_id: int) -> dict:
+        return {
+            "disponible_local": max(0.0, self._disponible.get(campaña_id, 0.0)),
+            "pendiente_local": self.pendiente(campaña_id),
+            "agotado": self.agotado(campaña_id),
+        }
+
+    def conocida(self, campaña_id: int) -> bool:
+        return campaña_id in self._conocidas
+
+    async def descubrir(self, campaña_id: int) -> bool:
+        """
+        True si la campaña tiene documento de presupuesto. Solo se consulta
+        Mongo la primera vez; las inexistentes no se recuerdan.
+        """
+        if campaña_id in self._conocidas:
+            return True
+        if await get_db_async()[COLECCION_PRESUPUESTOS].count_documents({"_id": campaña_id}, limit=1):
+            self._conocidas.add(campaña_id)
+            return True
+        return False
+
+    # -----------------------------------------------
+    # Reservas de cupo
+    def _recargar(self, campaña_id: int):
+        if campaña_id in self._reservando or self.sin_presupuesto(campaña_id):
+            return
+        self._reservando.add(campaña_id)
+        tarea = asyncio.get_running_loop().create_task(self._reservar(campaña_id))
+        self._tareas.add(tarea)
+        tarea.add_done_callback(self._tareas.discard)
+
+    async def _reservar(self, campaña_id: int):
+        coleccion = get_db_async()[COLECCION_PRESUPUESTOS]
+        try:
+            documento = await coleccion.find_one({"_id": campaña_id}, {"presupuesto": 1, "reservado": 1})
+            # Se reserva el cupo completo o, si no alcanza, lo que quede
+            while documento is not None:
+                restante = documento["presupuesto"] - documento["reservado"]
+                cupo = min(documento["presupuesto"] * self.fraccion_cupo, restante)
+                if cupo <= 0:
+                    break
+                reservado = await coleccion.find_one_and_update(
+                    {"_id": campaña_id, "$expr": {"$lte": [{"$add": ["$reservado", cupo]}, "$presupuesto"]}},
+                    {"$inc": {"reservado": cupo}},
+                    projection={"presupuesto": 1, "reservado": 1},
+                    return_document=ReturnDocument.AFTER,
+                )
+                if reservado is not None:
+                    self.reservas += 1
+                    self._conocidas.add(campaña_id)
+                    self._cupo[campaña_id] = cupo
+                    self._disponible[campaña_id] = self._disponible.get(campaña_id, 0.0) + cupo
+                    return
+                # Otro worker reservó entre medio: se relee y se prueba con lo que quede
+                documento = await coleccion.find_one({"_id": campaña_id}, {"presupuesto": 1, "reservado": 1})
+            self._sin_presupuesto[campaña_id] = time.monotonic() + RITMO_SIN_PRESUPUESTO_TTL_S
+        except PyMongoError:
+            logging.exception(f"No se pudo reservar cupo para la campaña {campaña_id}")
+        finally:
+            self._reservando.discard(campaña_id)
+
+    # -----------------------------------------------
+    # Escritura por lotes
+    async def escribir(self):
+        if not self._pendiente:
+            return
+        pendiente, self._pendiente = self._pendiente, {}
+        operaciones = [UpdateOne({"_id": campaña_id}, {"$inc": {"gastado": monto}}) for campaña_id, monto in pendiente.items()]
+        try:
+            await get_db_async()[COLECCION_PRESUPUESTOS].bulk_write(operaciones, ordered=False)
+            self.escrituras += 1
+        except PyMongoError:
+            logging.exception(f"No se pudo escribir el gasto de {len(operaciones)} campañas")
+            # Se suma a lo que llegó mientras tanto y se reintenta en el próximo ciclo
+            for campaña_id, monto in pendiente.items():
+                self._pendiente[campaña_id] = self._pendiente.get(campaña_id, 0.0) + monto
+
+    async def _ciclo(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            await self.escribir()
+            ahora = time.monotonic()
+            for campaña_id in [c for c, reintento in self._sin_presupuesto.items() if reintento <= ahora]:
+                del self._sin_presupuesto[campaña_id]
+
+    def iniciar(self):
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._ciclo())
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        await self.escribir()
+        # Devuelve los cupos sin usar para que otros workers puedan reservarlos
+        devoluciones = [
+            UpdateOne({"_id": campaña_id}, {"$inc": {"reservado": -disponible}})
+            for campaña_id, disponible in self._disponible.items() if disponible > 0
+        ]
+        if devoluciones:
+            try:
+                await get_db_async()[COLECCION_PRESUPUESTOS].bulk_write(devoluciones, ordered=False)
+            except PyMongoError:
+                logging.exception("No se pudieron devolver los cupos sin usar")
+        self._disponible.clear()
+        self._cupo.clear()
+
+# ---------------------------------------------------
+def ritmo(documento: dict, pendiente_local: float, ahora: datetime) -> dict:
+    """
+    Estado de ritmo: gasto por hora hasta ahora contra el que permitiría
+    terminar el presupuesto justo en fecha_fin.
+    """
+    presupuesto = documento["presupuesto"]
+    gastado = documento["gastado"] + pendiente_local
+    restante = max(0.0, presupuesto - gastado)
+    horas_transcurridas = max(0.0, (ahora - documento["fecha_inicio"]).total_seconds() / 3600)
+    horas_restantes = max(0.0, (documento["fecha_fin"] - ahora).total_seconds() / 3600)
+    gasto_por_hora = gastado / horas_transcurridas if horas_transcurridas else 0.0
+    ritmo_ideal = restante / horas_restantes if horas_restantes else 0.0
+    if restante <= 0:
+        estado = "agotado"
+    elif not horas_restantes:
+        estado = "finalizada"
+    elif gasto_por_hora > ritmo_ideal * 1.1:
+        estado = "adelantado"
+    elif gasto_por_hora < ritmo_ideal * 0.9:
+        estado = "atrasado"
+    else:
+        estado = "en_ritmo"
+    return {
+        "presupuesto": presupuesto,
+        "gastado": gastado,
+        "restante": restante,
+        "reservado": documento["reservado"],
+        "gasto_por_hora": gasto_por_hora,
+        "gasto_ideal_por_hora": ritmo_ideal,
+        "horas_restantes": horas_restantes,
+        "horas_hasta_agotar": restante / gasto_por_hora if gasto_por_hora else None,
+        "estado": estado,
+    }
+
+CONTADORES_PRESUPUESTO = ContadoresPresupuesto(RITMO_INTERVALO_S, RITMO_FRACCION_CUPO)
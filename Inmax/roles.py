@@ -1,22 +1,28 @@
-from fastapi import FastAPI, HTTPException, Path, status, Header, Depends
+from fastapi import FastAPI, HTTPException, Path, status, Depends
 from pydantic import BaseModel, Field
 from typing import List, Dict, Optional
+import logging
+
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from db import get_db_async
+from asignador_ids import AsignadorIds
+from autorizacion import (
+    COLECCION_ROLES, PERMISOS_DISPONIBLES, REGISTRO_ROLES, PermisoDesconocido,
+    compilar_permisos, normalizar_nombre, require, roles_de,
+)
+
+# Crear, cambiar o borrar roles es de administración: exige "eliminar", que
+# el Editor no tiene (con "actualizar" podría darse todos los permisos)
+PERMISO_ADMIN_ROLES = "eliminar"
+ASIGNADOR_ROLES = AsignadorIds("roles", 1)
 
 app = FastAPI(
     title="API de Roles",
-    description="Endpoints para gestionar roles y permisos del sistema con autenticación básica.",
+    description="Endpoints para gestionar roles y permisos del sistema, autorizados con el token de Keycloak.",
     version="1.1.0"
 )
 
-# ---------------------------------------------------
-def fake_jwt_auth(authorization: Optional[str] = Header(None)):
-    """
-    Simulación de validación de JWT. En producción, usa tu proveedor real de autenticación (p. ej. Keycloak).
-    """
-    if authorization != "Bearer fake-jwt-token":
-        raise HTTPException(status_code=401, detail="No autorizado. Token inválido o ausente.")
-    return True
-
 # ---------------------------------------------------
 class Rol(BaseModel):
     id: int
@@ -49,79 +55,96 @@ class RolEliminadoResponse(BaseModel):
     message: str
 
 # ---------------------------------------------------
-ROLES = [
-    {"id": 1, "nombre": "Admin", "descripcion": "Administrador del sistema", "permisos": ["crear", "leer", "actualizar", "eliminar"]},
-    {"id": 2, "nombre": "Editor", "descripcion": "Editor de contenido", "permisos": ["leer", "actualizar"]},
-    {"id": 3, "nombre": "Usuario", "descripcion": "Usuario básico", "permisos": ["leer"]}
-]
-
-PERMISOS_DISPONIBLES = ["crear", "leer", "actualizar", "eliminar", "exportar"]
+def _verificar_permisos(permisos: List[str], claims: dict):
+    try:
+        mascara = compilar_permisos(permisos)
+    except PermisoDesconocido as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if mascara & ~REGISTRO_ROLES.mascara(roles_de(claims)):
+        raise HTTPException(status_code=403, detail="No puede otorgar permisos que usted no tiene.")
+
+def _documento_rol(data) -> dict:
+    return {
+        "nombre": data.nombre.strip(),
+        "descripcion": data.descripcion.strip(),
+        "permisos": list(data.permisos),
+        "clave": normalizar_nombre(data.nombre),
+    }
 
 # ---------------------------------------------------
 # 23) GET /roles
 @app.get("/roles", response_model=List[Rol], summary="Lista todos los roles disponibles")
-async def listar_roles(autorizacion: bool = Depends(fake_jwt_auth)):
-    return ROLES
+async def listar_roles(claims: dict = Depends(require("leer"))):
+    return REGISTRO_ROLES.listar()
+
+# 28) GET /roles/permisos
+# Declarado antes de /roles/{id} para que "permisos" no se interprete como id
+@app.get("/roles/permisos", response_model=PermisosResponse, summary="Lista de permisos disponibles")
+async def listar_permisos(claims: dict = Depends(require("leer"))):
+    return {"permisos": PERMISOS_DISPONIBLES}
 
 # 24) POST /roles
 @app.post("/roles", response_model=RolCreadoResponse, status_code=201, summary="Crea un nuevo rol")
-async def crear_rol(data: CrearRolRequest, autorizacion: bool = Depends(fake_jwt_auth)):
-    nombre_normalizado = data.nombre.strip().lower()
-    for rol in ROLES:
-        if rol["nombre"].strip().lower() == nombre_normalizado:
-            raise HTTPException(status_code=409, detail="El nombre del rol ya existe.")
-    nuevo_id = max([rol["id"] for rol in ROLES], default=0) + 1
-    nuevo_rol = {
-        "id": nuevo_id,
-        "nombre": data.nombre.strip(),
-        "descripcion": data.descripcion.strip(),
-        "permisos": data.permisos
-    }
-    ROLES.append(nuevo_rol)
-    return {"id": nuevo_id, "message": "Rol creado correctamente."}
+async def crear_rol(data: CrearRolRequest, claims: dict = Depends(require(PERMISO_ADMIN_ROLES))):
+    _verificar_permisos(data.permisos, claims)
+    if REGISTRO_ROLES.id_por_nombre(data.nombre) is not None:
+        raise HTTPException(status_code=409, detail="El nombre del rol ya existe.")
+    try:
+        piso = max((rol["id"] for rol in REGISTRO_ROLES.listar()), default=0)
+        id = await ASIGNADOR_ROLES.siguiente(piso)
+        # El índice único sobre "clave" cubre dos workers creando el mismo nombre
+        await get_db_async()[COLECCION_ROLES].insert_one({"_id": id, **_documento_rol(data)})
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="El nombre del rol ya existe.")
+    except PyMongoError:
+        logging.exception("No se pudo guardar el rol")
+        raise HTTPException(status_code=503, detail="No se pudo guardar el rol.")
+    nuevo_rol = REGISTRO_ROLES.crear(data.nombre, data.descripcion, data.permisos, id=id)
+    return {"id": nuevo_rol["id"], "message": "Rol creado correctamente."}
 
 # 25) GET /roles/{id}
 @app.get("/roles/{id}", response_model=Rol, summary="Retorna un rol específico por su ID")
-async def obtener_rol(id: int = Path(..., description="ID del rol"), autorizacion: bool = Depends(fake_jwt_auth)):
-    for rol in ROLES:
-        if rol["id"] == id:
-            return rol
-    raise HTTPException(status_code=404, detail="Rol no encontrado.")
+async def obtener_rol(id: int = Path(..., description="ID del rol"), claims: dict = Depends(require("leer"))):
+    rol = REGISTRO_ROLES.obtener(id)
+    if rol is None:
+        raise HTTPException(status_code=404, detail="Rol no encontrado.")
+    return rol
 
 # 26) PUT /roles/{id}
 @app.put("/roles/{id}", response_model=MensajeResponse, summary="Actualiza un rol existente")
 async def actualizar_rol(
     id: int = Path(..., description="ID del rol a actualizar"),
     data: ActualizarRolRequest = ...,
-    autorizacion: bool = Depends(fake_jwt_auth)
+    claims: dict = Depends(require(PERMISO_ADMIN_ROLES))
 ):
-    nombre_normalizado = data.nombre.strip().lower()
-    for rol in ROLES:
-        if rol["id"] != id and rol["nombre"].strip().lower() == nombre_normalizado:
-            raise HTTPException(status_code=409, detail="El nombre ya está en uso.")
-    for rol in ROLES:
-        if rol["id"] == id:
-            rol.update({
-                "nombre": data.nombre.strip(),
-                "descripcion": data.descripcion.strip(),
-                "permisos": data.permisos
-            })
-            return {"message": "Rol actualizado correctamente."}
-    raise HTTPException(status_code=404, detail="Rol no encontrado.")
+    _verificar_permisos(data.permisos, claims)
+    if REGISTRO_ROLES.obtener(id) is None:
+        raise HTTPException(status_code=404, detail="Rol no encontrado.")
+    id_existente = REGISTRO_ROLES.id_por_nombre(data.nombre)
+    if id_existente is not None and id_existente != id:
+        raise HTTPException(status_code=409, detail="El nombre ya está en uso.")
+    try:
+        await get_db_async()[COLECCION_ROLES].update_one({"_id": id}, {"$set": _documento_rol(data)})
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="El nombre ya está en uso.")
+    except PyMongoError:
+        logging.exception(f"No se pudo actualizar el rol {id}")
+        raise HTTPException(status_code=503, detail="No se pudo actualizar el rol.")
+    REGISTRO_ROLES.actualizar(id, data.nombre, data.descripcion, data.permisos)
+    return {"message": "Rol actualizado correctamente."}
 
 # 27) DELETE /roles/{id}
 @app.delete("/roles/{id}", response_model=RolEliminadoResponse, summary="Elimina un rol por ID")
-async def eliminar_rol(id: int = Path(..., description="ID del rol a eliminar"), autorizacion: bool = Depends(fake_jwt_auth)):
-    for rol in ROLES:
-        if rol["id"] == id:
-            ROLES.remove(rol)
-            return {"id": id, "message": "Rol eliminado correctamente."}
-    raise HTTPException(status_code=404, detail="Rol no encontrado.")
-
-# 28) GET /roles/permisos
-@app.get("/roles/permisos", response_model=PermisosResponse, summary="Lista de permisos disponibles")
-async def listar_permisos(autorizacion: bool = Depends(fake_jwt_auth)):
-    return {"permisos": PERMISOS_DISPONIBLES}
+async def eliminar_rol(id: int = Path(..., description="ID del rol a eliminar"), claims: dict = Depends(require(PERMISO_ADMIN_ROLES))):
+    if REGISTRO_ROLES.obtener(id) is None:
+        raise HTTPException(status_code=404, detail="Rol no encontrado.")
+    try:
+        await get_db_async()[COLECCION_ROLES].delete_one({"_id": id})
+    except PyMongoError:
+        logging.exception(f"No se pudo eliminar el rol {id}")
+        raise HTTPException(status_code=503, detail="No se pudo eliminar el rol.")
+    REGISTRO_ROLES.eliminar(id)
+    return {"id": id, "message": "Rol eliminado correctamente."}
 
 # ---------------------------------------------------
 # Endpoint raíz de prueba
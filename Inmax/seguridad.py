@@ -0,0 +1,130 @@
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from typing import Dict, Optional
+import asyncio
+import httpx
+import logging
+import os
+import time
+
+KEYCLOAK_REALM_URL = "http://localhost:8080/auth/realms/mi-realm"
+KEYCLOAK_JWKS_URL = f"{KEYCLOAK_REALM_URL}/protocol/openid-connect/certs"
+KEYCLOAK_AUDIENCE = os.getenv("KEYCLOAK_AUDIENCE")  # None: no se valida "aud"
+
+# Cliente HTTP hacia Keycloak
+HTTP_TIMEOUT = httpx.Timeout(5.0, connect=2.0)
+HTTP_LIMITES = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0)
+JWKS_REFRESCO_S = 300
+JWKS_REFRESCO_MINIMO_S = 10
+
+# ---------------------------------------------------
+class CacheJWKS:
+    """
+    Claves públicas del IdP en memoria. Se refrescan en segundo plano y, si
+    llega un token con un `kid` desconocido, se refrescan a demanda (con un
+    intervalo mínimo para que tokens falsos no golpeen al IdP).
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self._claves: Dict[str, dict] = {}
+        self._ultimo_refresco = 0.0
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._claves)
+
+    async def _descargar(self, cliente: httpx.AsyncClient):
+        respuesta = await cliente.get(self.url)
+        respuesta.raise_for_status()
+        self._claves = {clave["kid"]: clave for clave in respuesta.json().get("keys", [])}
+        self._ultimo_refresco = time.monotonic()
+
+    async def refrescar(self, cliente: httpx.AsyncClient):
+        async with self._lock:
+            await self._descargar(cliente)
+
+    async def refrescar_periodicamente(self, cliente: httpx.AsyncClient):
+        while True:
+            try:
+                await self.refrescar(cliente)
+            except httpx.HTTPError as e:
+                logging.error(f"No se pudo refrescar JWKS: {e}")
+            except Exception:
+                # Una respuesta inesperada (JSON inválido, clave sin kid) no debe detener el refresco
+                logging.exception("Error inesperado al refrescar JWKS")
+            await asyncio.sleep(JWKS_REFRESCO_S)
+
+    async def clave(self, kid: str, cliente: httpx.AsyncClient) -> Optional[dict]:
+        clave = self._claves.get(kid)
+        if clave is not None:
+            return clave
+        # Las peticiones concurrentes con el mismo kid esperan un solo refresco
+        async with self._lock:
+            if kid not in self._claves and time.monotonic() - self._ultimo_refresco > JWKS_REFRESCO_MINIMO_S:
+                try:
+                    await self._descargar(cliente)
+                except httpx.HTTPError as e:
+                    logging.error(f"No se pudo refrescar JWKS: {e}")
+                except Exception:
+                    logging.exception("Error inesperado al refrescar JWKS")
+            return self._claves.get(kid)
+
+jwks = CacheJWKS(KEYCLOAK_JWKS_URL)
+
+# ---------------------------------------------------
+# Cliente HTTP compartido y refresco de JWKS. El refresco arranca con la primera
+# validación de token en el loop; solo login lo arranca y lo cierra en su lifespan
+_http_cliente: Optional[httpx.AsyncClient] = None
+_refresco: Optional[asyncio.Task] = None
+
+def cliente_http() -> httpx.AsyncClient:
+    global _http_cliente
+    if _http_cliente is None:
+        _http_cliente = httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITES)
+    return _http_cliente
+
+def iniciar():
+    global _refresco
+    loop = asyncio.get_running_loop()
+    if _refresco is None or _refresco.done() or _refresco.get_loop() is not loop:
+        _refresco = loop.create_task(jwks.refrescar_periodicamente(cliente_http()))
+
+async def cerrar():
+    global _http_cliente, _refresco
+    if _refresco is not None:
+        _refresco.cancel()
+        _refresco = None
+    if _http_cliente is not None:
+        await _http_cliente.aclose()
+        _http_cliente = None
+
+# ---------------------------------------------------
+# Validación local de JWT: firma con las claves en caché, sin llamar al IdP
+bearer = HTTPBearer(auto_error=False)
+
+async def usuario_actual(credenciales: Optional[HTTPAuthorizationCredentials] = Depends(bearer)) -> dict:
+    # jose se importa en la primera validación, no al arrancar el worker
+    from jose import jwt, JWTError
+
+    # Las apps sin lifespan propio (roles, campañas, ...) también rotan claves
+    iniciar()
+
+    if credenciales is None:
+        raise HTTPException(status_code=401, detail="No autorizado. Token inválido o ausente.")
+    token = credenciales.credentials
+    try:
+        encabezado = jwt.get_unverified_header(token)
+        clave = await jwks.clave(encabezado.get("kid"), cliente_http())
+        if clave is None:
+            raise HTTPException(status_code=401, detail="Token firmado con una clave desconocida")
+        return jwt.decode(
+            token,
+            clave,
+            algorithms=[clave.get("alg", "RS256")],
+            audience=KEYCLOAK_AUDIENCE,
+            issuer=KEYCLOAK_REALM_URL,
+            options={"verify_aud": KEYCLOAK_AUDIENCE is not None}
+        )
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Token inválido o expirado")
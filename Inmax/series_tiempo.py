@@ -0,0 +1,120 @@
+from calendar import timegm
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+import os
+import re
+
+import numpy as np
+
+# ---------------------------------------------------
+# Cada serie de una campaña es un archivo append-only de registros (instante
+# int64 en segundos UTC, monto float64). Se lee con memmap, sin copiar.
+SERIES_RUTA = os.getenv("SERIES_RUTA", "series")
+SERIES = ("gastos", "inversion")
+SEGUNDOS_DIA = 86400
+
+# Tamaño del bucket en segundos; None deja los registros tal cual
+RESOLUCIONES = {"cruda": None, "hora": 3600, "dia": SEGUNDOS_DIA, "semana": 7 * SEGUNDOS_DIA}
+# El 1970-01-01 fue jueves: corriendo 3 días las semanas empiezan el lunes
+DESFASE = {"semana": 3 * SEGUNDOS_DIA}
+# Unidad con que se escribe la fecha de cada bucket
+UNIDAD_FECHA = {"cruda": "s", "hora": "s", "dia": "D", "semana": "D"}
+
+REGISTRO = np.dtype([("t", "<i8"), ("v", "<f8")])
+
+NOMBRE_SERIE = re.compile(r"^[a-z_]+$")
+
+class SerieVacia(Exception):
+    pass
+
+def _ruta(serie: str, campaña_id: int) -> str:
+    if not NOMBRE_SERIE.match(serie):
+        raise ValueError(f"Serie inválida: {serie}")
+    return os.path.join(SERIES_RUTA, serie, f"{campaña_id}.rec")
+
+def _segundos(fecha: date) -> int:
+    return timegm(fecha.timetuple())
+
+# ---------------------------------------------------
+def agregar(serie: str, campaña_id: int, instantes: np.ndarray, montos: np.ndarray):
+    """
+    Agrega registros al final de la serie con un solo write en O_APPEND: dos
+    escritores a la vez no intercalan instantes de uno con montos del otro.
+    """
+    registros = np.empty(len(instantes), dtype=REGISTRO)
+    registros["t"] = instantes
+    registros["v"] = montos
+    datos = registros.tobytes()
+    ruta = _ruta(serie, campaña_id)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    archivo = os.open(ruta, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        escritos = os.write(archivo, datos)
+    finally:
+        os.close(archivo)
+    if escritos != len(datos):
+        raise OSError(f"Escritura parcial en {ruta}: {escritos} de {len(datos)} bytes")
+
+def leer(serie: str, campaña_id: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (instantes, montos) mapeados desde disco; SerieVacia si no hay registros.
+    Un registro a medio escribir al final del archivo no se cuenta.
+    """
+    ruta = _ruta(serie, campaña_id)
+    try:
+        cantidad = os.path.getsize(ruta) // REGISTRO.itemsize
+    except FileNotFoundError:
+        raise SerieVacia(serie)
+    if not cantidad:
+        raise SerieVacia(serie)
+    registros = np.memmap(ruta, dtype=REGISTRO, mode="r", shape=(cantidad,))
+    return registros["t"], registros["v"]
+
+# ---------------------------------------------------
+def remuestrear(instantes: np.ndarray, montos: np.ndarray, resolucion: str,
+                fecha_inicio: Optional[date] = None, fecha_fin: Optional[date] = None) -> Dict[str, np.ndarray]:
+    """
+    Recorta al rango de fechas y agrupa por bucket de la resolución con suma,
+    mínimo, máximo y cantidad de registros, todo con operaciones de NumPy.
+    """
+    # Los registros llegan casi siempre en orden; si no, se ordenan una vez
+    if len(instantes) > 1 and not (instantes[1:] >= instantes[:-1]).all():
+        orden = np.argsort(instantes, kind="stable")
+        instantes, montos = instantes[orden], montos[orden]
+    desde = 0 if fecha_inicio is None else np.searchsorted(instantes, _segundos(fecha_inicio), "left")
+    # fecha_fin es inclusiva
+    hasta = len(instantes) if fecha_fin is None else np.searchsorted(instantes, _segundos(fecha_fin) + SEGUNDOS_DIA, "left")
+    instantes = np.asarray(instantes[desde:hasta])
+    montos = np.asarray(montos[desde:hasta])
+
+    tamaño = RESOLUCIONES[resolucion]
+    if tamaño is None or not len(instantes):
+        return {"inicio": instantes, "monto": montos, "minimo": montos, "maximo": montos,
+                "registros": np.ones(len(montos), dtype=np.int64)}
+    desfase = DESFASE.get(resolucion, 0)
+    buckets = (instantes + desfase) // tamaño
+    cortes = np.flatnonzero(buckets[1:] != buckets[:-1]) + 1
+    comienzos = np.concatenate(([0], cortes))
+    return {
+        "inicio": buckets[comienzos] * tamaño - desfase,
+        "monto": np.add.reduceat(montos, comienzos),
+        "minimo": np.minimum.reduceat(montos, comienzos),
+        "maximo": np.maximum.reduceat(montos, comienzos),
+        "registros": np.diff(np.concatenate((comienzos, [len(montos)]))),
+    }
+
+def filas(columnas: Dict[str, np.ndarray], resolucion: str) -> List[dict]:
+    """
+    Filas {fecha, monto, minimo, maximo, registros} listas para serializar.
+    """
+    fechas = np.datetime_as_string(columnas["inicio"].astype("datetime64[s]"), unit=UNIDAD_FECHA[resolucion]).tolist()
+    return [
+        {"fecha": fecha, "monto": monto, "minimo": minimo, "maximo": maximo, "registros": registros}
+        for fecha, monto, minimo, maximo, registros in zip(
+            fechas,
+            columnas["monto"].tolist(),
+            columnas["minimo"].tolist(),
+            columnas["maximo"].tolist(),
+            columnas["registros"].tolist(),
+        )
+    ]
@@ -1,7 +1,16 @@
-from fastapi import FastAPI, HTTPException, Path
+from fastapi import FastAPI, HTTPException, Path, Query, Body, Depends, status
 from pydantic import BaseModel, Field
-from typing import List, Dict
-from datetime import date
+from typing import List, Dict, Optional, Union
+from calendar import timegm
+from datetime import date, datetime
+import asyncio
+
+import numpy as np
+
+from autorizacion import require
+from cache_respuestas import cache_respuesta, incrementar_generacion
+from respuestas_rapidas import responder_filas
+import series_tiempo
 
 app = FastAPI(
     title="API de Reportes de Inversión y Gastos",
@@ -17,9 +26,20 @@ class InversionPorLocalidad(BaseModel):
     localidad: str
 
 class GastoPorFecha(BaseModel):
-    fecha: date
+    fecha: Union[datetime, date] = Field(..., description="Inicio del bucket (fecha para día y semana)")
+    monto: float = Field(..., description="Suma de los montos del bucket")
+    minimo: float
+    maximo: float
+    registros: int
+
+class RegistroSerie(BaseModel):
+    campaña_id: int
+    fecha: datetime
     monto: float
 
+class RegistrosAceptadosResponse(BaseModel):
+    aceptados: int
+
 # ---------------------------------------------------
 # 🔄 Datos de ejemplo
 INVERSION_LOCALIDAD = {
@@ -46,24 +66,97 @@ EVOLUCION_GASTOS = {
 
 # ---------------------------------------------------
 # 41) GET /reportes/inversion/localidad
-@app.get("/reportes/inversion/localidad", response_model=List[InversionPorLocalidad], summary="Inversión por tipo de producto y localidad")
+@app.get("/reportes/inversion/localidad", response_model=List[InversionPorLocalidad], summary="Inversión por tipo de producto y localidad", dependencies=[Depends(require("leer"))])
+@cache_respuesta(ttl=300, fuentes=["inversion"], revalidar=600)
 async def inversion_por_localidad(
-    id_campaña: int = Path(..., description="ID de la campaña")
+    id_campaña: int = Query(..., description="ID de la campaña")
 ):
     datos = INVERSION_LOCALIDAD.get(id_campaña)
     if not datos:
         raise HTTPException(status_code=404, detail="No hay datos de inversión para esta campaña.")
     return datos
 
+def _columnas(serie: str, id_campaña: int):
+    """
+    Serie guardada en disco; mientras la campaña no tenga, los datos de ejemplo.
+    """
+    try:
+        return series_tiempo.leer(serie, id_campaña)
+    except series_tiempo.SerieVacia:
+        muestra = EVOLUCION_GASTOS.get(id_campaña) if serie == "gastos" else None
+        if not muestra:
+            return None
+        instantes = np.array([timegm(d["fecha"].timetuple()) for d in muestra], dtype=np.int64)
+        return instantes, np.array([d["monto"] for d in muestra], dtype=np.float64)
+
+def _evolucion(serie: str, id_campaña: int, resolucion: str, fecha_inicio: Optional[date], fecha_fin: Optional[date]) -> Optional[List[dict]]:
+    columnas = _columnas(serie, id_campaña)
+    if columnas is None:
+        return None
+    return series_tiempo.filas(series_tiempo.remuestrear(*columnas, resolucion, fecha_inicio, fecha_fin), resolucion)
+
+def _resolucion(resolucion: str) -> str:
+    if resolucion not in series_tiempo.RESOLUCIONES:
+        raise HTTPException(status_code=400, detail=f"Resolución inválida, use una de: {', '.join(series_tiempo.RESOLUCIONES)}.")
+    return resolucion
+
 # 42) GET /reportes/evolucion-gastos
-@app.get("/reportes/evolucion-gastos", response_model=List[GastoPorFecha], summary="Evolución de gastos de una campaña")
+@app.get("/reportes/evolucion-gastos", response_model=List[GastoPorFecha], summary="Evolución de gastos de una campaña", dependencies=[Depends(require("leer"))])
+@cache_respuesta(ttl=300, fuentes=["inversion"], revalidar=600)
 async def evolucion_gastos(
-    id_campaña: int = Path(..., description="ID de la campaña")
+    id_campaña: int = Query(..., description="ID de la campaña"),
+    resolucion: str = Query("dia", description="Agrupación: cruda, hora, dia o semana"),
+    fecha_inicio: Optional[date] = Query(None),
+    fecha_fin: Optional[date] = Query(None)
 ):
-    datos = EVOLUCION_GASTOS.get(id_campaña)
-    if not datos:
+    """
+    Gasto de la campaña agrupado por bucket, con suma, mínimo, máximo y cantidad de registros.
+    """
+    datos = await asyncio.to_thread(_evolucion, "gastos", id_campaña, _resolucion(resolucion), fecha_inicio, fecha_fin)
+    if datos is None:
         raise HTTPException(status_code=404, detail="No hay datos de gastos para esta campaña.")
-    return datos
+    return responder_filas(GastoPorFecha, datos, streaming=False)
+
+# GET /reportes/evolucion-inversion
+@app.get("/reportes/evolucion-inversion", response_model=List[GastoPorFecha], summary="Evolución de la inversión de una campaña", dependencies=[Depends(require("leer"))])
+@cache_respuesta(ttl=300, fuentes=["inversion"], revalidar=600)
+async def evolucion_inversion(
+    id_campaña: int = Query(..., description="ID de la campaña"),
+    resolucion: str = Query("dia", description="Agrupación: cruda, hora, dia o semana"),
+    fecha_inicio: Optional[date] = Query(None),
+    fecha_fin: Optional[date] = Query(None)
+):
+    datos = await asyncio.to_thread(_evolucion, "inversion", id_campaña, _resolucion(resolucion), fecha_inicio, fecha_fin)
+    if datos is None:
+        raise HTTPException(status_code=404, detail="No hay datos de inversión para esta campaña.")
+    return responder_filas(GastoPorFecha, datos, streaming=False)
+
+# POST /reportes/series/{serie}
+@app.post(
+    "/reportes/series/{serie}",
+    response_model=RegistrosAceptadosResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Agrega registros de gasto o inversión",
+    dependencies=[Depends(require("crear"))]
+)
+async def agregar_registros(
+    serie: str = Path(..., description="Serie: gastos o inversion"),
+    registros: List[RegistroSerie] = Body(...)
+):
+    if serie not in series_tiempo.SERIES:
+        raise HTTPException(status_code=404, detail=f"Serie desconocida, use una de: {', '.join(series_tiempo.SERIES)}.")
+    por_campaña: Dict[int, List[RegistroSerie]] = {}
+    for registro in registros:
+        por_campaña.setdefault(registro.campaña_id, []).append(registro)
+
+    def escribir():
+        for campaña_id, lista in por_campaña.items():
+            instantes = np.array([timegm(r.fecha.utctimetuple()) for r in lista], dtype=np.int64)
+            series_tiempo.agregar(serie, campaña_id, instantes, np.array([r.monto for r in lista], dtype=np.float64))
+
+    await asyncio.to_thread(escribir)
+    incrementar_generacion("inversion")
+    return {"aceptados": len(registros)}
 
 # ---------------------------------------------------
 # Endpoint raíz de prueba
@@ -0,0 +1,192 @@
+from calendar import timegm
+from datetime import date
+from typing import Dict, List, Tuple
+import asyncio
+import itertools
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+
+# ---------------------------------------------------
+# Coordenadas de actividad por día (append-only) y caché de teselas por día
+TESELAS_RUTA = os.getenv("TESELAS_RUTA", "teselas")
+ZOOM_MAXIMO = 18
+# Celdas por lado en cada tesela
+RESOLUCION = 64
+SEGUNDOS_DIA = 86400
+# Límite de Web Mercator
+LATITUD_MAXIMA = 85.05112878
+
+# Cada punto son dos float64: x e y de Web Mercator normalizados a [0, 1)
+BYTES_PUNTO = 16
+
+# Tope de la caché de teselas: al pasarlo se borran las menos recientes
+TESELAS_CACHE_MAX_BYTES = int(os.getenv("TESELAS_CACHE_MAX_BYTES", str(1024 ** 3)))
+# Cada cuántas escrituras de caché de este proceso se revisa el tamaño
+TESELAS_CACHE_REVISION = int(os.getenv("TESELAS_CACHE_REVISION", "1000"))
+
+def _ruta_dia(dia: int) -> str:
+    return os.path.join(TESELAS_RUTA, "puntos", f"{dia}.bin")
+
+def _ruta_cache(dia: int, z: int, x: int, y: int) -> str:
+    return os.path.join(TESELAS_RUTA, "cache", str(dia), str(z), str(x), f"{y}.npz")
+
+def dia_de(fecha: date) -> int:
+    return timegm(fecha.timetuple()) // SEGUNDOS_DIA
+
+def mercator(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """
+    Coordenadas (n, 2) de Web Mercator normalizadas, con (0, 0) en el noroeste.
+    """
+    phi = np.radians(np.clip(lat, -LATITUD_MAXIMA, LATITUD_MAXIMA))
+    x = (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(phi) + 1.0 / np.cos(phi)) / np.pi) / 2.0
+    # lon = 180 cae fuera de la última tesela
+    return np.column_stack((np.minimum(x, np.nextafter(1.0, 0.0)), y))
+
+# ---------------------------------------------------
+async def registrar_eventos(eventos: List[dict]):
+    """
+    Agrega al archivo de cada día las coordenadas de los eventos que las traen.
+    Los appends van en un hilo para no bloquear el loop con el disco.
+    """
+    por_dia: Dict[int, List[Tuple[float, float]]] = {}
+    for evento in eventos:
+        lat, lon = evento.get("lat"), evento.get("lon")
+        if lat is None or lon is None:
+            continue
+        dia = timegm(evento["fecha"].utctimetuple()) // SEGUNDOS_DIA
+        por_dia.setdefault(dia, []).append((lat, lon))
+    if por_dia:
+        await asyncio.to_thread(_agregar_puntos, por_dia)
+
+def _agregar_puntos(por_dia: Dict[int, List[Tuple[float, float]]]):
+    os.makedirs(os.path.join(TESELAS_RUTA, "puntos"), exist_ok=True)
+    for dia, coordenadas in por_dia.items():
+        lat, lon = np.array(coordenadas, dtype=np.float64).T
+        # Un solo write por día y lote: quien lee solo ve puntos completos
+        with open(_ruta_dia(dia), "ab") as archivo:
+            archivo.write(mercator(lat, lon).tobytes())
+
+def _leer_puntos(dia: int, desde: int, hasta: int) -> np.ndarray:
+    cuenta = hasta - desde
+    if cuenta <= 0:
+        return np.empty((0, 2))
+    return np.fromfile(_ruta_dia(dia), dtype=np.float64, count=cuenta * 2, offset=desde * BYTES_PUNTO).reshape(-1, 2)
+
+def _binear(puntos: np.ndarray, z: int, x: int, y: int) -> np.ndarray:
+    """
+    Cuenta los puntos que caen en la tesela (z, x, y) por celda de RESOLUCION x RESOLUCION.
+    """
+    escala = float(1 << z)
+    tx = puntos[:, 0] * escala - x
+    ty = puntos[:, 1] * escala - y
+    dentro = (tx >= 0) & (tx < 1) & (ty >= 0) & (ty < 1)
+    if not dentro.any():
+        return np.zeros(RESOLUCION * RESOLUCION, dtype=np.uint32)
+    columnas = (tx[dentro] * RESOLUCION).astype(np.intp)
+    filas = (ty[dentro] * RESOLUCION).astype(np.intp)
+    return np.bincount(filas * RESOLUCION + columnas, minlength=RESOLUCION * RESOLUCION).astype(np.uint32)
+
+_escrituras_cache = itertools.count(1)
+
+def _podar_cache():
+    """
+    Si la caché pasa de TESELAS_CACHE_MAX_BYTES, borra las teselas escritas
+    hace más tiempo hasta dejarla en el 80 %. Se recalculan si se vuelven a pedir.
+    """
+    archivos = []
+    total = 0
+    for directorio, _, nombres in os.walk(os.path.join(TESELAS_RUTA, "cache")):
+        for nombre in nombres:
+            ruta = os.path.join(directorio, nombre)
+            try:
+                estado = os.stat(ruta)
+            except FileNotFoundError:
+                continue
+            archivos.append((estado.st_mtime, estado.st_size, ruta))
+            total += estado.st_size
+    if total <= TESELAS_CACHE_MAX_BYTES:
+        return
+    inicio = time.perf_counter()
+    borrados = 0
+    archivos.sort()
+    for _, tamaño, ruta in archivos:
+        if total <= TESELAS_CACHE_MAX_BYTES * 0.8:
+            break
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            # Otro worker la podó primero
+            pass
+        total -= tamaño
+        borrados += 1
+    logging.info(f"Caché de teselas podada: {borrados} archivos en {time.perf_counter() - inicio:.1f} s")
+
+def _guardar_cache(ruta: str, celdas: np.ndarray, consumidos: int):
+    directorio = os.path.dirname(ruta)
+    os.makedirs(directorio, exist_ok=True)
+    descriptor, temporal = tempfile.mkstemp(dir=directorio, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as archivo:
+            np.savez_compressed(archivo, celdas=celdas, consumidos=np.int64(consumidos))
+        os.replace(temporal, ruta)
+    except BaseException:
+        os.unlink(temporal)
+        raise
+    if next(_escrituras_cache) % TESELAS_CACHE_REVISION == 0:
+        _podar_cache()
+
+def tesela_del_dia(dia: int, z: int, x: int, y: int, total: int) -> np.ndarray:
+    """
+    Conteos de la tesela para un día. La caché guarda cuántos puntos del día
+    ya se contaron; solo se binean los que llegaron después.
+    """
+    ruta = _ruta_cache(dia, z, x, y)
+    try:
+        with np.load(ruta) as guardado:
+            celdas, consumidos = guardado["celdas"], int(guardado["consumidos"])
+    except (FileNotFoundError, ValueError, OSError):
+        celdas, consumidos = np.zeros(RESOLUCION * RESOLUCION, dtype=np.uint32), 0
+    if consumidos < total:
+        celdas = celdas + _binear(_leer_puntos(dia, consumidos, total), z, x, y)
+        # Las teselas sin puntos (casi todas en zoom alto) no dejan archivo
+        if celdas.any():
+            _guardar_cache(ruta, celdas, total)
+    return celdas
+
+# ---------------------------------------------------
+def versiones(fecha_inicio: date, fecha_fin: date) -> List[Tuple[int, int]]:
+    """
+    (día, puntos registrados) de los días del rango con actividad: la versión
+    de cada bucket de fecha.
+    """
+    desde, hasta = dia_de(fecha_inicio), dia_de(fecha_fin)
+    resultado = []
+    try:
+        entradas = list(os.scandir(os.path.join(TESELAS_RUTA, "puntos")))
+    except FileNotFoundError:
+        return resultado
+    for entrada in entradas:
+        nombre, extension = os.path.splitext(entrada.name)
+        if extension != ".bin" or not nombre.lstrip("-").isdigit():
+            continue
+        dia = int(nombre)
+        if desde <= dia <= hasta:
+            total = entrada.stat().st_size // BYTES_PUNTO
+            if total:
+                resultado.append((dia, total))
+    resultado.sort()
+    return resultado
+
+def tesela(z: int, x: int, y: int, versiones_rango: List[Tuple[int, int]]) -> np.ndarray:
+    """
+    Conteos (RESOLUCION x RESOLUCION) de la tesela sumando los días del rango.
+    """
+    celdas = np.zeros(RESOLUCION * RESOLUCION, dtype=np.uint64)
+    for dia, total in versiones_rango:
+        celdas += tesela_del_dia(dia, z, x, y, total)
+    return celdas.reshape(RESOLUCION, RESOLUCION)
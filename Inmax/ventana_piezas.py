@@ -1,7 +1,18 @@
-from fastapi import FastAPI, HTTPException, Path, status
+from fastapi import FastAPI, HTTPException, Path, Query, Request, status
+from fastapi.responses import RedirectResponse
 from pydantic import BaseModel, Field
-from typing import List
+from typing import Dict, List, Optional
 from datetime import datetime
+import logging
+import mimetypes
+import os
+
+from pymongo.errors import PyMongoError
+
+from almacen_medios import ALMACEN_MEDIOS
+from catalogo_piezas import CATALOGO_PIEZAS, url_contenido
+from derivados import COLA_DERIVADOS, LISTO, TAMANOS_DERIVADOS, ruta_derivado
+from entrega_archivos import responder_archivo
 
 app = FastAPI(
     title="API de Piezas de Campañas",
@@ -16,35 +27,22 @@ class Pieza(BaseModel):
     url: str = Field(..., description="URL de la pieza")
     formato: str = Field(..., description="Formato de la pieza (jpg, mp4, etc.)")
     fecha_creacion: str = Field(..., description="Fecha de creación de la pieza (ISO)")
+    sha256: Optional[str] = Field(None, description="Hash del contenido, si la pieza está alojada en Inmax")
+    tamaño: Optional[int] = Field(None, description="Tamaño del archivo en bytes")
+    nombre_archivo: Optional[str] = Field(None, description="Nombre original del archivo subido")
+    estado_derivados: Optional[str] = Field(None, description="pendiente, procesando, listo o error (solo imágenes alojadas)")
+    derivados: Optional[Dict[str, str]] = Field(None, description="URL de cada versión reducida, cuando están listas")
 
-# ---------------------------------------------------
-PIEZAS_CAMPAÑAS = {
-    1: [
-        {
-            "pieza_id": 101,
-            "tipo": "imagen",
-            "url": "https://example.com/pieza101.jpg",
-            "formato": "jpg",
-            "fecha_creacion": "2025-06-01T10:00:00"
-        },
-        {
-            "pieza_id": 102,
-            "tipo": "video",
-            "url": "https://example.com/pieza102.mp4",
-            "formato": "mp4",
-            "fecha_creacion": "2025-06-02T12:00:00"
-        }
-    ],
-    2: [
-        {
-            "pieza_id": 201,
-            "tipo": "imagen",
-            "url": "https://example.com/pieza201.jpg",
-            "formato": "jpg",
-            "fecha_creacion": "2025-06-03T09:30:00"
-        }
-    ]
-}
+def _con_derivados(id: int, pieza: dict) -> dict:
+    if pieza["tipo"] != "imagen":
+        return pieza
+    estado = COLA_DERIVADOS.estado(pieza.get("sha256"))
+    if estado is None:
+        return pieza
+    derivados = None
+    if estado["estado"] == LISTO:
+        derivados = {nombre: url_contenido(id, pieza["pieza_id"], nombre) for nombre in TAMANOS_DERIVADOS}
+    return {**pieza, "estado_derivados": estado["estado"], "derivados": derivados}
 
 # ---------------------------------------------------
 
@@ -56,10 +54,14 @@ async def listar_piezas(
     """
     Retorna todas las piezas multimedia asociadas a una campaña específica.
     """
-    piezas = PIEZAS_CAMPAÑAS.get(id)
+    try:
+        piezas = await CATALOGO_PIEZAS.listar(id)
+    except PyMongoError:
+        logging.exception(f"No se pudieron leer las piezas de la campaña {id}")
+        raise HTTPException(status_code=503, detail="No se pudieron leer las piezas.")
     if piezas is None:
         raise HTTPException(status_code=404, detail="Campaña no encontrada o sin piezas.")
-    return piezas
+    return [_con_derivados(id, pieza) for pieza in piezas]
 
 # 30) GET /campañas/{id}/piezas/{pieza_id}
 @app.get("/campañas/{id}/piezas/{pieza_id}", response_model=Pieza, summary="Detalle de una pieza multimedia")
@@ -70,13 +72,52 @@ async def obtener_pieza(
     """
     Retorna el detalle de una pieza multimedia específica.
     """
-    piezas = PIEZAS_CAMPAÑAS.get(id)
-    if piezas is None:
+    try:
+        pieza = await CATALOGO_PIEZAS.obtener(id, pieza_id)
+        sin_piezas = pieza is None and await CATALOGO_PIEZAS.listar(id) is None
+    except PyMongoError:
+        logging.exception(f"No se pudo leer la pieza {pieza_id} de la campaña {id}")
+        raise HTTPException(status_code=503, detail="No se pudo leer la pieza.")
+    if sin_piezas:
         raise HTTPException(status_code=404, detail="Campaña no encontrada o sin piezas.")
-    for pieza in piezas:
-        if pieza["pieza_id"] == pieza_id:
-            return pieza
-    raise HTTPException(status_code=404, detail="Pieza no encontrada.")
+    if pieza is None:
+        raise HTTPException(status_code=404, detail="Pieza no encontrada.")
+    return _con_derivados(id, pieza)
+
+# Endpoint: GET|HEAD /campañas/{id}/piezas/{pieza_id}/contenido
+@app.api_route("/campañas/{id}/piezas/{pieza_id}/contenido", methods=["GET", "HEAD"], summary="Contenido de la pieza (admite Range, ETag y 304)")
+async def contenido_pieza(
+    request: Request,
+    id: int = Path(..., description="ID de la campaña"),
+    pieza_id: int = Path(..., description="ID de la pieza"),
+    derivado: Optional[str] = Query(None, description=f"Versión reducida: {', '.join(TAMANOS_DERIVADOS)}")
+):
+    try:
+        pieza = await CATALOGO_PIEZAS.obtener(id, pieza_id)
+    except PyMongoError:
+        logging.exception(f"No se pudo leer la pieza {pieza_id} de la campaña {id}")
+        raise HTTPException(status_code=503, detail="No se pudo leer la pieza.")
+    if pieza is None:
+        raise HTTPException(status_code=404, detail="Pieza no encontrada.")
+    sha256 = pieza.get("sha256")
+    if not sha256:
+        # Pieza alojada fuera de Inmax
+        return RedirectResponse(pieza["url"], status_code=307)
+
+    if derivado is None:
+        ruta = ALMACEN_MEDIOS.ruta_objeto(sha256)
+        etag = f'"{sha256}"'
+        tipo = pieza.get("tipo_contenido") or mimetypes.guess_type(f"x.{pieza['formato']}")[0] or "application/octet-stream"
+    elif derivado in TAMANOS_DERIVADOS:
+        ruta = ruta_derivado(sha256, derivado)
+        etag = f'"{sha256}-{derivado}"'
+        tipo = "image/webp"
+    else:
+        raise HTTPException(status_code=422, detail=f"Derivado desconocido: '{derivado}'.")
+
+    if not os.path.exists(ruta):
+        raise HTTPException(status_code=404, detail="Contenido no disponible.")
+    return responder_archivo(request, ruta, etag, tipo)
 
 # ---------------------------------------------------
 # Endpoint raíz de prueba
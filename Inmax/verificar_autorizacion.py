@@ -0,0 +1,71 @@
+"""
+Verifica que las rutas sensibles rechacen a quien no tiene el permiso.
+
+Reemplaza la validación del JWT por claims armados desde el encabezado
+X-Rol (sin Keycloak) y llama a cada app con TestClient. Los casos solo
+cubren rechazos, que se deciden antes de tocar Mongo u otros backends.
+Termina con código 1 si algún caso no responde lo esperado; pensado para
+correr en CI.
+
+Uso (desde Inmax/):
+    python verificar_autorizacion.py
+"""
+import importlib
+import sys
+
+from fastapi import HTTPException, Request
+from fastapi.testclient import TestClient
+
+import seguridad
+from autorizacion import PERMISOS_DISPONIBLES
+
+PERMISOS_TODOS = list(PERMISOS_DISPONIBLES)
+
+# (módulo, método, ruta, rol del token o None, cuerpo JSON, status esperado)
+CASOS = [
+    ("login", "PUT", "/auth/usuarios/alguien@inmax.cl/rol", None, {"rol": "Admin"}, 401),
+    ("login", "PUT", "/auth/usuarios/alguien@inmax.cl/rol", "Usuario", {"rol": "Admin"}, 403),
+    ("login", "PUT", "/auth/usuarios/alguien@inmax.cl/rol", "Usuario", {"rol": "Usuario"}, 403),
+    # Un Editor tiene "actualizar" pero no puede otorgar permisos que no tiene
+    ("login", "PUT", "/auth/usuarios/alguien@inmax.cl/rol", "Editor", {"rol": "Admin"}, 403),
+    # Cambiar destinatarios o disparar alertas envía correos, SMS y push reales
+    ("alerta", "PUT", "/avisador/alertas", None, {}, 401),
+    ("alerta", "PUT", "/avisador/alertas", "Usuario", {}, 403),
+    ("alerta", "POST", "/avisador/alertas/disparar-alerta", None, {}, 401),
+    ("alerta", "POST", "/avisador/alertas/disparar-alerta", "Usuario", {}, 403),
+    ("alerta", "POST", "/avisador/alertas/disparar-alerta", "Editor", {}, 403),
+    ("alerta", "PUT", "/avisador/campañas/estado", "Usuario", [], 403),
+    # Con "actualizar" un Editor podría reescribir su propio rol con todos los permisos
+    ("roles", "PUT", "/roles/2", "Editor", {"nombre": "Editor", "descripcion": "x", "permisos": PERMISOS_TODOS}, 403),
+    ("roles", "POST", "/roles", "Editor", {"nombre": "Otro", "descripcion": "x", "permisos": ["leer"]}, 403),
+    ("roles", "DELETE", "/roles/3", "Editor", None, 403),
+]
+
+
+async def claims_de_prueba(request: Request) -> dict:
+    rol = request.headers.get("X-Rol")
+    if rol is None:
+        raise HTTPException(status_code=401, detail="No autorizado. Token inválido o ausente.")
+    return {"sub": f"prueba-{rol}", "realm_access": {"roles": [rol]}}
+
+
+def main():
+    clientes = {}
+    fallas = 0
+    for modulo, metodo, ruta, rol, cuerpo, esperado in CASOS:
+        if modulo not in clientes:
+            app = importlib.import_module(modulo).app
+            app.dependency_overrides[seguridad.usuario_actual] = claims_de_prueba
+            clientes[modulo] = TestClient(app)
+        encabezados = {"X-Rol": rol} if rol else {}
+        respuesta = clientes[modulo].request(metodo, ruta, json=cuerpo, headers=encabezados)
+        ok = respuesta.status_code == esperado
+        fallas += not ok
+        print(f"{'ok   ' if ok else 'FALLA'} {metodo:<6} {ruta} rol={rol} -> {respuesta.status_code} (esperado {esperado})")
+    if fallas:
+        print(f"ERROR: {fallas} de {len(CASOS)} casos")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()